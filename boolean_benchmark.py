@@ -0,0 +1,104 @@
+"""
+My Own Search Engine project.
+This script compares the time of the evaluation of the boolean requests on
+the parse tree with their results as Python sets (Node.eval), on the plan
+with streams of document ids and on the plan with compressed bitmaps (see
+models/bitmap.py) on the CS276 index, checks that they give the same
+results, and compares the memory of the results as sets and as bitmaps.
+
+Usage:
+    boolean_benchmark.py [--queries=<filepath>] [--sample=<n>] [--terms=<n>] [--compact]
+    boolean_benchmark.py (-h | --help)
+
+Options:
+    -h --help                   Show this screen.
+    -q --queries=<filepath>     File with one boolean request per line, instead of random requests.
+    -s --sample=<n>             Number of random requests [default: 50].
+    -t --terms=<n>              Number of frequent terms of a random request [default: 4].
+    --compact                   Load the binary segment of the index in memory instead of reading it from disk.
+
+"""
+from docopt import docopt
+
+import random
+import sys
+from os import path
+from time import time
+
+from models.document import StanfordDocumentCollection
+from models.planner import QueryPlanner
+from models.request import BooleanRequest
+from models.reverse_index import StanfordReverseIndex
+
+
+def get_requests(reverse_index, sample, terms_number):
+    """Random requests mixing AND, OR and NOT over the most frequent terms"""
+    # the seed gives the same requests from one run to another
+    random.seed(0)
+    terms = sorted(reverse_index.keys(), key=reverse_index.get_frequence_col, reverse=True)[:100]
+    requests = []
+    for _ in range(sample):
+        request_terms = random.sample(terms, terms_number)
+        operator = random.choice([' || ', ' && ', ' && !'])
+        requests.append(request_terms[0] + ''.join(operator + term for term in request_terms[1:]))
+    return requests
+
+
+def set_size(document_ids):
+    """Size in bytes of a set of document ids and of its integers"""
+    return sys.getsizeof(document_ids) + sum(sys.getsizeof(document_id) for document_id in document_ids)
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+
+    print('Loading collection and index...')
+    collection = StanfordDocumentCollection()
+    collection.load_from_dir(path.join('Data', 'Collection', 'CS276'))
+    reverse_index = StanfordReverseIndex()
+    if args['--compact']:
+        reverse_index.load_compact()
+    else:
+        reverse_index.load_term_dictionary()
+        reverse_index.load_segment()
+    reverse_index.load_bitmaps()
+
+    if args['--queries']:
+        with open(args['--queries'], 'r') as queries_file:
+            requests = [line.strip() for line in queries_file if line.strip()]
+    else:
+        requests = get_requests(reverse_index, int(args['--sample']), int(args['--terms']))
+
+    durations = {'sets': 0, 'streams': 0, 'bitmaps': 0}
+    sizes = {'sets': 0, 'bitmaps': 0}
+    same_results = 0
+    boolean_request = BooleanRequest(reverse_index, collection)
+    for raw_request in requests:
+        # the requests are parsed and planned once, only their evaluation is timed
+        tree = boolean_request.parse_tree(raw_request)
+        plan = QueryPlanner(reverse_index).plan(tree)
+
+        start_time = time()
+        document_ids = tree.eval(reverse_index)
+        durations['sets'] += time() - start_time
+        sizes['sets'] += set_size(document_ids)
+
+        start_time = time()
+        stream = plan.stream(reverse_index)
+        durations['streams'] += time() - start_time
+
+        start_time = time()
+        bitmap = plan.bitmap(reverse_index)
+        durations['bitmaps'] += time() - start_time
+        sizes['bitmaps'] += bitmap.size()
+
+        same_results += sorted(map(int, document_ids)) == list(stream) == list(bitmap)
+
+    print('| Evaluation | Mean time per request (ms) | Mean size of the results (kB) |')
+    for name in ('sets', 'streams', 'bitmaps'):
+        print('| {} | {:.2f} | {} |'.format(
+            name,
+            durations[name] / len(requests) * 1000,
+            '{:.1f}'.format(sizes[name] / len(requests) / 1024) if name in sizes else '-'
+        ))
+    print('Same results: {}/{}'.format(same_results, len(requests)))
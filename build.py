@@ -1,10 +1,91 @@
+"""
+My Own Search Engine project.
+This script builds the CACM and CS276 collections and their reverse indexes.
+
+Usage:
+    build.py [--workers=<n>] [--reducers=<n>] [--strategy=<name>] [--max-postings=<n>]
+             [--codec=<name>] [--champions=<r>] [--bitmaps=<df>]
+    build.py (-h | --help)
+
+Options:
+    -h --help                   Show this screen.
+    -w --workers=<n>            Number of processes used to map the CS276 blocs [default: 1].
+    --reducers=<n>              Number of processes used to merge the CS276 partial indexes [default: 1].
+    -s --strategy=<name>        Index construction strategy, bsbi or spimi [default: bsbi].
+    --max-postings=<n>          Number of postings kept in memory by each mapper before writing a sorted run.
+    --codec=<name>              Codec of the posting lists: raw, vbyte, gamma, delta or packed [default: raw].
+    --champions=<r>             Write the champion list of the r best postings of each term, and report
+                                the recall of the champion lists on the CACM queries.
+    --bitmaps=<df>              Write the bitmaps of the documents of the terms found in at least df documents,
+                                used by the boolean requests evaluated with bitmaps.
+
+"""
+from docopt import docopt
+
 from models.document import CACMDocumentCollection, StanfordDocumentCollection
+from models.measure import recall
+from models.request import NumpyVectorialRequest, ChampionVectorialRequest
 from models.reverse_index import StanfordReverseIndex, CACMReverseIndex
 from os import path, listdir
 from datetime import datetime
+from time import time
+
+
+# number of results used to compare the champion lists with the full posting lists
+CHAMPIONS_RECALL_RESULTS = 10
+
+
+def report_champions_recall(reverse_index, collection, k):
+    """
+    Prints the recall@k on the CACM queries of the requests answered with the
+    champion lists and with the full posting lists, the share of the k best
+    documents found by both, and the mean time of a request.
+    """
+    # the posting lists are read from the segment rather than from the json index
+    reverse_index.load_segment()
+    relevant_document_dict = {}
+    with open(path.join('Data', 'CACM', 'qrels.text'), 'r') as qrels_file:
+        for line in qrels_file.read().split('\n')[:-1]:
+            id_request, id_document, _, _ = line.split()
+            relevant_document_dict.setdefault(str(int(id_request)), []).append(str(int(id_document)))
+    request_collection = CACMDocumentCollection(
+        source_data_filepath=path.join('Data', 'CACM', 'query.text'),
+        stop_list_filepath=path.join('Data', 'CACM', 'common_words'),
+        load_on_creation=True,
+    )
+
+    measures = {'full': [], 'champions': []}
+    durations = {'full': 0, 'champions': 0}
+    overlaps = []
+    for document in request_collection.values():
+        if document.id not in relevant_document_dict:
+            continue
+        raw_request = ' '.join(document.summary_tokenized)
+        found_documents = {}
+        for name, request_class in (('full', NumpyVectorialRequest), ('champions', ChampionVectorialRequest)):
+            start_time = time()
+            _, top_results = request_class(reverse_index, collection).return_top_results(raw_request, k)
+            durations[name] += time() - start_time
+            found_documents[name] = [doc_id for doc_id, _ in top_results]
+            if found_documents[name]:
+                measures[name].append(recall(relevant_document_dict[document.id], found_documents[name]))
+        if found_documents['full']:
+            overlaps.append(len(set(found_documents['full']) & set(found_documents['champions'])) / len(found_documents['full']))
+
+    requests_number = len(overlaps) or 1
+    print('| Posting lists | Recall@{} | Mean time per request (ms) |'.format(k))
+    for name in ('full', 'champions'):
+        print('| {} | {:.4f} | {:.2f} |'.format(
+            name,
+            sum(measures[name]) / (len(measures[name]) or 1),
+            durations[name] / requests_number * 1000
+        ))
+    print('Share of the {} best documents found with the champion lists: {:.4f}'.format(k, sum(overlaps) / requests_number))
 
 
 if __name__ == '__main__':
+    args = docopt(__doc__)
+
     begin = datetime.now()
     if 'cacm.collection' in listdir(path.join('Data', 'Collection')):
         cacm_document_collection = CACMDocumentCollection()
@@ -18,8 +99,20 @@ if __name__ == '__main__':
         cacm_document_collection.save(path.join('Data', 'Collection', 'cacm.collection'))
 
     print("======= Loading collection time : ", datetime.now() - begin, " =======")
-    cacm_reverse_index = CACMReverseIndex(cacm_document_collection)
+    max_postings = int(args['--max-postings']) if args['--max-postings'] else None
+    champions = int(args['--champions']) if args['--champions'] else None
+    bitmaps = int(args['--bitmaps']) if args['--bitmaps'] else None
+    cacm_reverse_index = CACMReverseIndex(
+        cacm_document_collection,
+        strategy=args['--strategy'],
+        max_postings=max_postings,
+        codec=args['--codec'],
+        champions=champions,
+        bitmaps=bitmaps,
+    )
     print("======= Total building time : ", datetime.now() - begin, " =======")
+    if champions:
+        report_champions_recall(cacm_reverse_index, cacm_document_collection, CHAMPIONS_RECALL_RESULTS)
 
     begin = datetime.now()
     if listdir(path.join('Data', 'Collection', 'CS276')):
@@ -33,5 +126,14 @@ if __name__ == '__main__':
         stanford_document_collection.save(path.join('Data', 'Collection', 'CS276'))
 
     print("======= Loading collection time : ", datetime.now() - begin, " =======")
-    stanford_reverse_index = StanfordReverseIndex(stanford_document_collection)
+    stanford_reverse_index = StanfordReverseIndex(
+        stanford_document_collection,
+        workers=int(args['--workers']),
+        reducers=int(args['--reducers']),
+        strategy=args['--strategy'],
+        max_postings=max_postings,
+        codec=args['--codec'],
+        champions=champions,
+        bitmaps=bitmaps,
+    )
     print("======= Total building time : ", datetime.now() - begin, " =======")
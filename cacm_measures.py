@@ -79,6 +79,7 @@ if __name__ == '__main__':
     if 'cacm.index' in listdir(path.join('Data', 'Index')):
         index = CACMReverseIndex()
         index.load_from_file(path.join('Data', 'Index', 'cacm.index'))
+        index.load_statistics()
     else:
         index = CACMReverseIndex(document_collection=collection)
 
@@ -0,0 +1,81 @@
+"""
+My Own Search Engine project.
+This script compares the posting list codecs on the CACM and CS276 indexes:
+size of the encoded posting lists in bytes per posting, and decoding throughput.
+
+Usage:
+    codec_benchmark.py [--sample=<n>] [--codecs=<names>]
+    codec_benchmark.py (-h | --help)
+
+Options:
+    -h --help                   Show this screen.
+    -s --sample=<n>             Only use one term out of n of each index [default: 1].
+    -c --codecs=<names>         Comma separated names of the codecs to compare [default: raw,vbyte,gamma,delta,packed].
+
+"""
+from docopt import docopt
+
+import json
+from os import path, listdir
+from time import time
+
+from models.codec import get_codec
+
+
+def load_posting_lists(index_filepath, sample):
+    posting_lists = []
+    with open(index_filepath, 'r') as index_file:
+        for line_number, line in enumerate(index_file):
+            if line_number % sample:
+                continue
+            # entry is like (term_id, [frequence_col, [(document_id, frequence_doc)...]])
+            postings = sorted((int(document_id), frequence) for document_id, frequence in json.loads(line)[1][1])
+            posting_lists.append((
+                [document_id for document_id, _ in postings],
+                [frequence for _, frequence in postings]
+            ))
+    return posting_lists
+
+
+def get_measures(posting_lists, codec):
+    print('Encoding posting lists with codec {}...'.format(codec.name))
+    encoded = [
+        (codec.encode(document_ids, frequences), len(document_ids))
+        for document_ids, frequences in posting_lists
+    ]
+    postings_number = sum(postings_number for _, postings_number in encoded)
+    bytes_number = sum(len(data) for data, _ in encoded)
+
+    start_time = time()
+    for data, postings_number_of_term in encoded:
+        codec.decode(data, postings_number_of_term)
+    duration = time() - start_time
+
+    return {
+        'bytes_per_posting': bytes_number / postings_number,
+        'postings_per_second': postings_number / duration,
+        'megabytes_per_second': bytes_number / duration / 1024 / 1024,
+    }
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    codecs = [get_codec(name) for name in args['--codecs'].split(',')]
+
+    for name in ('cacm', 'cs276'):
+        if '{}.index'.format(name) not in listdir(path.join('Data', 'Index')):
+            print('No index found for {}, run build.py first.'.format(name))
+            continue
+
+        print('Loading posting lists of {}...'.format(name))
+        posting_lists = load_posting_lists(path.join('Data', 'Index', name + '.index'), int(args['--sample']))
+        measures_by_codec = {codec.name: get_measures(posting_lists, codec) for codec in codecs}
+
+        print('| {} | Bytes per posting | Decoded postings per second | Decoded MB per second |'.format(name))
+        for codec_name, measures in measures_by_codec.items():
+            print('| {} | {:.2f} | {:.0f} | {:.2f} |'.format(
+                codec_name,
+                measures['bytes_per_posting'],
+                measures['postings_per_second'],
+                measures['megabytes_per_second'],
+            ))
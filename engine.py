@@ -1,14 +1,55 @@
 """
 My Own Search Engine project.
-This is the CLI engine for searching in CACM and CS276 collections.
+This is the CLI engine for searching in CACM and CS276 collections. With the
+serve command, the collection and the index are loaded once and the requests
+are answered by an HTTP/JSON server (see models/server.py). With the batch
+command, a file of requests is answered by a pool of processes and written as
+a TREC run file (see models/batch.py).
 
 Usage:
     engine.py cacm (vectorial | boolean) <request> [--collection=<filepath>]
-                                                   [--index=<filepath>]
+                                                   [--index=<filepath> | --compact]
                                                    [--results=<len>]
+                                                   [--scorer=<name>]
+                                                   [--explain]
+                                                   [--evaluation=<name>]
+                                                   [--workers=<n>]
     engine.py cs276 (vectorial | boolean) <request> [--collection=<filepath>]
-                                                    [--index=<filepath>]
+                                                    [--index=<filepath> | --compact]
                                                     [--results=<len>]
+                                                    [--scorer=<name>]
+                                                    [--explain]
+                                                    [--evaluation=<name>]
+                                                    [--workers=<n>]
+                                                    [--reducers=<n>]
+                                                    [--strategy=<name>]
+                                                    [--max-postings=<n>]
+                                                    [--codec=<name>]
+    engine.py serve (cacm | cs276) [--collection=<filepath>]
+                                   [--index=<filepath> | --compact]
+                                   [--host=<host>]
+                                   [--port=<port> | --socket=<filepath>]
+                                   [--results=<len>]
+                                   [--scorer=<name>]
+                                   [--evaluation=<name>]
+                                   [--threads=<n>]
+                                   [--query-cache=<MB>]
+                                   [--cache=<MB>]
+                                   [--cache-policy=<name>]
+                                   [--warmup=<filepath>]
+                                   [--workers=<n>]
+    engine.py batch (cacm | cs276) (vectorial | boolean) <queries> <run> [--collection=<filepath>]
+                                                                         [--index=<filepath> | --compact]
+                                                                         [--results=<len>]
+                                                                         [--scorer=<name>]
+                                                                         [--evaluation=<name>]
+                                                                         [--processes=<n>]
+                                                                         [--tag=<name>]
+                                                                         [--query-cache=<MB>]
+                                                                         [--cache=<MB>]
+                                                                         [--cache-policy=<name>]
+                                                                         [--warmup=<filepath>]
+                                                                         [--workers=<n>]
     engine.py (-h | --help)
     engine.py --version
 
@@ -16,10 +57,37 @@ General options:
     -h --help                   Show this screen.
     --version                   Show version.
     -r --results=<len>          Number of results to display [default: 10].
+    --scorer=<name>             Scorer of the vectorial requests: python, numpy, maxscore or champions [default: numpy].
+    --explain                   Print the plan of a boolean request with its estimated costs.
+    --evaluation=<name>         Evaluation of the boolean requests: streams or bitmaps [default: streams].
+    --query-cache=<MB>          Memory budget in MB of the cached AND / OR results of the boolean requests, 0 to disable [default: 0].
+    -w --workers=<n>            Number of processes used to build the index, or to load the index file [default: 1].
+
+Options for the server:
+    --host=<host>               Address of the HTTP server [default: 127.0.0.1].
+    -p --port=<port>            Port of the HTTP server [default: 8080].
+    --socket=<filepath>         Serve on the given Unix socket instead of a TCP port.
+    --threads=<n>               Number of threads evaluating the requests at once [default: 4].
+
+Options for the posting lists cache, when the index is read from disk:
+    --cache=<MB>                Memory budget in MB of the cache of the posting lists read from disk, 0 to disable [default: 0].
+    --cache-policy=<name>       Eviction policy of the posting lists cache: lru or lfu [default: lru].
+    --warmup=<filepath>         Requests file, in the format of the batch mode, whose most frequent terms are cached at startup.
+
+Options for the batch mode:
+    --processes=<n>             Number of processes answering the requests [default: 1].
+    --tag=<name>                Name of the run, written in the last column of the run file [default: mose].
 
 Options for CACM collection:
     -c --collection=<filepath>  Use the given collection file instead of creating it.
     -i --index=<filepath>       Use the given index file instead of creating it.
+    --compact                   Load the binary segment of the index in memory in compact arrays.
+
+Options for CS276 index creation:
+    --reducers=<n>              Number of processes used to merge the partial indexes [default: 1].
+    -s --strategy=<name>        Index construction strategy, bsbi or spimi [default: bsbi].
+    --max-postings=<n>          Number of postings kept in memory by each mapper before writing a sorted run.
+    --codec=<name>              Codec of the posting lists: raw, vbyte, gamma, delta or packed [default: raw].
 
 """
 from docopt import docopt
@@ -27,14 +95,39 @@ from docopt import docopt
 from time import time
 from os import path, listdir
 
+from models.batch import read_queries, run_batch
+from models.cache import QueryCache
 from models.document import CACMDocumentCollection, StanfordDocumentCollection
-from models.request import BooleanRequest, VectorialRequest
+from models.request import (
+    BooleanRequest,
+    BitmapBooleanRequest,
+    VectorialRequest,
+    NumpyVectorialRequest,
+    MaxScoreVectorialRequest,
+    ChampionVectorialRequest,
+)
 from models.reverse_index import StanfordReverseIndex, CACMReverseIndex
+from models.server import QueryServer
 
 
-if __name__ == '__main__':
-    args = docopt(__doc__, version='My Own Search Engine 0.2')
+VECTORIAL_SCORERS = {
+    'python': VectorialRequest,
+    'numpy': NumpyVectorialRequest,
+    'maxscore': MaxScoreVectorialRequest,
+    'champions': ChampionVectorialRequest,
+}
+
+BOOLEAN_EVALUATIONS = {
+    'streams': BooleanRequest,
+    'bitmaps': BitmapBooleanRequest,
+}
 
+
+def load_collection_and_index(args):
+    """
+    Loads the collection and the reverse index given by the arguments, or
+    builds them if they have not been saved yet.
+    """
     start_time = time()
     if args['cacm']:
         if args['--collection']:
@@ -68,21 +161,29 @@ if __name__ == '__main__':
         start_time = time()
         if args['--index']:
             reverse_index = CACMReverseIndex()
-            reverse_index.load_from_file(args['--index'])
+            reverse_index.load_from_file(args['--index'], workers=int(args['--workers']))
             duration = (time() - start_time) * 1000
             print('Index has been loaded from file {} in {:.2f} milliseconds.'.format(
                 args['--index'],
                 duration
             ))
+        elif args['--compact']:
+            reverse_index = CACMReverseIndex()
+            reverse_index.load_compact()
+            duration = (time() - start_time) * 1000
+            print('Index has been loaded in compact form in {:.2f} milliseconds.'.format(duration))
         else:
-            if 'cacm.hash' in listdir(path.join('Data', 'Index')):
-                print('Using default Hash Table {} for index...'.format(
-                    path.join('Data', 'Index', 'cacm.hash')
+            index_files = listdir(path.join('Data', 'Index'))
+            if 'cacm.terms' in index_files or 'cacm.hash' in index_files:
+                print('Using default term dictionary {} for index...'.format(
+                    path.join('Data', 'Index', 'cacm.terms' if 'cacm.terms' in index_files else 'cacm.hash')
                 ))
                 reverse_index = CACMReverseIndex()
-                reverse_index.load_hash_table()
+                reverse_index.load_term_dictionary()
+                if 'cacm.offsets' in index_files:
+                    reverse_index.load_segment()
                 duration = (time() - start_time) * 1000
-                print('Hash Table has been loaded in {:.2f} milliseconds.'.format(duration))
+                print('Term dictionary has been loaded in {:.2f} milliseconds.'.format(duration))
             else:
                 print('No default index found, building it...')
                 reverse_index = CACMReverseIndex(document_collection=collection)
@@ -121,46 +222,146 @@ if __name__ == '__main__':
         start_time = time()
         if args['--index']:
             reverse_index = StanfordReverseIndex()
-            reverse_index.load_from_file(args['--index'])
+            reverse_index.load_from_file(args['--index'], workers=int(args['--workers']))
             duration = (time() - start_time) * 1000
             print('Index has been loaded from file {} in {:.2f} milliseconds.'.format(
                 args['--index'],
                 duration
             ))
+        elif args['--compact']:
+            reverse_index = StanfordReverseIndex()
+            reverse_index.load_compact()
+            duration = (time() - start_time) * 1000
+            print('Index has been loaded in compact form in {:.2f} milliseconds.'.format(duration))
         else:
-            if 'cs276.hash' in listdir(path.join('Data', 'Index')):
-                print('Using default Hash Table {} for index...'.format(
-                    path.join('Data', 'Index', 'cs276.hash')
+            index_files = listdir(path.join('Data', 'Index'))
+            if 'cs276.terms' in index_files or 'cs276.hash' in index_files:
+                print('Using default term dictionary {} for index...'.format(
+                    path.join('Data', 'Index', 'cs276.terms' if 'cs276.terms' in index_files else 'cs276.hash')
                 ))
                 reverse_index = StanfordReverseIndex()
-                reverse_index.load_hash_table()
+                reverse_index.load_term_dictionary()
+                if 'cs276.offsets' in index_files:
+                    reverse_index.load_segment()
                 duration = (time() - start_time) * 1000
-                print('Hash Table has been loaded from file in {:.2f} milliseconds.'.format(
+                print('Term dictionary has been loaded from file in {:.2f} milliseconds.'.format(
                     duration
                 ))
             else:
-                print('No default Hash Table found, building index...')
-                reverse_index = StanfordReverseIndex(collection)
+                print('No default term dictionary found, building index...')
+                reverse_index = StanfordReverseIndex(
+                    collection,
+                    workers=int(args['--workers']),
+                    reducers=int(args['--reducers']),
+                    strategy=args['--strategy'],
+                    max_postings=int(args['--max-postings']) if args['--max-postings'] else None,
+                    codec=args['--codec'],
+                )
                 duration = time() - start_time
                 print('Index has been creadted in {:.2f} seconds.'.format(duration))
                 reverse_index.save(path.join('Data', 'Index', 'cs276.index'))
 
+    if reverse_index.statistics is None:
+        reverse_index.load_statistics()
+    if args['--scorer'] == 'champions' and reverse_index.champion_lists is None:
+        reverse_index.load_champions()
+        if reverse_index.champion_lists is None:
+            print('No champion lists found for this index (see build.py --champions), the full posting lists are scored.')
+    if args['--evaluation'] == 'bitmaps' and reverse_index.term_bitmaps is None:
+        reverse_index.load_bitmaps()
+    if int(args['--cache']) and not reverse_index.index_in_memory:
+        reverse_index.cache_postings(int(args['--cache']) * 1024 * 1024, args['--cache-policy'])
+        if args['--warmup']:
+            start_time = time()
+            loaded = reverse_index.warm_up(raw_request for _, raw_request in read_queries(args['--warmup']))
+            print('{} posting lists have been cached in {:.2f} seconds.'.format(loaded, time() - start_time))
+    return collection, reverse_index
+
+
+def run_request(args, reverse_index, collection):
     start_time = time()
-    request = (
-        VectorialRequest(reverse_index, collection)
-        if args['vectorial']
-        else BooleanRequest(reverse_index, collection)
-    )
-    results = request.return_results(args['<request>'])
+    if args['vectorial']:
+        # only the displayed results are selected from the scores
+        vectorial_request_class = VECTORIAL_SCORERS[args['--scorer']]
+        results_number, top_results = vectorial_request_class(reverse_index, collection).return_top_results(
+            args['<request>'],
+            int(args['--results'])
+        )
+        results = [doc_id for doc_id, _ in top_results]
+        if not vectorial_request_class.exact_results_number:
+            results_number = 'at least {}'.format(results_number)
+    else:
+        boolean_request = BOOLEAN_EVALUATIONS[args['--evaluation']](reverse_index, collection)
+        plan = boolean_request.parse_request(args['<request>'])
+        results = boolean_request.find_results(plan)
+        results_number = len(results)
+        if args['--explain']:
+            print('\n'.join(plan.explain()))
     duration = time() - start_time
 
     if args['cacm']:
-        print('We have found {} results in {:.2f} milliseconds.'.format(
-            len(results),
+        print('We have found {} results in {:.2f} milliseconds.'.format(
+            results_number,
             duration * 1000
         ))
     elif args['cs276']:
-        print('We have found {} results in {:.2f} seconds.'.format(len(results), duration))
+        print('We have found {} results in {:.2f} seconds.'.format(results_number, duration))
 
     for result in results[:int(args['--results'])]:
         print(collection[result])
+
+
+def get_query_cache(args):
+    budget = int(args['--query-cache'])
+    return QueryCache(results_budget=budget * 1024 * 1024) if budget else None
+
+
+def run_batch_file(args, reverse_index, collection):
+    queries = read_queries(args['<queries>'])
+    if args['vectorial']:
+        request_class = VECTORIAL_SCORERS[args['--scorer']]
+    else:
+        request_class = BOOLEAN_EVALUATIONS[args['--evaluation']]
+    queries_number, invalid_queries, duration = run_batch(
+        queries,
+        args['<run>'],
+        request_class,
+        reverse_index,
+        collection,
+        results=int(args['--results']),
+        vectorial=args['vectorial'],
+        processes=int(args['--processes']),
+        tag=args['--tag'],
+        query_cache=get_query_cache(args),
+    )
+    print('{} requests have been answered in {:.2f} seconds ({:.1f} requests per second), {} invalid requests.'.format(
+        queries_number,
+        duration,
+        queries_number / duration if duration else 0,
+        invalid_queries
+    ))
+    print('Run has been written to {}.'.format(args['<run>']))
+    if reverse_index.postings_cache is not None and int(args['--processes']) == 1:
+        print('Posting lists cache: {hits} hits, {misses} misses, {postings_lists} posting lists in {size} bytes.'.format(
+            **reverse_index.postings_cache.stats()
+        ))
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__, version='My Own Search Engine 0.2')
+
+    collection, reverse_index = load_collection_and_index(args)
+    if args['serve']:
+        QueryServer(
+            reverse_index,
+            collection,
+            vectorial_request_class=VECTORIAL_SCORERS[args['--scorer']],
+            boolean_request_class=BOOLEAN_EVALUATIONS[args['--evaluation']],
+            results=int(args['--results']),
+            threads=int(args['--threads']),
+            query_cache=get_query_cache(args),
+        ).serve(args['--host'], int(args['--port']), args['--socket'])
+    elif args['batch']:
+        run_batch_file(args, reverse_index, collection)
+    else:
+        run_request(args, reverse_index, collection)
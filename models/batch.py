@@ -0,0 +1,117 @@
+"""
+This file defines the batch mode of the search engine: a file of requests is
+answered by a pool of processes and the results are written as a TREC run
+file, one line per result:
+    query_id Q0 document_id rank score tag
+
+The collection and the reverse index are loaded once before the pool is
+created: the processes are forked from the loaded process and share its
+memory (and the mmap of the segment files) instead of loading the index
+again.
+
+The requests file is either in the CACM query.text format (.I and .W
+fields), the requests being the tokens of the .W field as in
+cacm_measures.py, or a text file with one request per line, the id of a
+request being its line number.
+"""
+import multiprocessing
+from os import path
+from time import time
+
+from models.document import CACMDocumentCollection
+from models.parser import ParsingError
+
+
+# state of the forked processes, set before the pool is created
+_batch = {}
+
+
+def read_queries(filepath):
+    """Returns the [(query_id, raw_request)...] of a requests file"""
+    with open(filepath, 'r') as queries_file:
+        lines = queries_file.read().split('\n')
+    if lines[0].startswith('.I'):
+        request_collection = CACMDocumentCollection(
+            source_data_filepath=filepath,
+            stop_list_filepath=path.join('Data', 'CACM', 'common_words'),
+            load_on_creation=True,
+        )
+        return [
+            (document.id, ' '.join(document.summary_tokenized))
+            for document in request_collection.values()
+        ]
+    return [
+        (str(line_number), line.strip())
+        for line_number, line in enumerate(lines, 1)
+        if line.strip()
+    ]
+
+
+def answer_query(query):
+    """
+    Answers one (query_id, raw_request) with the request class of the batch.
+    + returns:
+        (query_id, [(document_id, score)...]), or (query_id, None) if the
+        request is not valid
+    """
+    query_id, raw_request = query
+    request, results, vectorial = _batch['request'], _batch['results'], _batch['vectorial']
+    try:
+        _, top_results = request.search(raw_request, results)
+    except (KeyError, ParsingError):
+        return query_id, None
+    if not vectorial:
+        # the boolean results are not scored, the score gives their rank
+        top_results = [(document_id, 1 / rank) for rank, (document_id, _) in enumerate(top_results, 1)]
+    return query_id, top_results
+
+
+def run_batch(queries, run_filepath, request_class, reverse_index, collection, results=1000,
+              vectorial=True, processes=1, tag='mose', query_cache=None):
+    """
+    Answers the queries with a pool of processes and writes the TREC run
+    file as the results arrive, in the order of the queries.
+    + params:
+        - queries: [(query_id, raw_request)...], see read_queries
+        - run_filepath: path of the TREC run file
+        - request_class: Request class answering the queries
+        - results: max number of results written per query
+        - vectorial: True for the vectorial requests, False for the boolean
+        ones whose score is 1 / rank
+        - processes: number of processes of the pool, the queries are
+        answered in this process if 1
+        - tag: name of the run, last column of the run file
+        - query_cache: QueryCache of the boolean requests (see
+        models/cache.py), copied by each process of the pool
+    + return:
+        (number of queries answered, number of invalid queries, duration in seconds)
+    """
+    _batch.update(
+        request=request_class(reverse_index, collection) if vectorial else
+        request_class(reverse_index, collection, cache=query_cache),
+        results=results,
+        vectorial=vectorial,
+    )
+    start_time = time()
+    invalid_queries = 0
+    pool = None
+    if processes > 1:
+        # the processes are forked after the index has been loaded
+        pool = multiprocessing.get_context('fork').Pool(processes)
+        answers = pool.imap(answer_query, queries, chunksize=max(1, len(queries) // (processes * 8)))
+    else:
+        answers = map(answer_query, queries)
+
+    try:
+        with open(run_filepath, 'w') as run_file:
+            for query_id, top_results in answers:
+                if top_results is None:
+                    invalid_queries += 1
+                    continue
+                for rank, (document_id, score) in enumerate(top_results, 1):
+                    run_file.write('{} Q0 {} {} {:.6f} {}\n'.format(query_id, document_id, rank, score, tag))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return len(queries), invalid_queries, time() - start_time
@@ -0,0 +1,418 @@
+"""
+This file defines a compressed bitmap of document ids, in the way of the
+Roaring bitmaps, used to evaluate the boolean requests with set operations
+on packed integers instead of Python sets of ids.
+
+The 32 bits document ids are split in chunks of 65536 ids sharing their 16
+high bits. Each chunk stores its 16 low bits in the smallest of three
+containers:
+    - ArrayContainer: a sorted array of the ids, for at most 4096 ids
+    - BitmapContainer: a bitmap of 65536 bits (8 kB), for the dense chunks
+    - RunContainer: the runs of consecutive ids, e.g. for the universe of
+    an index
+
+The terms with a large frequence_col can have their bitmaps written when the
+index is built (see TermBitmapsWriter), in a single file:
+    - a header: (magic, version, min frequence_col, number of bitmaps)
+    - a fixed-width table containing one record per bitmap: (term_id, offset
+    of the bitmap in the file, length in bytes)
+    - the bitmaps, written by RoaringBitmap.to_bytes
+"""
+import json
+import mmap
+import struct
+
+import numpy as np
+
+
+# max number of ids of an array container, an array container is then
+# smaller than a bitmap container
+ARRAY_MAX_SIZE = 4096
+BITMAP_BYTES = 8192
+POPCOUNT = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.int64)
+
+MAGIC = b'MOBM'
+VERSION = 1
+# magic, version, min frequence_col, number of bitmaps
+HEADER = struct.Struct('<4sHII')
+# term_id, bitmap offset, bitmap length in bytes
+RECORD = struct.Struct('<IQI')
+# number of containers
+BITMAP_HEADER = struct.Struct('<I')
+# 16 high bits, container type, number of values
+CONTAINER_HEADER = struct.Struct('<HBI')
+
+
+class ArrayContainer(object):
+    """The sorted 16 low bits of the ids of a chunk."""
+    __slots__ = ('values',)
+    type_id = 0
+
+    def __init__(self, values):
+        self.values = values
+
+    def __len__(self):
+        return len(self.values)
+
+    def to_array(self):
+        return self.values
+
+    def to_bitmap(self):
+        bits = np.zeros(65536, dtype=bool)
+        bits[self.values] = True
+        return np.packbits(bits)
+
+    def contains(self, values):
+        """Returns the mask of the values found in the container"""
+        positions = np.searchsorted(self.values, values)
+        found = positions < len(self.values)
+        found[found] = self.values[positions[found]] == values[found]
+        return found
+
+    def size(self):
+        return 2 * len(self.values)
+
+
+class BitmapContainer(object):
+    """A bitmap of the 65536 ids of a chunk, packed in 8192 bytes."""
+    __slots__ = ('bitmap', 'cardinality')
+    type_id = 1
+
+    def __init__(self, bitmap, cardinality=None):
+        self.bitmap = bitmap
+        self.cardinality = int(POPCOUNT[bitmap].sum()) if cardinality is None else cardinality
+
+    def __len__(self):
+        return self.cardinality
+
+    def to_array(self):
+        return np.flatnonzero(np.unpackbits(self.bitmap)).astype(np.uint16)
+
+    def to_bitmap(self):
+        return self.bitmap
+
+    def contains(self, values):
+        values = values.astype(np.int64)
+        return ((self.bitmap[values >> 3] >> (7 - (values & 7))) & 1).astype(bool)
+
+    def size(self):
+        return BITMAP_BYTES
+
+
+class RunContainer(object):
+    """The runs [start, start + length] of consecutive ids of a chunk."""
+    __slots__ = ('starts', 'lengths')
+    type_id = 2
+
+    def __init__(self, starts, lengths):
+        self.starts = starts
+        self.lengths = lengths
+
+    def __len__(self):
+        return int(self.lengths.astype(np.int64).sum()) + len(self.lengths)
+
+    def to_array(self):
+        if not len(self.starts):
+            return np.zeros(0, dtype=np.uint16)
+        return np.concatenate([
+            np.arange(start, start + length + 1, dtype=np.uint16)
+            for start, length in zip(self.starts.tolist(), self.lengths.tolist())
+        ])
+
+    def to_bitmap(self):
+        bits = np.zeros(65536, dtype=bool)
+        for start, length in zip(self.starts.tolist(), self.lengths.tolist()):
+            bits[start:start + length + 1] = True
+        return np.packbits(bits)
+
+    def contains(self, values):
+        values = values.astype(np.int64)
+        runs = np.searchsorted(self.starts, values, side='right') - 1
+        found = runs >= 0
+        runs[~found] = 0
+        return found & (values <= self.starts[runs].astype(np.int64) + self.lengths[runs])
+
+    def size(self):
+        return 4 * len(self.starts)
+
+
+CONTAINER_TYPES = (ArrayContainer, BitmapContainer, RunContainer)
+
+
+def container_from_array(values):
+    """Returns the container of sorted 16 bits values, None if it is empty"""
+    if not len(values):
+        return None
+    if len(values) <= ARRAY_MAX_SIZE:
+        return ArrayContainer(values)
+    bits = np.zeros(65536, dtype=bool)
+    bits[values] = True
+    return BitmapContainer(np.packbits(bits), len(values))
+
+
+def container_from_bitmap(bitmap):
+    """Returns the container of a packed bitmap, None if it is empty"""
+    container = BitmapContainer(bitmap)
+    if not container.cardinality:
+        return None
+    if container.cardinality <= ARRAY_MAX_SIZE:
+        return ArrayContainer(container.to_array())
+    return container
+
+
+def run_container(values):
+    """Returns the RunContainer of sorted 16 bits values"""
+    values = values.astype(np.int64)
+    breaks = np.flatnonzero(np.diff(values) != 1)
+    starts = values[np.concatenate(([0], breaks + 1))]
+    ends = values[np.concatenate((breaks, [len(values) - 1]))]
+    return RunContainer(starts.astype(np.uint16), (ends - starts).astype(np.uint16))
+
+
+def intersect_containers(container, other):
+    if isinstance(other, ArrayContainer) and not isinstance(container, ArrayContainer):
+        container, other = other, container
+    if isinstance(container, ArrayContainer):
+        if isinstance(other, ArrayContainer):
+            values = np.intersect1d(container.values, other.values, assume_unique=True)
+        else:
+            values = container.values[other.contains(container.values)]
+        return ArrayContainer(values) if len(values) else None
+    return container_from_bitmap(container.to_bitmap() & other.to_bitmap())
+
+
+def unite_containers(container, other):
+    if isinstance(container, ArrayContainer) and isinstance(other, ArrayContainer):
+        # merge of the two sorted arrays, faster than np.union1d
+        values = np.concatenate((container.values, other.values))
+        values.sort(kind='mergesort')
+        return container_from_array(values[np.concatenate(([True], values[1:] != values[:-1]))])
+    return container_from_bitmap(container.to_bitmap() | other.to_bitmap())
+
+
+def subtract_containers(container, other):
+    if isinstance(container, ArrayContainer):
+        values = container.values[~other.contains(container.values)]
+        return ArrayContainer(values) if len(values) else None
+    return container_from_bitmap(container.to_bitmap() & ~other.to_bitmap())
+
+
+class RoaringBitmap(object):
+    """
+    This class contains a set of 32 bits integer document ids.
+    + attributes:
+        - containers: {16 high bits: container of the 16 low bits}
+    + core methods:
+        - from_sorted, from_ranges: build a bitmap from sorted ids or from
+        [start, end) ranges of ids
+        - run_optimize: use run containers where they are the smallest
+        - to_bytes, from_bytes: serialize the bitmap
+        - size: size of the containers in bytes
+    + wrapping methods:
+        - & (AND), | (OR), - (ANDNOT), __len__ (cardinality), __iter__ and
+        __contains__, as for a set
+    """
+
+    def __init__(self, containers=None):
+        self.containers = containers or {}
+
+    @staticmethod
+    def from_sorted(document_ids):
+        """Builds the bitmap of sorted and distinct integer ids"""
+        document_ids = np.asarray(document_ids, dtype=np.uint32)
+        if not len(document_ids):
+            return RoaringBitmap()
+        highs = document_ids >> 16
+        boundaries = np.flatnonzero(np.diff(highs)) + 1
+        starts = np.concatenate(([0], boundaries))
+        ends = np.concatenate((boundaries, [len(document_ids)]))
+        return RoaringBitmap({
+            int(highs[start]): container_from_array((document_ids[start:end] & 0xffff).astype(np.uint16))
+            for start, end in zip(starts.tolist(), ends.tolist())
+        })
+
+    @staticmethod
+    def from_ranges(ranges):
+        """Builds the bitmap of the ids of sorted [start, end) ranges with run containers"""
+        runs = {}
+        for start, end in ranges:
+            while start < end:
+                high = start >> 16
+                chunk_end = min(end, (high + 1) << 16)
+                runs.setdefault(high, []).append((start & 0xffff, chunk_end - start - 1))
+                start = chunk_end
+        return RoaringBitmap({
+            high: RunContainer(
+                np.array([start for start, _ in chunk_runs], dtype=np.uint16),
+                np.array([length for _, length in chunk_runs], dtype=np.uint16)
+            )
+            for high, chunk_runs in runs.items()
+        })
+
+    def run_optimize(self):
+        """Replaces the containers by run containers when they are smaller, returns self"""
+        for high, container in self.containers.items():
+            runs = run_container(container.to_array())
+            if runs.size() < container.size():
+                self.containers[high] = runs
+        return self
+
+    def _combine(self, other, highs, combine_containers):
+        containers = {}
+        for high in highs:
+            container = combine_containers(self.containers[high], other.containers[high])
+            if container is not None:
+                containers[high] = container
+        return RoaringBitmap(containers)
+
+    def __and__(self, other):
+        return self._combine(other, self.containers.keys() & other.containers.keys(), intersect_containers)
+
+    def __or__(self, other):
+        containers = dict(self.containers)
+        containers.update((high, container) for high, container in other.containers.items() if high not in self.containers)
+        result = self._combine(other, self.containers.keys() & other.containers.keys(), unite_containers)
+        containers.update(result.containers)
+        return RoaringBitmap(containers)
+
+    def __sub__(self, other):
+        """ANDNOT: the ids of self which are not in other"""
+        containers = {
+            high: container
+            for high, container in self.containers.items()
+            if high not in other.containers
+        }
+        result = self._combine(other, self.containers.keys() & other.containers.keys(), subtract_containers)
+        containers.update(result.containers)
+        return RoaringBitmap(containers)
+
+    def __len__(self):
+        return sum(len(container) for container in self.containers.values())
+
+    def __iter__(self):
+        for high in sorted(self.containers):
+            yield from ((high << 16) + self.containers[high].to_array().astype(np.int64)).tolist()
+
+    def __contains__(self, document_id):
+        container = self.containers.get(document_id >> 16)
+        return container is not None and bool(container.contains(np.array([document_id & 0xffff]))[0])
+
+    def size(self):
+        return sum(container.size() for container in self.containers.values())
+
+    def to_bytes(self):
+        data = bytearray(BITMAP_HEADER.pack(len(self.containers)))
+        for high in sorted(self.containers):
+            container = self.containers[high]
+            if isinstance(container, RunContainer):
+                data.extend(CONTAINER_HEADER.pack(high, container.type_id, len(container.starts)))
+                data.extend(np.stack((container.starts, container.lengths), axis=1).astype('<u2').tobytes())
+            elif isinstance(container, BitmapContainer):
+                data.extend(CONTAINER_HEADER.pack(high, container.type_id, container.cardinality))
+                data.extend(container.bitmap.tobytes())
+            else:
+                data.extend(CONTAINER_HEADER.pack(high, container.type_id, len(container.values)))
+                data.extend(container.values.astype('<u2').tobytes())
+        return bytes(data)
+
+    @staticmethod
+    def from_bytes(data):
+        containers = {}
+        container_number, = BITMAP_HEADER.unpack_from(data, 0)
+        position = BITMAP_HEADER.size
+        for _ in range(container_number):
+            high, type_id, number = CONTAINER_HEADER.unpack_from(data, position)
+            position += CONTAINER_HEADER.size
+            container_type = CONTAINER_TYPES[type_id]
+            if container_type is RunContainer:
+                runs = np.frombuffer(data, dtype='<u2', count=2 * number, offset=position).astype(np.uint16)
+                containers[high] = RunContainer(runs[0::2].copy(), runs[1::2].copy())
+                position += 4 * number
+            elif container_type is BitmapContainer:
+                bitmap = np.frombuffer(data, dtype=np.uint8, count=BITMAP_BYTES, offset=position).copy()
+                containers[high] = BitmapContainer(bitmap, number)
+                position += BITMAP_BYTES
+            else:
+                containers[high] = ArrayContainer(
+                    np.frombuffer(data, dtype='<u2', count=number, offset=position).astype(np.uint16)
+                )
+                position += 2 * number
+        return RoaringBitmap(containers)
+
+
+class TermBitmapsError(Exception):
+    """This is a custom exception raised when a term bitmaps file is not valid."""
+
+
+class TermBitmapsWriter(object):
+    """This class writes the bitmaps of the frequent terms from the json index built by the reducers."""
+
+    @staticmethod
+    def write_from_index(index_filepath, filepath, min_frequence_col):
+        """
+        + params:
+            - index_filepath: path of the json index, one line per term_id
+            - filepath: path of the term bitmaps file
+            - min_frequence_col: the bitmaps of the terms with a smaller
+            frequence_col are not written
+        """
+        records = []
+        bitmaps = []
+        offset = 0
+        with open(index_filepath, 'r') as index_file:
+            for line in index_file:
+                # entry is like (term_id, [frequence_col, [(document_id, frequence_doc)...]])
+                term_id, (frequence_col, postings) = json.loads(line)
+                if frequence_col < min_frequence_col:
+                    continue
+                bitmap = RoaringBitmap.from_sorted(
+                    sorted(int(document_id) for document_id, _ in postings)
+                ).run_optimize().to_bytes()
+                records.append((term_id, offset, len(bitmap)))
+                bitmaps.append(bitmap)
+                offset += len(bitmap)
+
+        with open(filepath, 'wb') as bitmaps_file:
+            bitmaps_file.write(HEADER.pack(MAGIC, VERSION, min_frequence_col, len(records)))
+            bitmaps_offset = HEADER.size + len(records) * RECORD.size
+            for term_id, record_offset, length in records:
+                bitmaps_file.write(RECORD.pack(term_id, bitmaps_offset + record_offset, length))
+            for bitmap in bitmaps:
+                bitmaps_file.write(bitmap)
+
+
+class TermBitmaps(object):
+    """
+    This class gives access to the term bitmaps file.
+    + wrapping methods:
+        - get: returns the RoaringBitmap of the given term_id, or None if its
+        bitmap has not been written
+        - __len__: returns the number of bitmaps
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        with open(filepath, 'rb') as bitmaps_file:
+            self.data = mmap.mmap(bitmaps_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.min_frequence_col, bitmap_number = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise TermBitmapsError('{} is not a valid term bitmaps file'.format(filepath))
+        self.records = {
+            term_id: (offset, length)
+            for term_id, offset, length in RECORD.iter_unpack(
+                self.data[HEADER.size:HEADER.size + bitmap_number * RECORD.size]
+            )
+        }
+
+    def get(self, term_id, default=None):
+        if term_id not in self.records:
+            return default
+        offset, length = self.records[term_id]
+        return RoaringBitmap.from_bytes(self.data[offset:offset + length])
+
+    def __len__(self):
+        return len(self.records)
+
+    def close(self):
+        self.data.close()
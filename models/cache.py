@@ -0,0 +1,309 @@
+"""
+This file defines the caches of the search engine, for a traffic where the
+same popular requests come again and again.
+
+The caches of the boolean requests are:
+    - the plans cache keeps the plan of a request (see models/planner.py),
+    keyed by the text of the request without its spaces, so that a request
+    seen before is neither tokenized nor parsed nor planned again
+    - the results cache keeps the results of the AND and OR nodes of the
+    plans, keyed by the canonical text of the node: a frequent fragment such
+    as a && b is evaluated once for all the requests containing it. The
+    results are kept as arrays of integers (4 bytes per document) or as
+    RoaringBitmap, within a budget of bytes, and the nodes whose estimated
+    size is above max_documents are not cached at all
+
+The plans and the results depend on the index: both caches are emptied when
+the version of the index changes, i.e. when the index is built or loaded
+again (see ReverseIndex.version).
+
+The posting lists cache keeps the posting lists read from disk by
+ReverseIndex.__getitem__ when the index is not loaded in memory, within a
+budget of bytes: the posting lists are kept as PostingsView objects over two
+arrays of integers (see models/compact_index.py), 8 bytes per posting
+instead of a list of tuples. The least recently (LRU) or the least frequently
+(LFU) used posting lists are removed when the budget is exceeded.
+
+The caches are bounded and protected by a lock, so that they can be shared by
+the threads answering the requests (see models/server.py).
+"""
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+
+from models.compact_index import PostingsView
+
+
+class LRUCache(object):
+    """
+    This class defines a mapping of at most maxsize items, the least recently
+    used items being removed when a new item is added to a full cache.
+    + attributes:
+        - maxsize: max number of items, or max number of bytes of the items
+        if sizeof is given
+        - sizeof: function returning the size in bytes of an item, or None
+        to count the items
+        - size: number of items, or number of bytes of the items
+        - hits, misses: number of calls of get finding or not the key
+    """
+
+    def __init__(self, maxsize, sizeof=None):
+        self.maxsize = maxsize
+        self.sizeof = sizeof
+        self.size = 0
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value, _ = self.items[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = 1 if self.sizeof is None else self.sizeof(value)
+        if size > self.maxsize:
+            return
+        with self.lock:
+            if key in self.items:
+                self.size -= self.items[key][1]
+            self.items[key] = value, size
+            self.items.move_to_end(key)
+            self.size += size
+            while self.size > self.maxsize:
+                _, (_, removed_size) = self.items.popitem(last=False)
+                self.size -= removed_size
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.size = 0
+
+    def stats(self):
+        return {
+            'items': len(self),
+            'size': self.size,
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    def __len__(self):
+        return len(self.items)
+
+
+class QueryCache(object):
+    """
+    This class defines the caches of the plans and of the results of the
+    boolean requests of an index.
+    + attributes:
+        - plans: LRUCache {request without spaces: Plan}, of at most plans
+        plans
+        - results: LRUCache {(node key, 'stream' or 'bitmap'): results}, of
+        at most results_budget bytes
+        - max_documents: max estimated size of the nodes whose results are
+        cached (see Plan.size), the broad nodes being evaluated each time
+        - version: version of the index whose plans and results are cached
+    + core methods:
+        - get_plan: returns the plan of a request, built if it is not cached
+        - get_result: returns the results of a node, evaluated if they are
+        not cached
+    """
+
+    def __init__(self, plans=1024, results_budget=64 * 1024 * 1024, max_documents=65536):
+        self.plans = LRUCache(plans)
+        self.results = LRUCache(results_budget, self.result_size)
+        self.max_documents = max_documents
+        self.version = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def result_size(result):
+        """Size in bytes of an array of document ids or of a RoaringBitmap"""
+        if isinstance(result, array):
+            return sys.getsizeof(result)
+        return result.size()
+
+    @staticmethod
+    def normalize(raw_request):
+        """The tokenizer ignores the spaces, the requests which only differ by their spaces have the same plan"""
+        return raw_request.replace(' ', '')
+
+    def check_version(self, index):
+        """Empties the caches if the index has changed since the items have been cached"""
+        with self.lock:
+            if self.version != index.version:
+                self.plans.clear()
+                self.results.clear()
+                self.version = index.version
+
+    def get_plan(self, index, raw_request, build_plan):
+        """
+        + params:
+            - index: ReverseIndex object of the plan
+            - raw_request: boolean request
+            - build_plan: function returning the plan of raw_request
+        """
+        self.check_version(index)
+        key = self.normalize(raw_request)
+        plan = self.plans.get(key)
+        if plan is None:
+            plan = build_plan(raw_request)
+            self.plans.put(key, plan)
+        return plan
+
+    def get_result(self, index, key, evaluation, evaluate):
+        """
+        + params:
+            - index: ReverseIndex object of the results
+            - key: canonical key of the node, see Plan.key
+            - evaluation: 'stream' or 'bitmap'
+            - evaluate: function returning the results of the node, an
+            array('I') of document ids or a RoaringBitmap, which are not
+            modified by the callers
+        """
+        self.check_version(index)
+        result = self.results.get((key, evaluation))
+        if result is None:
+            result = evaluate()
+            self.results.put((key, evaluation), result)
+        return result
+
+    def stats(self):
+        return {'plans': self.plans.stats(), 'results': self.results.stats()}
+
+
+class PostingsCache(object):
+    """
+    This class defines the cache of the posting lists of an index read from
+    disk, keyed by term_id.
+    + attributes:
+        - budget: max number of bytes of the cached posting lists
+        - policy: 'lru' to remove the least recently used posting lists
+        first, 'lfu' to remove the least frequently used ones first, the
+        least recently used of them for the equal frequencies
+        - size: number of bytes of the cached posting lists
+        - hits, misses: number of calls of get finding or not the term_id
+        - version: version of the index whose posting lists are cached
+    + core methods:
+        - get: returns the cached [frequence_col, PostingsView] of a term_id
+        - put: caches the [frequence_col, [(document_id, frequence_doc)...]]
+        entry of a term_id and returns its cached version
+    """
+    POLICIES = ('lru', 'lfu')
+
+    def __init__(self, budget, policy='lru'):
+        if policy not in self.POLICIES:
+            raise ValueError('Unknown cache policy {}, expected lru or lfu'.format(policy))
+        self.budget = budget
+        self.policy = policy
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.version = None
+        # {term_id: (frequence_col, PostingsView, size)}
+        self.entries = {}
+        # {number of uses: OrderedDict {term_id: None}} from the least to the
+        # most recently used, all the term_ids being in the bucket 0 for LRU
+        self.buckets = {}
+        self.uses = {}
+        self.lock = threading.Lock()
+
+    def _check_version(self, version):
+        if self.version != version:
+            self.entries.clear()
+            self.buckets.clear()
+            self.uses.clear()
+            self.size = 0
+            self.version = version
+
+    def _touch(self, term_id):
+        """Moves term_id at the end of the bucket of its new number of uses"""
+        uses = self.uses.get(term_id)
+        if uses is not None:
+            bucket = self.buckets[uses]
+            del bucket[term_id]
+            if not bucket:
+                del self.buckets[uses]
+        uses = 0 if self.policy == 'lru' else (uses or 0) + 1
+        self.uses[term_id] = uses
+        self.buckets.setdefault(uses, OrderedDict())[term_id] = None
+
+    def _evict(self):
+        bucket = self.buckets[min(self.buckets)]
+        term_id, _ = bucket.popitem(last=False)
+        if not bucket:
+            del self.buckets[self.uses[term_id]]
+        del self.uses[term_id]
+        self.size -= self.entries.pop(term_id)[2]
+
+    def get(self, version, term_id):
+        with self.lock:
+            self._check_version(version)
+            cached = self.entries.get(term_id)
+            if cached is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._touch(term_id)
+            return [cached[0], cached[1]]
+
+    def put(self, version, term_id, entry, evict=True):
+        """
+        + params:
+            - version: version of the index of the entry
+            - term_id: term_id of the entry
+            - entry: [frequence_col, [(document_id, frequence_doc)...]]
+            - evict: if False, the entry is only cached if it fits in the
+            budget without removing other entries
+        + return:
+            [frequence_col, PostingsView], cached if it fits in the budget
+        """
+        frequence_col, postings = entry
+        if isinstance(postings, PostingsView):
+            document_ids, frequences, doc_id_type = postings.document_ids, postings.frequences, postings.doc_id_type
+        else:
+            doc_id_type = type(postings[0][0]) if postings else int
+            document_ids = array('I', (int(document_id) for document_id, _ in postings))
+            frequences = array('I', (frequence for _, frequence in postings))
+        view = PostingsView(document_ids, frequences, doc_id_type)
+        size = sys.getsizeof(document_ids) + sys.getsizeof(frequences) + sys.getsizeof(view)
+        if size > self.budget:
+            return [frequence_col, view]
+
+        with self.lock:
+            self._check_version(version)
+            if not evict and self.size + size > self.budget:
+                return [frequence_col, view]
+            if term_id in self.entries:
+                self.size -= self.entries[term_id][2]
+            self.entries[term_id] = (frequence_col, view, size)
+            self.size += size
+            self._touch(term_id)
+            while self.size > self.budget:
+                self._evict()
+        return [frequence_col, view]
+
+    def __contains__(self, term_id):
+        return term_id in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        return {
+            'policy': self.policy,
+            'postings_lists': len(self),
+            'size': self.size,
+            'budget': self.budget,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
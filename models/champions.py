@@ -0,0 +1,126 @@
+"""
+This file defines the champion lists of our reverse index: for each term, the
+r postings with the largest weights, sorted by decreasing weight. A request
+can be answered from these short lists instead of the full posting lists (see
+ChampionVectorialRequest in models/request.py).
+
+The champion lists are stored in a single file:
+    - a header: (magic, version, document id type, r, number of terms)
+    - a fixed-width table containing one record per term_id: (offset of the
+    champion list in the file, number of postings)
+    - the champion lists, each posting being (document_id, frequence_doc) as
+    little-endian unsigned 32 bits integers
+"""
+import heapq
+import json
+import mmap
+import struct
+
+from models.ponderation import logtf_idf_normalized
+from models.segment import DOC_ID_TYPES
+
+
+MAGIC = b'MOCH'
+VERSION = 1
+# magic, version, document id type, r, number of terms
+HEADER = struct.Struct('<4sHHII')
+# champion list offset, number of postings
+RECORD = struct.Struct('<QI')
+POSTING = struct.Struct('<II')
+
+
+class ChampionListsError(Exception):
+    """This is a custom exception raised when a champion lists file is not valid."""
+
+
+class ChampionListsWriter(object):
+    """This class writes the champion lists from the json index built by the reducers."""
+
+    @staticmethod
+    def write_from_index(index_filepath, filepath, r, collection, statistics,
+                         weight_function=logtf_idf_normalized):
+        """
+        + params:
+            - index_filepath: path of the json index, one line per term_id
+            - filepath: path of the champion lists file
+            - r: max number of postings of a champion list
+            - collection, statistics: given to the weight function
+            - weight_function: ponderation function giving the weight of a
+            posting, logtf_idf_normalized as the vectorial requests by default
+        """
+        records = []
+        champion_lists = []
+        doc_id_type = int
+        offset = 0
+        with open(index_filepath, 'r') as index_file:
+            for line in index_file:
+                # entry is like (term_id, [frequence_col, [(document_id, frequence_doc)...]])
+                term_id, (frequence_col, postings) = json.loads(line)
+                if postings and isinstance(postings[0][0], str):
+                    doc_id_type = str
+                # the documents with equal weights are sorted by id
+                weighted_postings = heapq.nsmallest(r, (
+                    (
+                        -weight_function(
+                            tf=frequence,
+                            df=frequence_col,
+                            collection=collection,
+                            document_id=document_id,
+                            statistics=statistics
+                        ),
+                        int(document_id),
+                        frequence
+                    )
+                    for document_id, frequence in postings
+                ))
+                while len(records) < term_id:
+                    records.append((0, 0))
+                records.append((offset, len(weighted_postings)))
+                champion_lists.append(b''.join(
+                    POSTING.pack(document_id, frequence)
+                    for _, document_id, frequence in weighted_postings
+                ))
+                offset += len(champion_lists[-1])
+
+        with open(filepath, 'wb') as champions_file:
+            champions_file.write(HEADER.pack(MAGIC, VERSION, DOC_ID_TYPES.index(doc_id_type), r, len(records)))
+            lists_offset = HEADER.size + len(records) * RECORD.size
+            for record_offset, postings_number in records:
+                champions_file.write(RECORD.pack(lists_offset + record_offset, postings_number))
+            for champion_list in champion_lists:
+                champions_file.write(champion_list)
+
+
+class ChampionLists(object):
+    """
+    This class gives access to the champion lists file.
+    + wrapping methods:
+        - __getitem__: returns the [(document_id, frequence_doc)...] champion
+        list of the given term_id, sorted by decreasing weight
+        - __len__: returns the number of term_ids
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        with open(filepath, 'rb') as champions_file:
+            self.data = mmap.mmap(champions_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, doc_id_type, self.r, self.term_number = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ChampionListsError('{} is not a valid champion lists file'.format(filepath))
+        self.doc_id_type = DOC_ID_TYPES[doc_id_type]
+
+    def __getitem__(self, term_id):
+        if not 0 <= term_id < self.term_number:
+            raise KeyError(term_id)
+        offset, postings_number = RECORD.unpack_from(self.data, HEADER.size + term_id * RECORD.size)
+        return [
+            (self.doc_id_type(document_id), frequence)
+            for document_id, frequence in POSTING.iter_unpack(self.data[offset:offset + postings_number * POSTING.size])
+        ]
+
+    def __len__(self):
+        return self.term_number
+
+    def close(self):
+        self.data.close()
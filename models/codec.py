@@ -0,0 +1,238 @@
+"""
+This file defines the codecs used to store the posting lists in a segment.
+A codec needs to implement two class or static methods:
+    - encode(document_ids, frequences, base=-1): returns the bytes of the
+    posting list
+    - decode(data, postings_number, base=-1): returns the (document_ids,
+    frequences) lists of the posting list
+
+The document ids given to a codec are sorted integers, greater than base.
+Except for the raw codec, the document ids are stored as gaps: the first gap
+is computed from base, which is -1 so that every gap is at least 1.
+"""
+import struct
+
+import numpy as np
+
+
+__all__ = [
+    'RawCodec',
+    'VByteCodec',
+    'EliasGammaCodec',
+    'EliasDeltaCodec',
+    'BlockPackedCodec',
+]
+
+
+def gaps(document_ids, base):
+    """Returns the gaps between the sorted document ids, starting from base."""
+    previous = base
+    result = []
+    for document_id in document_ids:
+        result.append(document_id - previous)
+        previous = document_id
+    return result
+
+
+def ungaps(document_gaps, base):
+    """Returns the document ids from the gaps, starting from base."""
+    document_ids = []
+    previous = base
+    for gap in document_gaps:
+        previous += gap
+        document_ids.append(previous)
+    return document_ids
+
+
+class RawCodec(object):
+    """
+    The document ids, then the frequences, as little-endian unsigned 32 bits
+    integers. No compression but the fastest decoding.
+    """
+    name = 'raw'
+
+    @staticmethod
+    def encode(document_ids, frequences, base=-1):
+        return struct.pack('<{}I'.format(2 * len(document_ids)), *document_ids, *frequences)
+
+    @staticmethod
+    def decode(data, postings_number, base=-1):
+        values = struct.unpack_from('<{}I'.format(2 * postings_number), data)
+        return list(values[:postings_number]), list(values[postings_number:])
+
+
+class VByteCodec(object):
+    """
+    The document gaps, then the frequences, with variable byte encoding:
+    7 bits of the value per byte, the high bit marks the last byte of a value.
+    """
+    name = 'vbyte'
+
+    @staticmethod
+    def encode_numbers(numbers):
+        data = bytearray()
+        for number in numbers:
+            encoded = [number & 0x7f]
+            number >>= 7
+            while number:
+                encoded.append(number & 0x7f)
+                number >>= 7
+            encoded.reverse()
+            encoded[-1] |= 0x80
+            data.extend(encoded)
+        return data
+
+    @staticmethod
+    def decode_numbers(data):
+        numbers = []
+        number = 0
+        for byte in data:
+            if byte & 0x80:
+                numbers.append((number << 7) | (byte & 0x7f))
+                number = 0
+            else:
+                number = (number << 7) | byte
+        return numbers
+
+    @staticmethod
+    def encode(document_ids, frequences, base=-1):
+        return bytes(VByteCodec.encode_numbers(gaps(document_ids, base) + list(frequences)))
+
+    @staticmethod
+    def decode(data, postings_number, base=-1):
+        numbers = VByteCodec.decode_numbers(data)
+        return ungaps(numbers[:postings_number], base), numbers[postings_number:2 * postings_number]
+
+
+class EliasGammaCodec(object):
+    """
+    The document gaps, then the frequences, with Elias gamma encoding: a value
+    of n bits is written as n - 1 zeros followed by its binary representation.
+    The bit string is padded with ones to a whole number of bytes.
+    """
+    name = 'gamma'
+
+    @staticmethod
+    def encode_number(number):
+        binary = format(number, 'b')
+        return '0' * (len(binary) - 1) + binary
+
+    @staticmethod
+    def decode_number(bits, position):
+        """Returns the number starting at position in bits and the next position"""
+        length = bits.index('1', position) - position + 1
+        start = position + length - 1
+        return int(bits[start:start + length], 2), start + length
+
+    @classmethod
+    def encode_bits(cls, numbers):
+        bits = ''.join(cls.encode_number(number) for number in numbers)
+        bits += '1' * (-len(bits) % 8)
+        return int(bits, 2).to_bytes(len(bits) // 8, 'big') if bits else b''
+
+    @classmethod
+    def decode_bits(cls, data, count):
+        bits = ''.join(format(byte, '08b') for byte in data)
+        numbers = []
+        position = 0
+        for _ in range(count):
+            number, position = cls.decode_number(bits, position)
+            numbers.append(number)
+        return numbers
+
+    @classmethod
+    def encode(cls, document_ids, frequences, base=-1):
+        return cls.encode_bits(gaps(document_ids, base) + list(frequences))
+
+    @classmethod
+    def decode(cls, data, postings_number, base=-1):
+        numbers = cls.decode_bits(data, 2 * postings_number)
+        return ungaps(numbers[:postings_number], base), numbers[postings_number:]
+
+
+class EliasDeltaCodec(EliasGammaCodec):
+    """
+    Same as EliasGammaCodec, but the number of bits of a value is itself
+    written with Elias gamma encoding, followed by the binary representation
+    of the value without its leading one. Shorter for large values.
+    """
+    name = 'delta'
+
+    @staticmethod
+    def encode_number(number):
+        binary = format(number, 'b')
+        return EliasGammaCodec.encode_number(len(binary)) + binary[1:]
+
+    @staticmethod
+    def decode_number(bits, position):
+        length, position = EliasGammaCodec.decode_number(bits, position)
+        return int('1' + bits[position:position + length - 1], 2), position + length - 1
+
+
+class BlockPackedCodec(object):
+    """
+    The document gaps, then the frequences, by blocks of BLOCK_SIZE values.
+    Each block starts with one byte giving the number of bits b of its largest
+    value, followed by the values packed on b bits each. Blocks are packed and
+    unpacked in bulk with numpy.
+    """
+    name = 'packed'
+    BLOCK_SIZE = 128
+
+    @staticmethod
+    def pack(values):
+        data = bytearray()
+        for start in range(0, len(values), BlockPackedCodec.BLOCK_SIZE):
+            block = np.array(values[start:start + BlockPackedCodec.BLOCK_SIZE], dtype=np.uint64)
+            width = int(block.max()).bit_length()
+            data.append(width)
+            if width:
+                shifts = np.arange(width - 1, -1, -1, dtype=np.uint64)
+                bits = ((block[:, None] >> shifts) & 1).astype(np.uint8)
+                data.extend(np.packbits(bits.ravel()).tobytes())
+        return data
+
+    @staticmethod
+    def unpack(data, count, offset=0):
+        """Returns the count values packed from offset in data and the next offset"""
+        values = []
+        while len(values) < count:
+            block_size = min(BlockPackedCodec.BLOCK_SIZE, count - len(values))
+            width = data[offset]
+            offset += 1
+            if not width:
+                values.extend([0] * block_size)
+                continue
+            byte_number = (block_size * width + 7) // 8
+            bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8, count=byte_number, offset=offset))
+            bits = bits[:block_size * width].reshape(block_size, width).astype(np.uint64)
+            powers = np.left_shift(np.uint64(1), np.arange(width - 1, -1, -1, dtype=np.uint64))
+            values.extend((bits * powers).sum(axis=1).tolist())
+            offset += byte_number
+        return values, offset
+
+    @staticmethod
+    def encode(document_ids, frequences, base=-1):
+        return bytes(BlockPackedCodec.pack(gaps(document_ids, base)) + BlockPackedCodec.pack(frequences))
+
+    @staticmethod
+    def decode(data, postings_number, base=-1):
+        document_gaps, offset = BlockPackedCodec.unpack(data, postings_number)
+        frequences, _ = BlockPackedCodec.unpack(data, postings_number, offset)
+        document_ids = np.cumsum(np.array(document_gaps, dtype=np.int64)) + base
+        return document_ids.tolist(), frequences
+
+
+# the position of a codec in this tuple is stored in the segment header
+CODECS = (RawCodec, VByteCodec, EliasGammaCodec, EliasDeltaCodec, BlockPackedCodec)
+
+
+def get_codec(name):
+    """Returns the codec class with the given name."""
+    for codec in CODECS:
+        if codec.name == name:
+            return codec
+    raise ValueError('Unknown codec {}, expected one of {}'.format(
+        name,
+        ', '.join(codec.name for codec in CODECS)
+    ))
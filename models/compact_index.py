@@ -0,0 +1,109 @@
+"""
+This file defines a compact in-memory representation of our reverse index.
+All the posting lists are stored in flat arrays, using a CSR layout:
+    - offsets: array of len(terms) + 1 positions, the posting list of the
+    term_id t is stored between offsets[t] and offsets[t + 1]
+    - document_ids: array of the document ids of all the posting lists
+    - frequences: array of the document frequences of all the posting lists
+
+Unlike a dict of Python lists, each posting costs 8 bytes, and the index is
+loaded from a segment with bulk reads instead of decoding every entry.
+"""
+import sys
+from array import array
+
+from models.codec import RawCodec
+
+
+class PostingsView(object):
+    """
+    This class is a read-only view over a posting list of a CompactIndex.
+    It behaves like the list [(document_id, frequence_doc)...] without
+    copying the arrays.
+    """
+    __slots__ = ('document_ids', 'frequences', 'doc_id_type')
+
+    def __init__(self, document_ids, frequences, doc_id_type=int):
+        self.document_ids = document_ids
+        self.frequences = frequences
+        self.doc_id_type = doc_id_type
+
+    def __iter__(self):
+        if self.doc_id_type is int:
+            return zip(self.document_ids, self.frequences)
+        return zip(map(self.doc_id_type, self.document_ids), self.frequences)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(zip(
+                map(self.doc_id_type, self.document_ids[index]),
+                self.frequences[index]
+            ))
+        return self.doc_id_type(self.document_ids[index]), self.frequences[index]
+
+    def __len__(self):
+        return len(self.document_ids)
+
+
+class CompactIndex(object):
+    """
+    This class contains the posting lists of all the term_ids in CSR layout.
+    + wrapping methods:
+        - __getitem__: returns [frequence_col, PostingsView] for the given term_id
+        - __len__: returns the number of term_ids
+    """
+
+    def __init__(self, doc_id_type=int):
+        self.offsets = array('Q', [0])
+        self.document_ids = array('I')
+        self.frequences = array('I')
+        self.doc_id_type = doc_id_type
+
+    @staticmethod
+    def load_from_segment(segment):
+        """
+        Builds the compact index from a Segment object. With the raw codec the
+        postings file is read at once, otherwise each posting list is decoded
+        with the codec of the segment.
+        """
+        compact_index = CompactIndex(segment.doc_id_type)
+        if segment.codec is RawCodec:
+            # the whole postings file is read at once
+            postings = memoryview(segment.postings[:])
+
+        for term_id in range(len(segment)):
+            offset, length, postings_number = segment.record(term_id)
+            if segment.codec is RawCodec:
+                # each block of n postings is n document ids followed by n
+                # frequences, all the blocks but the last one are full
+                for start in range(0, postings_number, segment.block_size):
+                    block_length = 4 * min(segment.block_size, postings_number - start)
+                    compact_index.document_ids.frombytes(postings[offset:offset + block_length])
+                    compact_index.frequences.frombytes(postings[offset + block_length:offset + 2 * block_length])
+                    offset += 2 * block_length
+            else:
+                blocks = segment.blocks(term_id)
+                for block in range(len(blocks)):
+                    document_ids, frequences = segment.decode_block(blocks, block)
+                    compact_index.document_ids.extend(document_ids)
+                    compact_index.frequences.extend(frequences)
+            compact_index.offsets.append(len(compact_index.document_ids))
+
+        if segment.codec is RawCodec and sys.byteorder == 'big':
+            # the segment is stored in little-endian
+            compact_index.document_ids.byteswap()
+            compact_index.frequences.byteswap()
+        return compact_index
+
+    def __getitem__(self, term_id):
+        if not 0 <= term_id < len(self):
+            raise KeyError(term_id)
+        start, end = self.offsets[term_id], self.offsets[term_id + 1]
+        return [end - start, PostingsView(
+            memoryview(self.document_ids)[start:end],
+            memoryview(self.frequences)[start:end],
+            self.doc_id_type
+        )]
+
+    def __len__(self):
+        return len(self.offsets) - 1
@@ -1,5 +1,6 @@
 import pickle
 import os
+from array import array
 
 from nltk.tokenize import word_tokenize
 
@@ -84,28 +85,75 @@ class MetaDocumentCollection(object):
     """This class allows us to group collections in a single interface.
     This makes it easier to use our collection properties for a significant
     amount of data when files are splitted in multiple directories.
+
+    The document ids are integers: a routing table gives for each document id
+    the position of its collection in self.routed_collections, so that a
+    document is found without trying every collection.
     """
+    routing_table_filename = 'routing.table'
+    # position of the document ids without collection in the routing table
+    NO_COLLECTION = -1
 
     def __init__(self, data_dirpath='', name='', load_on_creation=False):
         self.data_dirpath = data_dirpath
         self.name = name
         self.meta_collection = {}  # must contains DocumentCollection objects
+        self.routed_collections = []
+        self.routing_table = array('i')
         if load_on_creation:
             self.load_collection()
             self.generate_vocabulary()
+            self.generate_routing_table()
 
     def save(self, dirpath):
         for collection in self.meta_collection.values():
             with open(os.path.join(dirpath, collection.name) + '.collection', 'wb') as collection_file:
                 pickler = pickle.Pickler(collection_file)
                 pickler.dump(collection)
+        with open(os.path.join(dirpath, self.routing_table_filename), 'wb') as routing_file:
+            pickler = pickle.Pickler(routing_file)
+            pickler.dump((
+                [collection.name for collection in self.routed_collections],
+                self.routing_table
+            ))
 
     def load_from_dir(self, dirpath):
         for file in os.listdir(dirpath):
+            if not file.endswith('.collection'):
+                continue
             with open(os.path.join(dirpath, file), 'rb') as collection_file:
                 depickler = pickle.Unpickler(collection_file)
                 self.meta_collection[file] = depickler.load()
         self.generate_vocabulary()
+        self.load_routing_table(os.path.join(dirpath, self.routing_table_filename))
+
+    def generate_routing_table(self):
+        """Builds the routing table from the document ids of each collection"""
+        self.routed_collections = list(self.meta_collection.values())
+        document_number = max(
+            (max(collection.keys()) + 1 for collection in self.routed_collections if len(collection)),
+            default=0
+        )
+        self.routing_table = array('i', [self.NO_COLLECTION]) * document_number
+        for position, collection in enumerate(self.routed_collections):
+            for document_id in collection.keys():
+                self.routing_table[document_id] = position
+
+    def load_routing_table(self, filepath):
+        """
+        Loads the routing table saved with the collections, or builds it if
+        it is missing or does not match the loaded collections.
+        """
+        collections_by_name = {collection.name: collection for collection in self.meta_collection.values()}
+        if os.path.exists(filepath):
+            with open(filepath, 'rb') as routing_file:
+                depickler = pickle.Unpickler(routing_file)
+                names, routing_table = depickler.load()
+            if sorted(names) == sorted(collections_by_name):
+                self.routed_collections = [collections_by_name[name] for name in names]
+                self.routing_table = routing_table
+                return
+        self.generate_routing_table()
 
     def load_collection(self):
         raise NotImplementedError
@@ -122,6 +170,7 @@ class MetaDocumentCollection(object):
                 for key, value
                 in list(coll.collection.items())[:len(coll.collection) // 2]
             }
+        self.generate_routing_table()
 
     def _generate_vocabulary(self):
         self.vocabulary = {}
@@ -142,39 +191,28 @@ class MetaDocumentCollection(object):
         for frequence in self.vocabulary.values():
             self.token_number += frequence
 
+    def _route(self, key):
+        """Returns the collection containing the document id key"""
+        try:
+            position = self.routing_table[key] if key >= 0 else self.NO_COLLECTION
+        except (IndexError, TypeError):
+            raise KeyError(key)
+        if position == self.NO_COLLECTION:
+            raise KeyError(key)
+        return self.routed_collections[position]
+
     def __getitem__(self, key):
         """This methods wraps the __getitem__ methods of self.collection"""
-        for collection in self.meta_collection.values():
-            try:
-                item = collection[key]
-                return item
-            except KeyError:
-                continue
-        raise KeyError
+        return self._route(key)[key]
 
     def __setitem__(self, key, value):
         """This methods wraps the __setitem__ methods of self.collection"""
-        is_set = False
-        for collection in self.meta_collection.values():
-            try:
-                collection[key] = value
-                is_set = True
-            except KeyError:
-                continue
-        if not is_set:
-            raise KeyError
+        self._route(key)[key] = value
 
     def __delitem__(self, key):
         """This methods wraps the __delitem__ methods of self.collection"""
-        is_del = False
-        for collection in self.meta_collection.values():
-            try:
-                del self.collection[key]
-                is_del = True
-            except KeyError:
-                continue
-        if not is_del:
-            raise KeyError
+        del self._route(key)[key]
+        self.routing_table[key] = self.NO_COLLECTION
 
     def get_collections(self):
         col = {}
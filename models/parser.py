@@ -20,7 +20,13 @@ Here is the definition of our parser:
                          | '!'SubExpression            Operator: NOT
                          | RoleName
         RoleName::= [a-zA-Z]+
+
+The nodes are evaluated on sorted streams of integer document ids (see
+models/streams.py): AND is an intersection seeking in the longest posting
+lists, OR is a merge of the streams, and NOT is a difference. They can also
+be evaluated on compressed bitmaps of document ids (see models/bitmap.py).
 """
+from models import streams
 
 
 class ParsingError(Exception):
@@ -32,13 +38,37 @@ class Node(object):
 
     def eval(self, index):
         """
-        This function to implement defines how we should eval the current node.
+        This function defines how we should eval the current node.
         + params:
             - index: ReverseIndex object where we look for results.
         + returns:
             a set containing all posting_ids corresponding to the boolean expression given:
             {posting_ids ...}
         """
+        return set(map(index.document_id_type(), self.stream(index)))
+
+    def stream(self, index):
+        """
+        This function to implement defines how we should eval the current node
+        on streams.
+        + params:
+            - index: ReverseIndex object where we look for results.
+        + returns:
+            a stream over the sorted integer posting_ids corresponding to the
+            boolean expression given
+        """
+        raise NotImplementedError
+
+    def bitmap(self, index):
+        """
+        This function to implement defines how we should eval the current node
+        on bitmaps.
+        + params:
+            - index: ReverseIndex object where we look for results.
+        + returns:
+            a RoaringBitmap of the integer posting_ids corresponding to the
+            boolean expression given
+        """
         raise NotImplementedError
 
 
@@ -62,12 +92,48 @@ class BinaryNode(Node):
 class AndNode(BinaryNode):
     """This class defines the AND operator logic in our tree."""
 
-    def eval(self, index):
+    def stream(self, index):
         """
         Implements the and eval function.
-        This is the intersection between the result of eval function of the two children nodes.
+        This is the intersection between the result of stream function of the two children nodes.
+        A NOT child is evaluated as a difference: A && !B is A minus B, and
+        !A && !B is the universe minus (A || B).
         """
-        return self.left_expression.eval(index).intersection(self.right_expression.eval(index))
+        left_is_not = isinstance(self.left_expression, NotNode)
+        right_is_not = isinstance(self.right_expression, NotNode)
+        if left_is_not and right_is_not:
+            return streams.difference(
+                index.get_universe().document_ids(),
+                streams.union([
+                    self.left_expression.expression.stream(index),
+                    self.right_expression.expression.stream(index)
+                ])
+            )
+        elif right_is_not:
+            return streams.difference(
+                self.left_expression.stream(index),
+                self.right_expression.expression.stream(index)
+            )
+        elif left_is_not:
+            return streams.difference(
+                self.right_expression.stream(index),
+                self.left_expression.expression.stream(index)
+            )
+        return streams.intersection([self.left_expression.stream(index), self.right_expression.stream(index)])
+
+    def bitmap(self, index):
+        """Implements the and eval function on bitmaps, with the same differences as stream."""
+        left_is_not = isinstance(self.left_expression, NotNode)
+        right_is_not = isinstance(self.right_expression, NotNode)
+        if left_is_not and right_is_not:
+            return index.get_universe_bitmap() - (
+                self.left_expression.expression.bitmap(index) | self.right_expression.expression.bitmap(index)
+            )
+        elif right_is_not:
+            return self.left_expression.bitmap(index) - self.right_expression.expression.bitmap(index)
+        elif left_is_not:
+            return self.right_expression.bitmap(index) - self.left_expression.expression.bitmap(index)
+        return self.left_expression.bitmap(index) & self.right_expression.bitmap(index)
 
     def __str__(self):
         return '({} && {})'.format(self.left_expression, self.right_expression)
@@ -76,12 +142,16 @@ class AndNode(BinaryNode):
 class OrNode(BinaryNode):
     """This class defines the OR operator logic in our tree."""
 
-    def eval(self, index):
+    def stream(self, index):
         """
         Implements the or eval function.
-        This is the union between the result of eval function of the two children nodes.
+        This is the union between the result of stream function of the two children nodes.
         """
-        return self.left_expression.eval(index).union(self.right_expression.eval(index))
+        return streams.union([self.left_expression.stream(index), self.right_expression.stream(index)])
+
+    def bitmap(self, index):
+        """Implements the or eval function on bitmaps."""
+        return self.left_expression.bitmap(index) | self.right_expression.bitmap(index)
 
     def __str__(self):
         return '({} || {})'.format(self.left_expression, self.right_expression)
@@ -90,19 +160,18 @@ class OrNode(BinaryNode):
 class NotNode(UnaryNode):
     """This class defines the NOT operator logic in our tree."""
 
-    def eval(self, index):
+    def stream(self, index):
         """
         Implements the not eval function.
         This is the difference between:
-            - all posting_ids in index
-            - the result of eval function of the child node.
+            - all posting_ids in index, given by the universe of the index
+            - the result of stream function of the child node.
         """
-        all_posting_ids = {
-            posting_id
-            for term_id in index.keys()
-            for posting_id, _ in index[term_id][1]
-        }
-        return all_posting_ids.difference(self.expression.eval(index))
+        return streams.difference(index.get_universe().document_ids(), self.expression.stream(index))
+
+    def bitmap(self, index):
+        """Implements the not eval function on bitmaps."""
+        return index.get_universe_bitmap() - self.expression.bitmap(index)
 
     def __str__(self):
         return '!({})'.format(self.expression)
@@ -115,12 +184,16 @@ class RoleNode(Node):
         """self.role_name is the value of the leaf (a word)"""
         self.role_name = role_name
 
-    def eval(self, index):
+    def stream(self, index):
         """
-        Implements the eval function for RoleNode.
-        Return all posting_ids associated to self.role_name.
+        Implements the stream function for RoleNode.
+        Return a stream over all posting_ids associated to self.role_name.
         """
-        return {posting_id for posting_id, _, in index[self.role_name][1]}
+        return index.document_stream(self.role_name)
+
+    def bitmap(self, index):
+        """Return the bitmap of all posting_ids associated to self.role_name."""
+        return index.document_bitmap(self.role_name)
 
     def __str__(self):
         return str(self.role_name)
@@ -167,66 +240,84 @@ class Tokenizer(object):
 
 
 class BooleanParser(object):
-    """This class contains the logic to build a tree given a tokenized expression."""
-    index = 0
+    """
+    This class contains the logic to build a tree given a tokenized expression.
+    The position in the tokens is kept by each parser object, a parser being
+    created by each call of parse: several requests can be parsed at once by
+    different threads.
+    + attributes:
+        - tokens: tokenized expression [token ...]
+        - index: position of the next token to read
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.index = 0
 
     @staticmethod
     def parse(tokens):
         """
         Method to call to build tree from tokenized expression.
-        Reset BooleanParser.index to 0 and build the tree for the given token list.
+        Build the tree for the given token list with a new parser.
         + params:
             - tokens: tokenized expression [token ...]
         + returns:
             root Node of our tokenized expression
         """
-        BooleanParser.index = 0
-        return BooleanParser.parse_exp(tokens)
-
-    @staticmethod
-    def parse_exp(tokens):
+        parser = BooleanParser(tokens)
+        expression = parser.parse_exp()
+        if parser.index < len(tokens):
+            raise ParsingError('Unexpected \')\'')
+        return expression
+
+    def current_token(self):
+        """Returns the next token to read, the request ending before it being not valid."""
+        if self.index >= len(self.tokens):
+            raise ParsingError('Unexpected end of request')
+        return self.tokens[self.index]
+
+    def parse_exp(self):
         """This methods implements Expression rule."""
-        left_expression = BooleanParser.parse_subexp(tokens)
+        left_expression = self.parse_subexp()
 
-        if BooleanParser.index >= len(tokens):
+        if self.index >= len(self.tokens):
             return left_expression
 
-        elif tokens[BooleanParser.index] == ')':
-            return left_expression
+        current_token = self.tokens[self.index]
 
-        current_token = tokens[BooleanParser.index]
+        if current_token == ')':
+            return left_expression
 
-        if current_token == '&&':
-            BooleanParser.index += 1
-            right_expression = BooleanParser.parse_exp(tokens)
+        elif current_token == '&&':
+            self.index += 1
+            right_expression = self.parse_exp()
             return AndNode(left_expression, right_expression)
 
         elif current_token == '||':
-            BooleanParser.index += 1
-            right_expression = BooleanParser.parse_exp(tokens)
+            self.index += 1
+            right_expression = self.parse_exp()
             return OrNode(left_expression, right_expression)
 
         raise ParsingError('Expected \'&&\' or \'||\' or EOF')
 
-    @staticmethod
-    def parse_subexp(tokens):
+    def parse_subexp(self):
         """This method implements SubExpression rule."""
-        current_token = tokens[BooleanParser.index]
+        current_token = self.current_token()
 
         if current_token == '(':
-            BooleanParser.index += 1
-            expression = BooleanParser.parse_exp(tokens)
+            self.index += 1
+            expression = self.parse_exp()
 
-            if tokens[BooleanParser.index] != ')':
+            if self.current_token() != ')':
                 raise ParsingError('Expected \')\'')
 
-            BooleanParser.index += 1
+            self.index += 1
             return expression
 
         elif current_token == '!':
-            BooleanParser.index += 1
-            expression = BooleanParser.parse_subexp(tokens)
+            self.index += 1
+            expression = self.parse_subexp()
             return NotNode(expression)
 
-        BooleanParser.index += 1
+        self.index += 1
         return RoleNode(current_token)
@@ -0,0 +1,323 @@
+"""
+This file defines the planning stage of the boolean requests, between the
+parsing of the request (see models/parser.py) and its evaluation.
+
+BooleanParser builds right-deep binary trees: a && b && c is evaluated as
+a && (b && c), in the order of the request. The QueryPlanner rewrites the
+tree in a plan:
+    - nested AND and OR nodes are flattened in n-ary AndPlan and OrPlan
+    - the NOT nodes are pushed in the AND: a && !b is an AndPlan with the
+    positive operand a and the negative operand b, !(a || b) is an AndPlan
+    with the negative operands a and b, and !!a is a
+    - the positive operands of an AndPlan are sorted by increasing estimated
+    size (the frequence_col of a term), so that the intersection starts from
+    the shortest posting list and seeks in the longest ones
+    - the evaluation of an AndPlan stops as soon as its intermediate result is
+    empty, without reading the posting lists of the remaining operands
+
+A plan is evaluated on streams of document ids (stream) or on compressed
+bitmaps of document ids (bitmap, see models/bitmap.py).
+
+With a QueryCache (see models/cache.py), the AND and OR nodes of the plan
+whose estimated size is at most QueryCache.max_documents are wrapped in
+CachedPlan nodes: their results are kept in the cache, keyed by the canonical
+text of the node, where the operands are sorted by name.
+
+The estimated size of a plan is an upper bound of its number of documents,
+its estimated cost is a number of postings read, both computed from the
+frequence_col of the terms.
+"""
+from array import array
+
+from models import streams
+from models.bitmap import RoaringBitmap
+from models.streams import ListStream
+from models.parser import AndNode, NotNode, OrNode, RoleNode
+
+
+class Plan(object):
+    """
+    This class defines a node of the plan of a boolean request.
+    + attributes:
+        - size: estimated max number of documents of the node
+        - cost: estimated number of postings read to evaluate the node
+        - key: canonical text of the node, the same for the nodes giving the
+        same documents whatever the order of their operands
+    """
+    size = 0
+    cost = 0
+    key = ''
+
+    def stream(self, index):
+        """
+        This function to implement evaluates the node.
+        + params:
+            - index: ReverseIndex object where we look for results.
+        + returns:
+            a stream over the sorted integer posting_ids of the node
+        """
+        raise NotImplementedError
+
+    def bitmap(self, index):
+        """
+        This function to implement evaluates the node on bitmaps.
+        + params:
+            - index: ReverseIndex object where we look for results.
+        + returns:
+            a RoaringBitmap of the integer posting_ids of the node
+        """
+        raise NotImplementedError
+
+    def explain(self, depth=0):
+        """Returns the lines describing the plan, indented by depth"""
+        raise NotImplementedError
+
+    def _describe(self, depth, name):
+        return '{}{} (size <= {}, cost = {})'.format('    ' * depth, name, self.size, self.cost)
+
+
+class TermPlan(Plan):
+    """This class defines a leaf of the plan: the posting list of a term."""
+
+    def __init__(self, term, frequence_col):
+        self.term = term
+        self.key = term
+        self.size = frequence_col
+        self.cost = frequence_col
+
+    def stream(self, index):
+        return index.document_stream(self.term)
+
+    def bitmap(self, index):
+        return index.document_bitmap(self.term)
+
+    def explain(self, depth=0):
+        return [self._describe(depth, 'TERM {}'.format(self.term))]
+
+
+class AndPlan(Plan):
+    """
+    This class defines an n-ary AND of positive operands and negative operands:
+    the documents of all the positive operands which are in none of the
+    negative operands. Without positive operand, the documents are taken from
+    the universe of the index.
+    """
+
+    def __init__(self, operands, negated_operands, universe_size):
+        self.operands = sorted(operands, key=lambda operand: operand.size)
+        self.negated_operands = sorted(negated_operands, key=lambda operand: operand.size)
+        self.universe_size = universe_size
+        self.key = '({})'.format(' && '.join(
+            sorted(operand.key for operand in self.operands) +
+            sorted('!' + operand.key for operand in self.negated_operands)
+        ))
+        if self.operands:
+            self.size = self.operands[0].size
+            # the next operands are term posting lists seeked for each
+            # document of the intermediate result, or sub-plans evaluated
+            # entirely
+            self.cost = self.operands[0].cost
+            for operand in self.operands[1:]:
+                self.cost += min(operand.cost, self.size) if isinstance(operand, TermPlan) else operand.cost
+        else:
+            self.size = universe_size
+            self.cost = universe_size
+        for operand in self.negated_operands:
+            self.cost += min(operand.cost, self.size) if isinstance(operand, TermPlan) else operand.cost
+
+    def stream(self, index):
+        if not self.operands:
+            return streams.difference(
+                index.get_universe().document_ids(),
+                streams.union([operand.stream(index) for operand in self.negated_operands])
+            )
+        result = self.operands[0].stream(index)
+        for operand in self.operands[1:]:
+            if not len(result):
+                return result
+            result = streams.intersection([result, operand.stream(index)])
+        for operand in self.negated_operands:
+            if not len(result):
+                return result
+            result = streams.difference(result, operand.stream(index))
+        return result
+
+    def bitmap(self, index):
+        if not self.operands:
+            result = index.get_universe_bitmap()
+        else:
+            result = self.operands[0].bitmap(index)
+            for operand in self.operands[1:]:
+                if not result.containers:
+                    return result
+                result = result & operand.bitmap(index)
+        for operand in self.negated_operands:
+            if not result.containers:
+                return result
+            result = result - operand.bitmap(index)
+        return result
+
+    def explain(self, depth=0):
+        lines = [self._describe(depth, 'AND')]
+        for operand in self.operands:
+            lines.extend(operand.explain(depth + 1))
+        for operand in self.negated_operands:
+            lines.append('{}NOT'.format('    ' * (depth + 1)))
+            lines.extend(operand.explain(depth + 2))
+        return lines
+
+
+class OrPlan(Plan):
+    """This class defines an n-ary OR: the documents of one of the operands."""
+
+    def __init__(self, operands):
+        self.operands = operands
+        self.key = '({})'.format(' || '.join(sorted(operand.key for operand in operands)))
+        self.size = sum(operand.size for operand in operands)
+        self.cost = sum(operand.cost for operand in operands)
+
+    def stream(self, index):
+        return streams.union([operand.stream(index) for operand in self.operands if operand.size])
+
+    def bitmap(self, index):
+        result = RoaringBitmap()
+        for operand in self.operands:
+            if operand.size:
+                result = result | operand.bitmap(index)
+        return result
+
+    def explain(self, depth=0):
+        lines = [self._describe(depth, 'OR')]
+        for operand in self.operands:
+            lines.extend(operand.explain(depth + 1))
+        return lines
+
+
+class CachedPlan(Plan):
+    """
+    This class wraps an AND or OR node whose results are kept in a
+    QueryCache: the node is only evaluated when its results are not in the
+    cache. The results of stream are kept as a sorted array of 4 bytes
+    integers, the bitmaps are never modified by the operations on them.
+    """
+
+    def __init__(self, plan, cache):
+        self.plan = plan
+        self.cache = cache
+        self.key = plan.key
+        self.size = plan.size
+        self.cost = plan.cost
+
+    def stream(self, index):
+        document_ids = self.cache.get_result(
+            index,
+            self.key,
+            'stream',
+            lambda: array('I', self.plan.stream(index))
+        )
+        return ListStream(document_ids)
+
+    def bitmap(self, index):
+        return self.cache.get_result(index, self.key, 'bitmap', lambda: self.plan.bitmap(index))
+
+    def explain(self, depth=0):
+        lines = self.plan.explain(depth)
+        lines[0] += ' [cached]'
+        return lines
+
+
+class QueryPlanner(object):
+    """
+    This class builds the plan of a boolean request from the tree built by
+    BooleanParser.
+    + attributes:
+        - index: ReverseIndex object of the request
+        - cache: QueryCache keeping the results of the AND and OR nodes, or
+        None
+    + core methods:
+        - plan: returns the Plan of the root Node of a request
+    """
+
+    def __init__(self, index, cache=None):
+        self.index = index
+        self.cache = cache
+        self._universe_size = None
+
+    def universe_size(self):
+        if self._universe_size is None:
+            self._universe_size = len(self.index.get_universe())
+        return self._universe_size
+
+    def plan(self, node):
+        """Returns the Plan of node, whose AND and OR nodes are cached with a cache"""
+        plan = self.build(node)
+        if self.cache is not None:
+            plan = self.cached(plan)
+        return plan
+
+    def cached(self, plan):
+        """Wraps the AND and OR nodes of plan which are small enough in CachedPlan nodes"""
+        if isinstance(plan, AndPlan):
+            plan.operands = [self.cached(operand) for operand in plan.operands]
+            plan.negated_operands = [self.cached(operand) for operand in plan.negated_operands]
+        elif isinstance(plan, OrPlan):
+            plan.operands = [self.cached(operand) for operand in plan.operands]
+        else:
+            return plan
+        if plan.size > self.cache.max_documents:
+            return plan
+        return CachedPlan(plan, self.cache)
+
+    def build(self, node):
+        if isinstance(node, RoleNode):
+            return TermPlan(node.role_name, self.index.get_frequence_col(node.role_name))
+        elif isinstance(node, NotNode):
+            return self.negate(self.build(node.expression))
+        elif isinstance(node, AndNode):
+            operands = []
+            negated_operands = []
+            for child in (node.left_expression, node.right_expression):
+                child_plan = self.build(child)
+                if isinstance(child_plan, AndPlan):
+                    operands.extend(child_plan.operands)
+                    negated_operands.extend(child_plan.negated_operands)
+                else:
+                    operands.append(child_plan)
+            operands = self._unique(operands)
+            # the universe is only needed by an AND without positive operand
+            return AndPlan(operands, self._unique(negated_operands), 0 if operands else self.universe_size())
+        elif isinstance(node, OrNode):
+            operands = []
+            for child in (node.left_expression, node.right_expression):
+                child_plan = self.build(child)
+                if isinstance(child_plan, OrPlan):
+                    operands.extend(child_plan.operands)
+                else:
+                    operands.append(child_plan)
+            return OrPlan(self._unique(operands))
+        raise TypeError('Unknown node {}'.format(node))
+
+    def negate(self, plan):
+        """Returns the plan of NOT plan"""
+        if isinstance(plan, AndPlan) and not plan.operands:
+            # !!a is a, and !(!a && !b) is a || b
+            if len(plan.negated_operands) == 1:
+                return plan.negated_operands[0]
+            return OrPlan(plan.negated_operands)
+        elif isinstance(plan, OrPlan):
+            # !(a || b) is !a && !b
+            return AndPlan([], plan.operands, self.universe_size())
+        return AndPlan([], [plan], self.universe_size())
+
+    @staticmethod
+    def _unique(operands):
+        """Removes the terms found several times in the operands of an AND or an OR"""
+        terms = set()
+        unique_operands = []
+        for operand in operands:
+            if isinstance(operand, TermPlan):
+                if operand.term in terms:
+                    continue
+                terms.add(operand.term)
+            unique_operands.append(operand)
+        return unique_operands
@@ -5,6 +5,8 @@ A ponderation function needs to have at least these arguments:
     - df: the number of document of the collection which contains given token
     - collection: collection given for the request
     - document_id: the id of the document to calculate the ponderation
+    - statistics: optional DocumentStatistics of the index (see
+    models/statistics.py), used instead of the term_bag of the document
 The function should return wd = ptf * pdf * nd
 
 Some variables defines in function:
@@ -14,6 +16,8 @@ Some variables defines in function:
 """
 from math import log10
 
+import numpy as np
+
 
 __all__ = [
     'tf_df',
@@ -28,7 +32,25 @@ __all__ = [
 ]
 
 
-def tf_df(tf, df, collection, document_id):
+def _doc_len(collection, document_id, statistics):
+    if statistics is not None:
+        return statistics.doc_len(document_id)
+    try:
+        return sum(collection[document_id].term_bag.values())
+    except KeyError:
+        return 1
+
+
+def _tf_max(collection, document_id, statistics):
+    if statistics is not None:
+        return statistics.tf_max(document_id)
+    try:
+        return max(collection[document_id].term_bag.values())
+    except KeyError:
+        return 1
+
+
+def tf_df(tf, df, collection, document_id, statistics=None):
     """
     - ptf = tf
     - pdf = 1 / df
@@ -37,7 +59,7 @@ def tf_df(tf, df, collection, document_id):
     return tf * (1 / df) * 1
 
 
-def only_tf(tf, df, collection, document_id):
+def only_tf(tf, df, collection, document_id, statistics=None):
     """
     - ptf = tf
     - pdf = 1
@@ -46,7 +68,7 @@ def only_tf(tf, df, collection, document_id):
     return tf * 1 * 1
 
 
-def only_logtf(tf, df, collection, document_id):
+def only_logtf(tf, df, collection, document_id, statistics=None):
     """
     - ptf = (1 + log10(tf))
     - pdf = 1
@@ -55,7 +77,7 @@ def only_logtf(tf, df, collection, document_id):
     return (1 + log10(tf)) * 1 * 1
 
 
-def tf_idf(tf, df, collection, document_id):
+def tf_idf(tf, df, collection, document_id, statistics=None):
     """
     - ptf = tf
     - pdf = log10(N / df)
@@ -65,21 +87,18 @@ def tf_idf(tf, df, collection, document_id):
     return tf * log10(N / df)
 
 
-def tf_idf_normalized(tf, df, collection, document_id):
+def tf_idf_normalized(tf, df, collection, document_id, statistics=None):
     """
     - ptf = tf
     - pdf = log10(N / df)
     - n = (1 / doc_len)
     """
     N = len(collection)
-    try:
-        doc_len = sum(collection[document_id].term_bag.values())
-    except KeyError:
-        doc_len = 1
+    doc_len = _doc_len(collection, document_id, statistics)
     return tf * log10(N / df) * (1 / doc_len)
 
 
-def logtf_idf(tf, df, collection, document_id):
+def logtf_idf(tf, df, collection, document_id, statistics=None):
     """
     - ptf = (1 + log10(tf))
     - pdf = log10(N / df)
@@ -89,43 +108,89 @@ def logtf_idf(tf, df, collection, document_id):
     return (1 + log10(tf)) * log10(N / df)
 
 
-def logtf_idf_normalized(tf, df, collection, document_id):
+def logtf_idf_normalized(tf, df, collection, document_id, statistics=None):
     """
     - ptf = (1 + log10(tf))
     - pdf = log10(N / df)
     - n = (1 / doc_len)
     """
     N = len(collection)
-    try:
-        doc_len = sum(collection[document_id].term_bag.values())
-    except KeyError:
-        doc_len = 1
+    doc_len = _doc_len(collection, document_id, statistics)
     return (1 + log10(tf)) * log10(N / df) * (1 / doc_len)
 
 
-def normalizedtf_df(tf, df, collection, document_id):
+def normalizedtf_df(tf, df, collection, document_id, statistics=None):
     """
     - ptf = tf / tf_max
     - pdf = 1 / df
     - n = 1
     """
-    try:
-        tf_max = max(collection[document_id].term_bag.values())
-    except KeyError:
-        tf_max = 1
+    tf_max = _tf_max(collection, document_id, statistics)
     return (tf / tf_max) * (1 / df) * 1
 
 
-def normalizedtf_df_normalized(tf, df, collection, document_id):
+def normalizedtf_df_normalized(tf, df, collection, document_id, statistics=None):
     """
     - ptf = tf / tf_max
     - pdf = 1 / df
     - n = 1 / doc_len
     """
-    try:
-        tf_max = max(collection[document_id].term_bag.values())
-        doc_len = sum(collection[document_id].term_bag.values())
-    except KeyError:
-        tf_max = 1
-        doc_len = 1
+    tf_max = _tf_max(collection, document_id, statistics)
+    doc_len = _doc_len(collection, document_id, statistics)
     return (tf / tf_max) * (1 / df) * doc_len
+
+
+# Vectorized versions of the ponderation functions, used by NumpyVectorialRequest.
+# They take the numpy arrays tf, doc_len and tf_max of a posting list, df and
+# N being numbers, and compute the weights with the same operations.
+
+
+def _log10_array(values):
+    """
+    Computes log10 with math.log10 for each distinct value: the vectorized
+    np.log10 may differ in the last bit, which changes the order of the
+    documents with equal scores.
+    """
+    distinct_values, inverse = np.unique(values, return_inverse=True)
+    return np.array([log10(value) for value in distinct_values.tolist()])[inverse]
+
+
+def tf_df_array(tf, df, N, doc_len, tf_max):
+    return tf * (1 / df) * 1
+
+
+def only_tf_array(tf, df, N, doc_len, tf_max):
+    return tf * 1 * 1
+
+
+def only_logtf_array(tf, df, N, doc_len, tf_max):
+    return (1 + _log10_array(tf)) * 1 * 1
+
+
+def tf_idf_array(tf, df, N, doc_len, tf_max):
+    return tf * log10(N / df)
+
+
+def tf_idf_normalized_array(tf, df, N, doc_len, tf_max):
+    return tf * log10(N / df) * (1 / doc_len)
+
+
+def logtf_idf_array(tf, df, N, doc_len, tf_max):
+    return (1 + _log10_array(tf)) * log10(N / df)
+
+
+def logtf_idf_normalized_array(tf, df, N, doc_len, tf_max):
+    return (1 + _log10_array(tf)) * log10(N / df) * (1 / doc_len)
+
+
+def normalizedtf_df_array(tf, df, N, doc_len, tf_max):
+    return (tf / tf_max) * (1 / df) * 1
+
+
+def normalizedtf_df_normalized_array(tf, df, N, doc_len, tf_max):
+    return (tf / tf_max) * (1 / df) * doc_len
+
+
+def vectorized(weight_function):
+    """Returns the vectorized version of the given ponderation function"""
+    return globals()[weight_function.__name__ + '_array']
@@ -1,27 +1,59 @@
+import heapq
 from math import sqrt
+from operator import itemgetter
 
+import numpy as np
+
+from models.compact_index import PostingsView
 from models.parser import BooleanParser, Tokenizer
-from models.ponderation import logtf_idf_normalized
+from models.planner import QueryPlanner
+from models.ponderation import logtf_idf_normalized, vectorized
 
 
 class Request(object):
+    """
+    A request object only keeps the index and the collection, which are read
+    and never modified: the parsed request is returned by parse_request and
+    given to the other methods, so that a single request object can answer
+    several requests at once from different threads.
+    + core methods:
+        - parse_request: returns the parsed request of a raw request
+        - find_results: returns the results of a parsed request
+        - search: thread-safe entry point, returns the first results of a raw request
+    """
+    # False when the number of documents found returned with the top results
+    # may only be a lower bound of the number of documents matching the request
+    exact_results_number = True
 
     def __init__(self, index, collection):
         self.index = index
         self.collection = collection
 
     def return_results(self, raw_request, *args, **kwargs):
-        self.raw_request = raw_request
-        self.parse_request()
-        return self.find_results(*args, **kwargs)
+        return self.find_results(self.parse_request(raw_request), *args, **kwargs)
+
+    def search(self, raw_request, k, *args, **kwargs):
+        """
+        Parses and evaluates raw_request. Nothing is stored on the request
+        object and the index is only read, so search can be called by several
+        threads at once on the same objects, without lock.
+        + params:
+            - raw_request: request as typed by the user
+            - k: number of results to return
+        + return:
+            (number of documents found, [(document_id, score)...]) with the
+            k first results, the score being None for the unscored models
+        """
+        results = self.return_results(raw_request, *args, **kwargs)
+        return len(results), [(document_id, None) for document_id in results[:k]]
 
-    def parse_request(self):
+    def parse_request(self, raw_request):
         """
-        Parse the raw request given at object's creation.
+        Parse the raw request and return the parsed request given to find_results.
         """
         raise NotImplementedError
 
-    def find_results(self):
+    def find_results(self, parsed_request):
         """
         Implements here the algorithm to find results.
         """
@@ -29,37 +61,130 @@ class Request(object):
 
 
 class BooleanRequest(Request):
-    """All the logic of this class uses models written in file models/parser.py."""
+    """
+    All the logic of this class uses models written in files models/parser.py
+    and models/planner.py.
+    With a QueryCache (see models/cache.py), the plans of the requests and
+    the results of their AND and OR nodes are kept between the requests.
+    """
 
-    def parse_request(self):
+    def __init__(self, index, collection, cache=None):
+        super().__init__(index, collection)
+        self.cache = cache
+
+    def parse_tree(self, raw_request):
+        """Returns the root Node of the tree of the tokenized raw_request"""
+        return BooleanParser.parse(Tokenizer.tokenize(raw_request))
+
+    def parse_request(self, raw_request):
         """
-        We have two steps to parse the request:
+        We have three steps to parse the request:
             - tokenize the raw_request
             - build the associated tree
+            - plan the evaluation of the tree
+        + return:
+            the root Plan of the request
+        """
+        if self.cache is not None:
+            return self.cache.get_plan(self.index, raw_request, self.build_plan)
+        return self.build_plan(raw_request)
+
+    def build_plan(self, raw_request):
+        return QueryPlanner(self.index, self.cache).plan(self.parse_tree(raw_request))
+
+    def find_results(self, plan):
+        """
+        We only have to use the stream function of the root of the plan, its
+        document ids are sorted as integers and not as the document ids.
         """
-        self.tokenized_request = Tokenizer.tokenize(self.raw_request)
-        self.parsed_request = BooleanParser.parse(self.tokenized_request)
+        return sorted(map(self.index.document_id_type(), plan.stream(self.index)))
+
+    def explain(self, raw_request):
+        """Returns the plan of the request with its estimated costs"""
+        return '\n'.join(self.parse_request(raw_request).explain())
 
-    def find_results(self):
-        """We only have to use the eval function of the root node."""
-        return sorted(list(self.parsed_request.eval(self.index)))
+
+class BitmapBooleanRequest(BooleanRequest):
+    """
+    This class evaluates the plan of the boolean requests on compressed
+    bitmaps of document ids (see models/bitmap.py) instead of streams: the
+    broad OR and NOT are combined as packed integers rather than merged id
+    by id.
+    """
+
+    def find_results(self, plan):
+        return sorted(map(self.index.document_id_type(), plan.bitmap(self.index)))
 
 
 class VectorialRequest(Request):
 
-    def parse_request(self):
+    def parse_request(self, raw_request):
         """
         We parse the raw request by splitting on spaces.
+        + return:
+            [token...] the tokens of the request found in the index
         """
-        self.parsed_request = [
-            elt.lower() for elt in self.raw_request.split(' ') if elt.lower() in self.index.keys()
+        return [
+            elt.lower() for elt in raw_request.split(' ') if elt.lower() in self.index.keys()
         ]
 
-    def find_results(self, weight_function=logtf_idf_normalized):
+    def return_top_results(self, raw_request, k, *args, **kwargs):
+        return self.find_top_results(self.parse_request(raw_request), k, *args, **kwargs)
+
+    def search(self, raw_request, k, *args, **kwargs):
+        return self.return_top_results(raw_request, k, *args, **kwargs)
+
+    def get_entry(self, token):
+        """Returns the [frequence_col, [(document_id, frequence_doc)...]] entry scored for token"""
+        return self.index[token]
+
+    def find_results(self, parsed_request, weight_function=logtf_idf_normalized):
+        """
+        Returns the ids of all the documents found, sorted by decreasing scores.
+        """
+        s = self.score_documents(parsed_request, weight_function)
+        return [doc_id for doc_id, _ in sorted(s.items(), key=lambda x: x[1], reverse=True)]
+
+    def find_top_results(self, parsed_request, k, weight_function=logtf_idf_normalized):
+        """
+        Returns the k best documents only, selected with a heap of size k
+        instead of sorting all the scores.
+        + params:
+            - parsed_request: [token...] given by parse_request
+            - k: number of documents to return
+            - weight_function: function which calculate weight of given term
+        + return:
+            (number of documents found, [(document_id, score)...]) with the
+            same order as find_results
+        """
+        s = self.score_documents(parsed_request, weight_function)
+        # nlargest is stable, the documents with equal scores keep the order of find_results
+        return len(s), heapq.nlargest(k, s.items(), key=itemgetter(1))
+
+    def iter_result_pages(self, parsed_request, page_size, weight_function=logtf_idf_normalized):
+        """
+        Yields the [(document_id, score)...] pages of page_size documents, in
+        the order of find_results. The scores are heapified once and each page
+        only pops its own documents, so the documents after the last page
+        read are never sorted.
+        """
+        # the position of the document breaks the ties as the stable sort of find_results
+        heap = [
+            (-score, position, doc_id)
+            for position, (doc_id, score) in enumerate(self.score_documents(parsed_request, weight_function).items())
+        ]
+        heapq.heapify(heap)
+        while heap:
+            yield [
+                (doc_id, -score)
+                for score, _, doc_id in (heapq.heappop(heap) for _ in range(min(page_size, len(heap))))
+            ]
+
+    def score_documents(self, parsed_request, weight_function=logtf_idf_normalized):
         """
         Apply algorithm to find results from index.
         + params:
-            - index: ReverseIndex object where we look for results
+            - parsed_request: [token...] given by parse_request
             - weight_function: function which calculate weight of given term
         + return:
             {document_id: score}
@@ -83,33 +208,317 @@ class VectorialRequest(Request):
                         s[j] = s[j] / (sqrt(n[j]) * sqrt(nq))
                 return document_id list sorted by decreasing scores
         """
+        entries = [self.get_entry(token) for token in parsed_request]
         nq = 0
         ndj = {
             posting_id: 0
-            for token in self.parsed_request
-            for posting_id, _ in self.index[token][1]
+            for entry in entries
+            for posting_id, _ in entry[1]
         }
         s = {
             posting_id: 0
-            for token in self.parsed_request
-            for posting_id, _ in self.index[token][1]
+            for entry in entries
+            for posting_id, _ in entry[1]
         }
-        for token in self.parsed_request:
+        for entry in entries:
             wq = weight_function(
                 tf=1,
-                df=self.index[token][0],
+                df=entry[0],
                 collection=self.collection,
-                document_id=-1
+                document_id=-1,
+                statistics=self.index.statistics
             )
             nq += wq ** 2
-            for posting_id, doc_frequence in self.index[token][1]:
+            for posting_id, doc_frequence in entry[1]:
                 wj = weight_function(
                     tf=doc_frequence,
-                    df=self.index[token][0],
+                    df=entry[0],
                     collection=self.collection,
-                    document_id=posting_id
+                    document_id=posting_id,
+                    statistics=self.index.statistics
                 )
                 ndj[posting_id] += wj ** 2
                 s[posting_id] += wq * wj
-        s = {key: value / (sqrt(nq) * sqrt(ndj[key])) for key, value in s.items()}
-        return [doc_id for doc_id, _ in sorted(s.items(), key=lambda x: x[1], reverse=True)]
+        return {key: value / (sqrt(nq) * sqrt(ndj[key])) for key, value in s.items()}
+
+
+class NumpyVectorialRequest(VectorialRequest):
+    """
+    Same algorithm as VectorialRequest, term at a time, but each posting list
+    is loaded as numpy arrays and the weights are computed with the vectorized
+    ponderation functions (see models/ponderation.py). The scores are
+    accumulated in dense arrays indexed by document id, whose size is given
+    by the statistics of the index, needed for doc_len and tf_max.
+    The documents are kept in the order in which they are first found, so that
+    the documents with equal scores are ranked as with VectorialRequest.
+    """
+
+    @staticmethod
+    def posting_arrays(postings):
+        """
+        Returns the (document_ids, frequences, document id type) of a posting
+        list, the arrays being numpy arrays.
+        """
+        if isinstance(postings, PostingsView):
+            # the arrays of a compact index are used without copy
+            return (
+                np.frombuffer(postings.document_ids, dtype=np.uint32).astype(np.int64),
+                np.frombuffer(postings.frequences, dtype=np.uint32).astype(np.int64),
+                postings.doc_id_type,
+            )
+        if not len(postings):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), int
+        # CACM document ids are strings, they are parsed by numpy
+        arrays = np.array(postings).astype(np.int64).reshape(-1, 2)
+        return arrays[:, 0], arrays[:, 1], type(postings[0][0])
+
+    def score_arrays(self, parsed_request, weight_function=logtf_idf_normalized):
+        """
+        + return:
+            (document_ids, scores, document id type), the numpy arrays of the
+            documents found in the order in which they are first found
+        """
+        statistics = self.index.statistics
+        doc_lens = statistics.as_numpy('doc_lens')
+        tf_maxs = statistics.as_numpy('tf_maxs')
+        weight_array_function = vectorized(weight_function)
+        N = len(self.collection)
+
+        nq = 0
+        ndj = np.zeros(len(doc_lens))
+        s = np.zeros(len(doc_lens))
+        seen = np.zeros(len(doc_lens), dtype=bool)
+        found_document_ids = []
+        doc_id_type = int
+        for token in parsed_request:
+            frequence_col, postings = self.get_entry(token)
+            wq = weight_function(
+                tf=1,
+                df=frequence_col,
+                collection=self.collection,
+                document_id=-1,
+                statistics=statistics
+            )
+            nq += wq ** 2
+            document_ids, frequences, doc_id_type = self.posting_arrays(postings)
+            wj = weight_array_function(
+                tf=frequences,
+                df=frequence_col,
+                N=N,
+                doc_len=doc_lens[document_ids],
+                tf_max=tf_maxs[document_ids]
+            )
+            # the document ids of a posting list are unique
+            # float_power calls pow as Python does, while ** 2 multiplies wj by
+            # itself, which may differ in the last bit and change the ranking
+            ndj[document_ids] += np.float_power(wj, 2)
+            s[document_ids] += wq * wj
+            new_document_ids = document_ids[~seen[document_ids]]
+            seen[new_document_ids] = True
+            found_document_ids.append(new_document_ids)
+
+        document_ids = np.concatenate(found_document_ids) if found_document_ids else np.zeros(0, dtype=np.int64)
+        scores = s[document_ids] / (sqrt(nq) * np.sqrt(ndj[document_ids]))
+        return document_ids, scores, doc_id_type
+
+    def score_documents(self, parsed_request, weight_function=logtf_idf_normalized):
+        if self.index.statistics is None:
+            # without statistics the documents are scored one by one
+            return super().score_documents(parsed_request, weight_function)
+        document_ids, scores, doc_id_type = self.score_arrays(parsed_request, weight_function)
+        return dict(zip(map(doc_id_type, document_ids.tolist()), scores.tolist()))
+
+    def _ranked_arrays(self, parsed_request, weight_function):
+        """Returns the document_ids and scores sorted by decreasing scores"""
+        document_ids, scores, doc_id_type = self.score_arrays(parsed_request, weight_function)
+        # a stable sort keeps the documents with equal scores in the order they are found
+        ranks = np.argsort(-scores, kind='mergesort')
+        return document_ids[ranks], scores[ranks], doc_id_type
+
+    def find_results(self, parsed_request, weight_function=logtf_idf_normalized):
+        if self.index.statistics is None:
+            return super().find_results(parsed_request, weight_function)
+        document_ids, _, doc_id_type = self._ranked_arrays(parsed_request, weight_function)
+        return list(map(doc_id_type, document_ids.tolist()))
+
+    def find_top_results(self, parsed_request, k, weight_function=logtf_idf_normalized):
+        if self.index.statistics is None:
+            return super().find_top_results(parsed_request, k, weight_function)
+        document_ids, scores, doc_id_type = self._ranked_arrays(parsed_request, weight_function)
+        return len(document_ids), list(zip(
+            map(doc_id_type, document_ids[:k].tolist()),
+            scores[:k].tolist()
+        ))
+
+
+class MaxScoreVectorialRequest(VectorialRequest):
+    """
+    Same scores as VectorialRequest, but the k best documents are found
+    document at a time with the MaxScore algorithm, skipping the documents
+    which can not reach the score of the k-th best document found so far.
+
+    The score of a document d containing the set S of the request terms is
+        s(d) = sum(a_i * w_i,d for i in S) / sqrt(sum(w_i,d ** 2 for i in S))
+    with a_i = w_i,q / |q|, so by the Cauchy-Schwarz inequality
+        s(d) <= sqrt(sum(a_i ** 2 for i in S))
+    The bound of a term only depends on its weight in the request, given by
+    its frequence_col stored in the index. The terms are sorted by increasing
+    bound: the first ones, whose bounds together can not reach the threshold,
+    are non-essential. Only the documents of the essential terms are scored,
+    the non-essential posting lists being searched for these documents only.
+    """
+    # the documents skipped by MaxScore are not counted
+    exact_results_number = False
+    # margin on the bounds for the rounding errors of the scores
+    EPSILON = 1e-9
+
+    def find_top_results(self, parsed_request, k, weight_function=logtf_idf_normalized):
+        """
+        Returns the same top results as VectorialRequest.find_top_results,
+        including the order of the documents with equal scores. The number of
+        results is a lower bound: the documents skipped are not counted.
+        """
+        statistics = self.index.statistics
+        terms = list(dict.fromkeys(parsed_request))
+        frequences_col = {term: self.index.get_frequence_col(term) for term in terms}
+        wq = {
+            term: weight_function(
+                tf=1,
+                df=frequences_col[term],
+                collection=self.collection,
+                document_id=-1,
+                statistics=statistics
+            )
+            for term in terms
+        }
+        nq = 0
+        for token in parsed_request:
+            nq += wq[token] ** 2
+        if not nq or k <= 0:
+            return super().find_top_results(parsed_request, k, weight_function)
+
+        doc_id_type = self.index.document_id_type()
+        # cursors over the posting lists sorted by document id, current[term]
+        # being the document id of the cursor of term or None at the end
+        streams = {term: self.index.postings_stream(term) for term in terms}
+        current = {term: streams[term].seek(0) for term in terms}
+
+        squared_bounds = {
+            term: parsed_request.count(term) * (wq[term] ** 2 / nq)
+            for term in terms
+        }
+        sorted_terms = sorted(terms, key=lambda term: squared_bounds[term])
+        # prefix_bounds[e]: squared bound of the documents found in the e first terms only
+        prefix_bounds = [0]
+        for term in sorted_terms:
+            prefix_bounds.append(prefix_bounds[-1] + squared_bounds[term])
+        term_ranks = {term: rank for rank, term in enumerate(terms)}
+
+        visited = 0
+        heap = []
+        threshold = 0
+        essential = 0  # sorted_terms[:essential] are non-essential
+        while True:
+            document_id = min(
+                (current[term] for term in sorted_terms[essential:] if current[term] is not None),
+                default=None
+            )
+            if document_id is None:
+                break
+            visited += 1
+
+            # found[term]: (frequence, rank) of document_id in the posting list of term
+            found = {}
+            squared_bound = prefix_bounds[essential]
+            for term in sorted_terms[essential:]:
+                if current[term] == document_id:
+                    stream = streams[term]
+                    found[term] = stream.frequence(), stream.rank()
+                    squared_bound += squared_bounds[term]
+                    current[term] = stream.seek(document_id + 1)
+            if len(heap) == k and sqrt(squared_bound) * (1 + self.EPSILON) < threshold:
+                continue
+
+            # the non-essential terms with the largest bounds are searched first
+            for term in reversed(sorted_terms[:essential]):
+                stream = streams[term]
+                if current[term] is not None and current[term] < document_id:
+                    current[term] = stream.seek(document_id)
+                if current[term] == document_id:
+                    found[term] = stream.frequence(), stream.rank()
+                else:
+                    squared_bound -= squared_bounds[term]
+                    if len(heap) == k and sqrt(squared_bound) * (1 + self.EPSILON) < threshold:
+                        break
+            else:
+                # exact score, with the operations of VectorialRequest.score_documents
+                s = 0
+                ndj = 0
+                for token in parsed_request:
+                    if token in found:
+                        wj = weight_function(
+                            tf=found[token][0],
+                            df=frequences_col[token],
+                            collection=self.collection,
+                            document_id=doc_id_type(document_id),
+                            statistics=statistics
+                        )
+                        ndj += wj ** 2
+                        s += wq[token] * wj
+                score = s / (sqrt(nq) * sqrt(ndj))
+                # VectorialRequest ranks the equal scores in the order the documents are found
+                first_term = min(found, key=term_ranks.get)
+                item = (score, -term_ranks[first_term], -found[first_term][1], document_id)
+                if len(heap) < k:
+                    heapq.heappush(heap, item)
+                elif item > heap[0]:
+                    heapq.heapreplace(heap, item)
+                if len(heap) == k:
+                    threshold = heap[0][0]
+                    while essential < len(sorted_terms) and \
+                            sqrt(prefix_bounds[essential + 1]) * (1 + self.EPSILON) < threshold:
+                        essential += 1
+
+        results_number = max([visited] + list(frequences_col.values()))
+        return results_number, [
+            (doc_id_type(document_id), score)
+            for score, _, _, document_id in sorted(heap, reverse=True)
+        ]
+
+
+class ChampionListsRequest(NumpyVectorialRequest):
+    """
+    This class scores the documents of the champion lists of the request
+    terms only (see models/champions.py), instead of their full posting lists.
+    """
+
+    def get_entry(self, token):
+        return self.index.champion_entry(token)
+
+
+class ChampionVectorialRequest(NumpyVectorialRequest):
+    """
+    Approximate top k: the documents are scored with the champion lists of
+    the request terms only (see ChampionListsRequest), the full posting lists
+    being used when the champion lists give less than k documents.
+    The index needs to be built with champion lists and load_champions called,
+    otherwise the full posting lists are scored.
+    When the champion lists are used, the number of documents found is the
+    largest frequence_col of the request terms, a lower bound of the number
+    of documents of their full posting lists.
+    """
+    exact_results_number = False
+
+    def __init__(self, index, collection):
+        super().__init__(index, collection)
+        self.champion_request = ChampionListsRequest(index, collection)
+
+    def find_top_results(self, parsed_request, k, weight_function=logtf_idf_normalized):
+        if self.index.champion_lists is None:
+            return super().find_top_results(parsed_request, k, weight_function)
+        results_number, top_results = self.champion_request.find_top_results(parsed_request, k, weight_function)
+        if results_number < k:
+            return super().find_top_results(parsed_request, k, weight_function)
+        return max(
+            [results_number] + [self.index.get_frequence_col(token) for token in parsed_request]
+        ), top_results
@@ -1,9 +1,27 @@
 import operator
+import heapq
 import json
 import os
+import re
+import shutil
+from collections import Counter
 from datetime import datetime
+from time import time
+from itertools import groupby
+from multiprocessing import Pool
 import linecache
 
+from models.bitmap import RoaringBitmap, TermBitmaps, TermBitmapsWriter
+from models.cache import PostingsCache
+from models.champions import ChampionLists, ChampionListsWriter
+from models.codec import get_codec
+from models.compact_index import CompactIndex
+from models.segment import Segment, SegmentWriter
+from models.statistics import DocumentStatistics
+from models.streams import ListStream
+from models.term_dictionary import TermDictionary
+from models.universe import DocumentUniverse
+
 
 class ReverseIndex(object):
     """
@@ -11,17 +29,76 @@ class ReverseIndex(object):
     + attributes:
         - reverse_index: contains the reverse index with the following structure:
             {term: [frequence_col, [(document_id, frequence_doc)...]]}
+        a list indexed by term_id when loaded with load_from_file, or a
+        CompactIndex object when loaded with load_compact
         - term_dict: dict that contains all the terms of all the documents and
-        their affected id under the form {term: id} (~ hashing table)
+        their affected id under the form {term: id} (~ hashing table), or a
+        TermDictionary object when loaded from the term dictionary file (see
+        models/term_dictionary.py)
         - term_id: attribute used to keep track of the last attributed id
         - name: name of the index (for the file to be exported as name.index)
         - index_in_memory: tells if the index has been loaded in memory or
         should be read directly from disk
+        - segment: Segment object giving access to the binary segment files
+        of the index, used instead of the json index when the index is read
+        from disk (see models/segment.py)
+        - workers: number of processes used to map the blocs in parallel
+        - reducers: number of processes used to merge the partial indexes,
+        each reducer merging a range of term_id
+        - strategy: 'bsbi' to build the term dict before mapping the blocs,
+        or 'spimi' to build the index in a single pass (see SPIMIIndexer)
+        - max_postings: number of postings kept in memory by a mapper or by
+        the SPIMI indexer before writing a sorted run on disk, if None the
+        mappers write one run per bloc
+        - codec: name of the codec used to compress the posting lists of the
+        segment (see models/codec.py)
+        - statistics: DocumentStatistics object giving the length, tf_max and
+        norms of the documents, used by the ponderation functions (see
+        models/statistics.py)
+        - champions: number of postings of the champion list of each term
+        written with the index, no champion lists are written if None
+        - champion_lists: ChampionLists object giving the postings with the
+        largest weights of each term (see models/champions.py)
+        - universe: DocumentUniverse object containing the ids of all the
+        documents of the index, used to evaluate the NOT operator (see
+        models/universe.py)
+        - bitmaps: min frequence_col of the terms whose bitmaps are written
+        with the index, no bitmaps are written if None
+        - term_bitmaps: TermBitmaps object giving the prebuilt bitmaps of the
+        frequent terms (see models/bitmap.py)
+        - version: incremented each time the index is built or loaded, the
+        cached plans and results of the boolean requests of an older version
+        are dropped (see models/cache.py)
+        - postings_cache: PostingsCache object keeping the posting lists read
+        from disk, or None (see models/cache.py)
     + core methods:
         - load_from_file: load the reverse index contained in the given text
-        file
-        - load_hash_table: load the dict {term: id} from the file. Needed to
-        access the index entries
+        file, with one or several processes
+        - load_term_dictionary: open the sorted term dictionary file giving
+        the id of each term. Needed to access the index entries
+        - load_hash_table: load the dict {term: id} from the json file written
+        by the older versions of the index
+        - load_segment: open the binary segment files of the index to read
+        the index entries from disk
+        - load_compact: load the binary segment of the index in memory, in
+        flat arrays (see models/compact_index.py)
+        - load_statistics: load the statistics of the documents of the index
+        - load_champions: open the champion lists file of the index
+        - champion_entry: returns [frequence_col, champion list] for a term
+        - get_frequence_col: returns the frequence_col of a term, used by the
+        boolean query planner (see models/planner.py)
+        - get_universe: returns the ids of all the documents of the index
+        - document_stream: returns a stream over the sorted integer ids of
+        the documents of a term, used by the boolean requests (see
+        models/streams.py)
+        - document_bitmap: returns the RoaringBitmap of the ids of the
+        documents of a term, used by the boolean requests evaluated with
+        bitmaps (see models/bitmap.py)
+        - load_bitmaps: open the term bitmaps file of the index
+        - cache_postings: keep the posting lists read from disk in a cache
+        of a given number of bytes
+        - warm_up: read in the cache the posting lists of the terms found
+        the most often in a list of requests
         - create_index: create reverse_index from given document_collection
     + wrapping methods:
         - __getitem__: returns the index entry, from self.reverse_index or
@@ -32,27 +109,75 @@ class ReverseIndex(object):
         index
     """
 
-    def __init__(self, document_collection=None, name=''):
+    # approximate size in bytes of the chunks of lines decoded at once when
+    # loading the json index
+    load_chunk_size = 16 * 1024 * 1024
+
+    def __init__(self, document_collection=None, name='', workers=1, reducers=1,
+                 strategy='bsbi', max_postings=None, codec='raw', champions=None,
+                 bitmaps=None):
         """
         We init the reverse_index attribute to an empty dict.
-        If a document collection, we initialize reverse_index calling create_index method.
+        If a document collection, we initialize reverse_index calling create_index method,
+        or create_index_spimi method for the 'spimi' strategy.
         """
         self.reverse_index = {}
         self.term_dict = {}
         self.name = name
         self.term_id = 0
         self.index_in_memory = False
+        self.segment = None
+        self.workers = workers
+        self.reducers = reducers
+        self.strategy = strategy
+        self.max_postings = max_postings
+        self.codec = codec
+        self.statistics = None
+        self.champions = champions
+        self.champion_lists = None
+        self.universe = None
+        self.universe_bitmap = None
+        self.bitmaps = bitmaps
+        self.term_bitmaps = None
+        self.version = 0
+        self.postings_cache = None
         if document_collection:
-            self._parse_all_terms(document_collection)
-            self._save_hash_table()
-            self.create_index(document_collection)
+            if self.strategy == 'spimi':
+                self.create_index_spimi(document_collection)
+                self._save_term_dictionary()
+            else:
+                self._parse_all_terms(document_collection)
+                self._save_term_dictionary()
+                self.create_index(document_collection)
+            self._save_segment()
+            self._save_statistics(document_collection)
+            self._save_universe()
+            if self.champions:
+                self._save_champions(document_collection)
+            if self.bitmaps:
+                self._save_bitmaps()
+            self.version += 1
+
+    def _iter_documents(self, document_collection):
+        """
+        Yields all the documents of the collection, bloc after bloc.
+        """
+        raise NotImplementedError
 
     def _parse_all_terms(self, document_collection):
         """
         This method collects all the terms that exists in all the documents,
         and give them a unique id, filling the self.term_dict dictionnary
         """
-        raise NotImplementedError
+        begin = datetime.now()
+        for document in self._iter_documents(document_collection):
+            for token in document.term_bag:
+                try:
+                    self.term_dict[token]  # check if the term already exists
+                except KeyError:
+                    self.term_dict[token] = self.term_id
+                    self.term_id += 1
+        print("======= Generating term id dictionnary time : ", datetime.now() - begin, " =======")
 
     def create_index(self, document_collection):
         """
@@ -60,31 +185,331 @@ class ReverseIndex(object):
         """
         raise NotImplementedError
 
-    def load_from_file(self, filepath):
-        self.load_hash_table()
+    def create_index_spimi(self, document_collection):
+        """
+        Creates the index in a single pass over the collection: the term_ids
+        are given on the fly and the sorted runs written by the SPIMI indexer
+        are merged by the reducers.
+        """
+        begin = datetime.now()
+        run_filepaths = SPIMIIndexer.index(
+            self.term_dict,
+            self._iter_documents(document_collection),
+            os.path.join('temp', self.name) + '.index',
+            self.max_postings or SPIMIIndexer.max_postings
+        )
+        self.term_id = len(self.term_dict)
+        print("======= Time for indexing : ", datetime.now() - begin, " =======")
+
+        begin = datetime.now()
+        bounds = self._partition_bounds()
+        if bounds is not None:
+            # the term_id ranges are only known once every run is written
+            for filepath in run_filepaths:
+                with open(filepath, 'r', Reducer.read_buffer_size) as run_file:
+                    Mapper.write_entries(Reducer.read_entries(run_file), filepath, bounds)
+        self._reduce(run_filepaths)
+        print("======= Time for reducing : ", datetime.now() - begin, " =======")
+
+    def _partition_bounds(self):
+        """
+        Returns the term_id ranges the mappers must split their output into,
+        or None when only one reducer is used.
+        """
+        if self.reducers > 1:
+            return Reducer.partition_bounds(len(self.term_dict), self.reducers)
+        return None
+
+    def _reduce(self, file_paths):
+        """
+        Merges the partial indexes written by the mappers into the final
+        name.index file, with one or several reducers.
+        """
+        output_filepath = os.path.join('Data', 'Index', self.name) + '.index'
+        if self.reducers > 1:
+            Reducer.reduce_partitioned(file_paths, output_filepath, self.reducers)
+        else:
+            Reducer.reduce(file_paths, output_filepath)
+
+    def load_from_file(self, filepath, workers=1):
+        """
+        Loads the json index in memory. The file is read by chunks of lines,
+        each chunk being decoded with a single json.loads call, in parallel
+        when workers > 1.
+        """
+        begin = time()
+        self.load_term_dictionary()
+        # the term dictionary gives the number of entries, and the term_ids are
+        # the positions in the list
+        self.reverse_index = [None] * len(self.term_dict)
         with open(filepath, 'r') as index_file:
-            line = index_file.readline()
-            i = 0
-            while line != '':  # EOF
-                if i % 1000 == 0:
-                    print("LINE READ : ", i)
-                # entry is like (term_id, [frequence_col, [(document_id, frequence_doc, doc_len)...]])
-                line = index_file.readline()
-                if line == '':  # EOF
-                    break
-                entry = json.loads(line)
-                self.reverse_index[entry[0]] = entry[1]
-                i += 1
+            chunks = iter(lambda: index_file.readlines(ReverseIndex.load_chunk_size), [])
+            if workers > 1:
+                # the workers are terminated even if a chunk can not be decoded
+                with Pool(workers) as pool:
+                    postings_number = self._store_entries(pool.imap(ReverseIndex._decode_chunk, chunks))
+            else:
+                postings_number = self._store_entries(map(ReverseIndex._decode_chunk, chunks))
         self.index_in_memory = True
+        self.version += 1
+
+        duration = time() - begin
+        size = os.path.getsize(filepath) / 1024 / 1024
+        print("======= Index loaded : {:.2f} MB in {:.2f} s ({:.2f} MB/s, {:.0f} postings/s) =======".format(
+            size,
+            duration,
+            size / duration,
+            postings_number / duration
+        ))
+
+    def _store_entries(self, decoded_chunks):
+        """Stores the decoded entries in self.reverse_index, returns the number of postings"""
+        postings_number = 0
+        # entry is like (term_id, [frequence_col, [(document_id, frequence_doc)...]])
+        for entries in decoded_chunks:
+            for term_id, entry in entries:
+                self.reverse_index[term_id] = entry
+                postings_number += entry[0]
+        return postings_number
 
-    def _save_hash_table(self):
-        with open(os.path.join('Data', 'Index', self.name) + '.hash', 'w') as hash_file:
-            json.dump(self.term_dict, hash_file)
+    @staticmethod
+    def _decode_chunk(lines):
+        """Decodes a list of json index lines at once"""
+        return json.loads('[' + ','.join(lines) + ']')
+
+    def _save_term_dictionary(self):
+        TermDictionary.write(self.term_dict, os.path.join('Data', 'Index', self.name) + '.terms')
+
+    def load_term_dictionary(self):
+        """Opens the term dictionary file, or the json hash table of an older index"""
+        filepath = os.path.join('Data', 'Index', self.name) + '.terms'
+        if os.path.exists(filepath):
+            self.term_dict = TermDictionary(filepath)
+        else:
+            self.load_hash_table()
+        self.version += 1
 
     def load_hash_table(self):
         with open(os.path.join('Data', 'Index', self.name) + '.hash', 'r') as hash_file:
             self.term_dict = json.load(hash_file)
 
+    def _save_segment(self):
+        begin = datetime.now()
+        SegmentWriter.write_from_index(
+            os.path.join('Data', 'Index', self.name) + '.index',
+            os.path.join('Data', 'Index', self.name),
+            get_codec(self.codec)
+        )
+        print("======= Time for writing segment : ", datetime.now() - begin, " =======")
+
+    def _save_statistics(self, document_collection):
+        begin = datetime.now()
+        self.statistics = DocumentStatistics.build_from_index(
+            os.path.join('Data', 'Index', self.name) + '.index',
+            document_collection
+        )
+        self.statistics.save(os.path.join('Data', 'Index', self.name) + '.stats')
+        print("======= Time for computing document statistics : ", datetime.now() - begin, " =======")
+
+    def load_statistics(self):
+        """Loads the statistics of the documents, if they have been computed for this index"""
+        filepath = os.path.join('Data', 'Index', self.name) + '.stats'
+        if os.path.exists(filepath):
+            self.statistics = DocumentStatistics.load(filepath)
+
+    def _save_universe(self):
+        # the documents of the index are the documents with a length
+        self.universe = DocumentUniverse.from_document_ids(
+            self.statistics.document_ids(),
+            self.statistics.doc_id_type
+        )
+        self.universe.save(os.path.join('Data', 'Index', self.name) + '.universe')
+
+    def load_universe(self):
+        """Loads the universe, if it has been written for this index"""
+        filepath = os.path.join('Data', 'Index', self.name) + '.universe'
+        if os.path.exists(filepath):
+            self.universe = DocumentUniverse.load(filepath)
+
+    def get_universe(self):
+        """
+        Returns the universe of the index, loaded from its file or, for the
+        indexes written without universe, built from all the posting lists.
+        """
+        if self.universe is None:
+            self.load_universe()
+        if self.universe is None:
+            document_ids = {
+                posting_id
+                for term in self.keys()
+                for posting_id, _ in self[term][1]
+            }
+            doc_id_type = type(next(iter(document_ids))) if document_ids else int
+            self.universe = DocumentUniverse.from_document_ids(map(int, document_ids), doc_id_type)
+        return self.universe
+
+    def document_id_type(self):
+        """Returns the type of the document ids of the index"""
+        if self.index_in_memory and isinstance(self.reverse_index, CompactIndex):
+            return self.reverse_index.doc_id_type
+        elif self.segment is not None:
+            return self.segment.doc_id_type
+        elif self.statistics is not None:
+            return self.statistics.doc_id_type
+        return self.get_universe().doc_id_type
+
+    def document_stream(self, term):
+        """
+        Returns a stream over the sorted integer ids of the documents of term:
+        the skip pointers of the segment are used when the index is read from
+        disk, and the arrays of the compact index are used without copy.
+        """
+        term_id = self.term_dict[term]
+        if self.index_in_memory and isinstance(self.reverse_index, CompactIndex):
+            return ListStream(self.reverse_index[term_id][1].document_ids)
+        elif not self.index_in_memory and self.segment is not None:
+            return self.segment.stream(term_id)
+        return ListStream(sorted(int(document_id) for document_id, _ in self[term][1]))
+
+    def postings_stream(self, term):
+        """
+        Returns a stream over the sorted integer ids of the documents of term
+        and their frequences (see ListStream.frequence and rank): read without
+        copy from the compact index or block by block from the segment, the
+        other posting lists, which may not be sorted by document id, are
+        sorted with the ranks of their postings.
+        """
+        term_id = self.term_dict[term]
+        if self.index_in_memory and isinstance(self.reverse_index, CompactIndex):
+            view = self.reverse_index[term_id][1]
+            return ListStream(view.document_ids, view.frequences)
+        elif not self.index_in_memory and self.segment is not None:
+            return self.segment.stream(term_id)
+        postings = sorted(
+            (int(document_id), frequence, rank)
+            for rank, (document_id, frequence) in enumerate(self[term][1])
+        )
+        return ListStream(
+            [document_id for document_id, _, _ in postings],
+            [frequence for _, frequence, _ in postings],
+            [rank for _, _, rank in postings],
+        )
+
+    def get_universe_bitmap(self):
+        """Returns the universe of the index as a RoaringBitmap of run containers"""
+        if self.universe_bitmap is None:
+            self.universe_bitmap = RoaringBitmap.from_ranges(self.get_universe().ranges)
+        return self.universe_bitmap
+
+    def document_bitmap(self, term):
+        """
+        Returns the RoaringBitmap of the sorted integer ids of the documents
+        of term: the bitmap written with the index for the frequent terms, or
+        the bitmap built from the posting list.
+        """
+        term_id = self.term_dict[term]
+        if self.term_bitmaps is not None:
+            bitmap = self.term_bitmaps.get(term_id)
+            if bitmap is not None:
+                return bitmap
+        if self.index_in_memory and isinstance(self.reverse_index, CompactIndex):
+            return RoaringBitmap.from_sorted(self.reverse_index[term_id][1].document_ids)
+        return RoaringBitmap.from_sorted(list(self.document_stream(term)))
+
+    def _save_bitmaps(self):
+        begin = datetime.now()
+        filepath = os.path.join('Data', 'Index', self.name) + '.bitmaps'
+        TermBitmapsWriter.write_from_index(
+            os.path.join('Data', 'Index', self.name) + '.index',
+            filepath,
+            self.bitmaps
+        )
+        self.term_bitmaps = TermBitmaps(filepath)
+        print("======= Time for writing term bitmaps : ", datetime.now() - begin, " =======")
+
+    def load_bitmaps(self):
+        """Opens the term bitmaps, if they have been written for this index"""
+        filepath = os.path.join('Data', 'Index', self.name) + '.bitmaps'
+        if os.path.exists(filepath):
+            self.term_bitmaps = TermBitmaps(filepath)
+
+    def _save_champions(self, document_collection):
+        begin = datetime.now()
+        filepath = os.path.join('Data', 'Index', self.name) + '.champions'
+        ChampionListsWriter.write_from_index(
+            os.path.join('Data', 'Index', self.name) + '.index',
+            filepath,
+            self.champions,
+            document_collection,
+            self.statistics
+        )
+        self.champion_lists = ChampionLists(filepath)
+        print("======= Time for writing champion lists : ", datetime.now() - begin, " =======")
+
+    def load_champions(self):
+        """Opens the champion lists, if they have been written for this index"""
+        filepath = os.path.join('Data', 'Index', self.name) + '.champions'
+        if os.path.exists(filepath):
+            self.champion_lists = ChampionLists(filepath)
+
+    def get_frequence_col(self, term):
+        """Returns the frequence_col of term without reading its posting list if possible"""
+        term_id = self.term_dict[term]
+        if self.index_in_memory:
+            return self.reverse_index[term_id][0]
+        elif self.segment is not None:
+            return self.segment.record(term_id)[2]
+        return self[term][0]
+
+    def champion_entry(self, term):
+        """Returns [frequence_col, champion list] without reading the full posting list if possible"""
+        return [self.get_frequence_col(term), self.champion_lists[self.term_dict[term]]]
+
+    def load_segment(self):
+        self.segment = Segment(os.path.join('Data', 'Index', self.name))
+        self.version += 1
+
+    def load_compact(self):
+        self.load_term_dictionary()
+        segment = Segment(os.path.join('Data', 'Index', self.name))
+        self.reverse_index = CompactIndex.load_from_segment(segment)
+        segment.close()
+        self.index_in_memory = True
+        self.version += 1
+
+    def cache_postings(self, budget, policy='lru'):
+        """
+        Keeps the posting lists read from disk in a PostingsCache of budget
+        bytes, whose policy is 'lru' or 'lfu'. Useless when the index is
+        loaded in memory.
+        """
+        self.postings_cache = PostingsCache(budget, policy)
+
+    def warm_up(self, raw_requests):
+        """
+        Reads in the posting lists cache the posting lists of the terms found
+        the most often in raw_requests (boolean or vectorial requests), the
+        posting lists which do not fit in the rest of the budget being
+        skipped. The hits and misses of the cache are counted from zero
+        after the warm up.
+        + return:
+            the number of posting lists cached
+        """
+        terms = Counter(
+            term
+            for raw_request in raw_requests
+            for term in re.split(r'[\s!()&|]+', raw_request.lower())
+            if term in self.keys()
+        )
+        loaded = 0
+        for term, _ in terms.most_common():
+            term_id = self.term_dict[term]
+            self.postings_cache.put(self.version, term_id, self._read_entry(term_id), evict=False)
+            loaded += term_id in self.postings_cache
+        self.postings_cache.hits = 0
+        self.postings_cache.misses = 0
+        return loaded
+
     def __getitem__(self, term):
         """Returns the index entry when seeking a term"""
         term_id = self.term_dict[term]
@@ -95,6 +520,19 @@ class ReverseIndex(object):
         # Cons : access will be slower since we read the disk
         if self.index_in_memory:
             return self.reverse_index[term_id]
+        elif self.postings_cache is not None:
+            # the posting lists read from disk are kept in the cache
+            entry = self.postings_cache.get(self.version, term_id)
+            if entry is None:
+                entry = self.postings_cache.put(self.version, term_id, self._read_entry(term_id))
+            return entry
+        return self._read_entry(term_id)
+
+    def _read_entry(self, term_id):
+        """Reads the index entry of term_id from disk"""
+        if self.segment is not None:
+            # the offset table gives directly the position of the posting list
+            return self.segment[term_id]
         else:
             # entry is like (term_id, [frequence_col, [(document_id, frequence_doc, doc_len)...]])
             line = linecache.getline(os.path.join('Data', 'Index',  self.name) + '.index', term_id + 1)
@@ -114,88 +552,74 @@ class CACMReverseIndex(ReverseIndex):
 
     term_id = 0
 
-    def __init__(self, document_collection=None):
-        super().__init__(document_collection, name='cacm')
+    def __init__(self, document_collection=None, **kwargs):
+        super().__init__(document_collection, name='cacm', **kwargs)
 
-    def _parse_all_terms(self, document_collection):
-        begin = datetime.now()
-        for document in document_collection.values():
-            for token in document.term_bag:
-                try:
-                    self.term_dict[token]  # check if the term already exists
-                except KeyError:
-                    self.term_dict[token] = self.term_id
-                    self.term_id += 1
-        print("======= Generating term id dictionnary time : ", datetime.now() - begin, " =======")
+    def _iter_documents(self, document_collection):
+        return iter(document_collection.values())
 
     def create_index(self, document_collection):
         """
         We have only one bloc for that small collection
         """
         begin = datetime.now()
-        Mapper.map(
+        run_filepaths = Mapper.map(
             self.term_dict,
             document_collection,
-            os.path.join('temp', document_collection.name) + '.index'
+            os.path.join('temp', document_collection.name) + '.index',
+            self._partition_bounds(),
+            self.max_postings
         )
         print("======= Time for mapping : ", datetime.now() - begin, " =======")
 
         # it takes some time before the mapping is finished and the reducing
         # phase can starts
         begin = datetime.now()
-        # Here we use only one reducer, that is enought to merge the indexes
-        # in one time because we read the partial text indexes line by line
-        file_paths = [os.path.join('temp', document_collection.name) + '.index']
-        Reducer.reduce(
-            file_paths,
-            os.path.join('Data', 'Index', 'cacm.index')
-        )
+        self._reduce(run_filepaths)
         print("======= Time for reducing : ", datetime.now() - begin, " =======")
 
 
 class StanfordReverseIndex(ReverseIndex):
 
-    def __init__(self, document_collection=None):
-        super().__init__(document_collection, name='cs276')
+    def __init__(self, document_collection=None, **kwargs):
+        super().__init__(document_collection, name='cs276', **kwargs)
 
-    def _parse_all_terms(self, document_collection):
-        begin = datetime.now()
-        for collection in document_collection.values():
-            for document in collection:
-                for token in document.term_bag:
-                    try:
-                        self.term_dict[token]  # check if the term already exists
-                    except KeyError:
-                        self.term_dict[token] = self.term_id
-                        self.term_id += 1
-        print("======= Generating term id dictionnary time : ", datetime.now() - begin, " =======")
+    def _iter_documents(self, meta_document_collection):
+        for collection in meta_document_collection.get_collections():
+            for document in collection.values():
+                yield document
 
     def create_index(self, meta_document_collection):
         """
         Each bloc is a sub-collection of Stanford collection (ie
-        a bloc = collection formed by all the files in a folder)
+        a bloc = collection formed by all the files in a folder).
+        When self.workers > 1, the blocs are mapped in parallel, each worker
+        process writing its own partial index files.
         """
         begin = datetime.now()
-        for collection in meta_document_collection.get_collections():
-            # print(collection)
-            # send collections as blocs to the mapper
-            Mapper.map(
-                self.term_dict,
+        blocs = [
+            (
                 collection,
-                os.path.join('temp', collection.name) + '.index'
+                os.path.join('temp', collection.name) + '.index',
+                self._partition_bounds(),
+                self.max_postings
             )
+            for collection in meta_document_collection.get_collections()
+        ]
+        if self.workers > 1:
+            # the term dict is sent once to each worker instead of once per bloc
+            with Pool(self.workers, initializer=Mapper.init_worker, initargs=(self.term_dict,)) as pool:
+                bloc_run_filepaths = pool.starmap(Mapper.map_bloc, blocs)
+        else:
+            # send collections as blocs to the mapper
+            bloc_run_filepaths = [Mapper.map(self.term_dict, *bloc) for bloc in blocs]
         print("======= Time for mapping : ", datetime.now() - begin, " =======")
 
         # it takes some time before the mapping is finished and the reducing
         # phase can starts
         begin = datetime.now()
-        # Here we use only one reducer, that is enought to merge the indexes
-        # in one time because we read the partial text indexes line by line
-        file_paths = [os.path.join('temp', collection.name) + '.index' for collection in meta_document_collection.get_collections()]
-        Reducer.reduce(
-            file_paths,
-            os.path.join('Data', 'Index', 'cs276.index')
-        )
+        # runs are given bloc after bloc to keep the posting lists sorted
+        self._reduce([filepath for run_filepaths in bloc_run_filepaths for filepath in run_filepaths])
         print("======= Time for reducing : ", datetime.now() - begin, " =======")
 
 
@@ -204,25 +628,54 @@ class Mapper(object):
     Class defining a mapper that takes a bloc, parse it, sort the terms
     following their term_id and write the result to a text file as json
     """
+    # term dict shared by all the blocs mapped in a worker process
+    worker_term_dict = None
 
     @staticmethod
-    def map(term_dict, collection, filepath):
+    def init_worker(term_dict):
+        """Initializer of the worker processes used to map blocs in parallel"""
+        Mapper.worker_term_dict = term_dict
+
+    @staticmethod
+    def map_bloc(collection, filepath, bounds=None, max_postings=None):
+        """Maps a bloc in a worker process, using the term dict of the worker"""
+        return Mapper.map(Mapper.worker_term_dict, collection, filepath, bounds, max_postings)
+
+    @staticmethod
+    def run_filepath(filepath, run):
+        """Returns the path of the run number run of the index filepath"""
+        return '{}.run{}'.format(filepath, run)
+
+    @staticmethod
+    def map(term_dict, collection, filepath, bounds=None, max_postings=None):
         """
         + attributes:
             - term_dict : dict containing all the possible terms and their id
             - collection : object of type Collection containing all the
             documents that need to be indexed
             - filepath: path where the partial index must be stored
+            - bounds: first term_id of each range given by
+            Reducer.partition_bounds, if given the partial index is split in
+            one file per range (see Reducer.partition_filepath)
+            - max_postings: if given, a sorted run is written each time this
+            number of postings is held in memory (see Mapper.run_filepath)
+            instead of a single partial index for the whole bloc
+        + return: list of the partial index filepaths, in the order of the
+        documents
         """
+        run_filepaths = []
         # dictionnary that contains all the (term_id, term) tuple_list
         # will be sorted later
         # form : {term_id: [frequence_col, [(document_id, frequence_doc, doc_len)...]]}
         term_id_dict = {}
+        postings_number = 0
         for index, doc in enumerate(collection.values()):
             if index % 1000 == 0:
                 print("GETTING TERM OF INDEX :", index)
 
-            for term, frequence in doc.term_bag.items():
+            term_bag = doc.term_bag
+            postings_number += len(term_bag)
+            for term, frequence in term_bag.items():
                 term_id = term_dict[term]
                 try:
                     term_id_dict[term_id][0] += 1
@@ -235,24 +688,147 @@ class Mapper(object):
                         [(doc.id, frequence)]
                     ]
 
+            if max_postings and postings_number >= max_postings:
+                # the memory budget is reached, the postings are spilled
+                run_filepaths.append(Mapper.run_filepath(filepath, len(run_filepaths)))
+                Mapper.write_run(term_id_dict, run_filepaths[-1], bounds)
+                print("FILE FINISHED", run_filepaths[-1])
+                term_id_dict = {}
+                postings_number = 0
+
+        if not max_postings:
+            run_filepaths.append(filepath)
+        elif term_id_dict or not run_filepaths:
+            run_filepaths.append(Mapper.run_filepath(filepath, len(run_filepaths)))
+        else:
+            return run_filepaths
+        Mapper.write_run(term_id_dict, run_filepaths[-1], bounds)
+        print("FILE FINISHED", run_filepaths[-1])
+        return run_filepaths
+
+    @staticmethod
+    def write_run(term_id_dict, filepath, bounds=None):
+        """
+        Sorts the given {term_id: [frequence_col, [(document_id, frequence_doc)...]]}
+        dict by term_id and writes it as a partial index.
+        """
         # all the elements from the collection are in the dictionnary, we now
         # sort them by term_id
         sorted_terms = sorted(term_id_dict.items(), key=operator.itemgetter(0))
         # store sorted keys line by line in the file so that lines can be
         # extracted one by one when merging the list
-        with open(filepath, 'a') as partial_index_file:
-            for k in sorted_terms:
-                line = json.dumps(k)
-                partial_index_file.write(line)
-                partial_index_file.write('\n')
-        print("FILE FINISHED", filepath)
+        Mapper.write_entries(
+            ((k[0], json.dumps(k) + '\n') for k in sorted_terms),
+            filepath,
+            bounds
+        )
+
+    @staticmethod
+    def write_entries(entries, filepath, bounds=None):
+        """
+        Writes sorted (term_id, line) tuples in filepath, or in one file per
+        term_id range if bounds is given.
+        """
+        if bounds is None:
+            with open(filepath, 'w') as partial_index_file:
+                partial_index_file.writelines(line for _, line in entries)
+            return
+
+        # every range file is created, even empty, so that each reducer finds
+        # one file per bloc
+        partition = 0
+        partial_index_file = open(Reducer.partition_filepath(filepath, partition), 'w')
+        for term_id, line in entries:
+            while partition + 1 < len(bounds) and term_id >= bounds[partition + 1]:
+                partial_index_file.close()
+                partition += 1
+                partial_index_file = open(Reducer.partition_filepath(filepath, partition), 'w')
+            partial_index_file.write(line)
+        partial_index_file.close()
+        for partition in range(partition + 1, len(bounds)):
+            open(Reducer.partition_filepath(filepath, partition), 'w').close()
+
+
+class SPIMIIndexer(object):
+    """
+    Class defining a single-pass in-memory indexer: the documents are read
+    only once, the term_ids are given on the fly and the postings are
+    accumulated in memory until max_postings is reached. The accumulated
+    postings are then sorted by term_id and written as a run, that will be
+    merged by the reducers with the runs of the other blocs.
+    """
+    # default number of postings kept in memory before writing a run
+    max_postings = 1000000
+
+    @staticmethod
+    def index(term_dict, documents, filepath, max_postings):
+        """
+        + attributes:
+            - term_dict: dict filled with the terms and their id, ids are given
+            in the order the terms are met in the documents
+            - documents: iterable over all the documents to index
+            - filepath: base path of the runs to write (see Mapper.run_filepath)
+            - max_postings: number of postings kept in memory before writing
+            a run
+        + return: list of the run filepaths, in the order of the documents
+        """
+        run_filepaths = []
+        # form : {term_id: [frequence_col, [(document_id, frequence_doc)...]]}
+        term_id_dict = {}
+        postings_number = 0
+        for index, doc in enumerate(documents):
+            if index % 1000 == 0:
+                print("GETTING TERM OF INDEX :", index)
+
+            # the term bag is built only once per document
+            term_bag = doc.term_bag
+            for term, frequence in term_bag.items():
+                try:
+                    term_id = term_dict[term]
+                except KeyError:
+                    term_id = term_dict[term] = len(term_dict)
+                try:
+                    term_id_dict[term_id][0] += 1
+                    term_id_dict[term_id][1].append((doc.id, frequence))
+                except KeyError:
+                    term_id_dict[term_id] = [1, [(doc.id, frequence)]]
+
+            postings_number += len(term_bag)
+            if postings_number >= max_postings:
+                run_filepaths.append(Mapper.run_filepath(filepath, len(run_filepaths)))
+                Mapper.write_run(term_id_dict, run_filepaths[-1])
+                print("FILE FINISHED", run_filepaths[-1])
+                term_id_dict = {}
+                postings_number = 0
+
+        if term_id_dict or not run_filepaths:
+            run_filepaths.append(Mapper.run_filepath(filepath, len(run_filepaths)))
+            Mapper.write_run(term_id_dict, run_filepaths[-1])
+            print("FILE FINISHED", run_filepaths[-1])
+        return run_filepaths
 
 
 class Reducer(object):
     """
     Class defining a reducer that takes many blocs as input, defined as json
     text files, and merge them into one bloc with external sorting method.
+    The k-way merge uses a priority queue over the partial index files, so
+    selecting the next index entry costs O(log(files)) instead of a scan of
+    every file.
     """
+    # max size of the read buffer of a partial index file
+    read_buffer_size = 1024 * 1024
+    # total size of the read buffers of the files merged at the same time,
+    # shared between the files: 500 files get 64 KiB each
+    read_buffers_budget = 32 * 1024 * 1024
+    # min size of the read buffer of a partial index file
+    min_read_buffer_size = 8 * 1024
+    # number of index entries written at once in the output file
+    write_batch_size = 1000
+    # maximum number of files merged at the same time, above this number the
+    # files are merged in several passes
+    max_open_files = 500
+
     @staticmethod
     def reduce(input_filepaths, output_filepath):
         """
@@ -261,136 +837,145 @@ class Reducer(object):
             text files containing the partial indexes
             - output_filepath: path where the final index will be outputted
         """
-        files = Reducer.open_files(input_filepaths)
-
-        with open(output_filepath, 'w', 1) as output_file:
-            buffers = Buffers(files)
-
-            # a few hints here : we get the index entry with the lowest term_id,
-            # then get all the following index entries with the same term_id,
-            # whether they are from the same file or another one.
-            # When we got all those values, we merge all those posting lists
-            # into one, and write the final index entry to a file.
-            # We iterate over all the possible term_id, and stop when the partial
-            # index files are empty.
-            while not buffers.isEmpty:
-                L = []  # list of entries sharing the same term_id
-                # index entry is like (term_id, [frequence_col, [(document_id, frequence_doc, doc_len)...]])
-                _, index_entry = buffers.update()
-                if index_entry is None:
-                    break
-                term_id = index_entry[0]
-                while True:
-                    min_value, index_entry = buffers.update()
-                    if index_entry is None:
-                        break
-                    if term_id != index_entry[0]:  # new term, we will merge it later
-                        break
-                    L.append(index_entry)
-                    buffers.remove_value(min_value)
-
-                # merge the different terms into one
-                new_entry = (term_id, [0, []])
-                for entry in L:
-                    new_entry[1][0] += entry[1][0]
-                    for posting in entry[1][1]:
-                        new_entry[1][1].append(
-                            (posting[0], posting[1])
-                        )
-
-                output_file.write(json.dumps(new_entry))
-                output_file.write('\n')
-                if term_id % 1000 == 0:
-                    print("INDEXED_TERM", term_id)
+        pass_number = 0
+        temporary_filepaths = []
+        while len(input_filepaths) > Reducer.max_open_files:
+            # merge consecutive groups of files so the postings keep the
+            # order of the input files
+            merged_filepaths = []
+            for start in range(0, len(input_filepaths), Reducer.max_open_files):
+                merged_filepath = '{}.pass{}.{}'.format(
+                    output_filepath,
+                    pass_number,
+                    start // Reducer.max_open_files
+                )
+                Reducer.merge(
+                    input_filepaths[start:start + Reducer.max_open_files],
+                    merged_filepath
+                )
+                merged_filepaths.append(merged_filepath)
+            temporary_filepaths.extend(merged_filepaths)
+            input_filepaths = merged_filepaths
+            pass_number += 1
+
+        Reducer.merge(input_filepaths, output_filepath)
+        for filepath in temporary_filepaths:
+            os.remove(filepath)
 
     @staticmethod
-    def open_files(input_filepaths):
-        """Opens the files containing the sorted parts of the index.
-            + filenames: array of strings, that are the paths to the files
-            return: Dictionnary of files
+    def partition_bounds(term_number, reducers):
         """
-        files = {}
-        for i in range(len(input_filepaths)):
-            files[i] = open(input_filepaths[i], 'r', 1)  # select line buffering
-        return files
-
-
-class Buffers(object):
-    # inspired from https://github.com/spiralout/external-sort
-    """
-    Class that will handle multiple buffers at the time, corresponding to
-    multiple text files. At the beginning the buffers are filled with the first
-    line of each file (one line = one index entry), then we refill them with
-    the next line of the the file that the reducer has used.
-    + attributes:
-        - files: list of File objects that we need to pump the index entries from
-        - buffers: dictionnary of buffers, of the form {file_ref: index_entry}
-        - empty_buffers: set of buffers that are considered as empty, meaning
-        the last line of the corresponding file has been reached
-    """
+        Splits the term_ids in ranges of the same size, one per reducer.
+        + return: list of the first term_id of each range
+        """
+        return [term_number * partition // reducers for partition in range(reducers)]
 
-    def __init__(self, files):
-        self.files = files
-        self.buffers = {i: None for i in range(len(files))}
-        self.empty_buffers = set()
-
-    def _select_min_value(self, choices):
-        """Implements the k-way merging : selects the index of the choices with
-        the lowest value (temr_id value for us).
-            + choices : dictionnary of {buffer_index: value}
-        """
-        min_index = -1
-        for an_index in choices:  # ensure min_index is in choices
-            min_index = an_index
-            break
-        for i in choices:
-            if choices[i] < choices[min_index]:
-                min_index = i
-        return min_index
-
-    def _fill_buffers(self):
-        """
-        Fill in the buffers that are empty with data from the partial index
-        files
-        """
-        for i in range(len(self.buffers)):
-            if self.buffers[i] is None and i not in self.empty_buffers:
-                line = self.files[i].readline()
-                if line == '':  # EOF
-                    self.empty_buffers.add(i)
-                    print("EMPTY BUFFERS", self.empty_buffers, len(self.empty_buffers), len(self.files))
-                    continue
-                # converts the string to object : (term_id, [frequence_col, [(document_id, frequence_doc)...]])
-                self.buffers[i] = json.loads(line)
-        if self.isEmpty:
-            return False
-        else:
-            return True
+    @staticmethod
+    def partition_filepath(filepath, partition):
+        """Returns the path of the file holding the given range of an index"""
+        return '{}.{}'.format(filepath, partition)
 
-    def _get_buffers_values(self):
+    @staticmethod
+    def reduce_partitioned(input_filepaths, output_filepath, reducers):
         """
-        Returns the term_id from each buffer to later pick the lowest
+        Merges the partial indexes with one reducer process per term_id range,
+        then joins the range outputs into the final index. As the ranges are
+        disjoint and ordered, joining is a plain concatenation.
+        + attributes:
+            - input_filepaths: array containing the filepaths given to the
+            mappers, each one being split in range files
+            - output_filepath: path where the final index will be outputted
+            - reducers: number of ranges, and of reducer processes
         """
-        return {i: self.buffers[i][0] for i in range(len(self.buffers)) if i not in self.empty_buffers}
+        partitions = [
+            (
+                [Reducer.partition_filepath(filepath, partition) for filepath in input_filepaths],
+                Reducer.partition_filepath(output_filepath, partition)
+            )
+            for partition in range(reducers)
+        ]
+        with Pool(reducers) as pool:
+            pool.starmap(Reducer.reduce, partitions)
+
+        with open(output_filepath, 'wb') as output_file:
+            for _, partition_filepath in partitions:
+                with open(partition_filepath, 'rb') as partition_file:
+                    shutil.copyfileobj(partition_file, output_file, Reducer.read_buffer_size)
+                os.remove(partition_filepath)
 
-    def update(self):
+    @staticmethod
+    def merge(input_filepaths, output_filepath):
         """
-        Public method that fill the buffers if they are empty, then selects the
-        buffer index with the lowest value.
-        + return: buffer_index_min_value, corresponding_value
+        Merges the given sorted partial indexes into one sorted file in a
+        single pass.
+        + attributes:
+            - input_filepaths: array containing the filepaths of the partial
+            indexes to merge, at most Reducer.max_open_files
+            - output_filepath: path where the merged index will be outputted
         """
-        if self._fill_buffers():
-            min_index = self._select_min_value(self._get_buffers_values())
-            return min_index, self.buffers[min_index]
-        else:
-            return -1, None
+        files = Reducer.open_files(input_filepaths)
+        try:
+            # heapq.merge keeps the order of the files for entries sharing the
+            # same term_id, so the posting lists are concatenated in the order
+            # of the blocs
+            entries = heapq.merge(
+                *[Reducer.read_entries(partial_index_file) for partial_index_file in files.values()],
+                key=operator.itemgetter(0)
+            )
+            with open(output_filepath, 'w') as output_file:
+                batch = []
+                for term_id, group in groupby(entries, key=operator.itemgetter(0)):
+                    lines = [line for _, line in group]
+                    if len(lines) == 1:
+                        # nothing to merge, the line is already well formed
+                        batch.append(lines[0])
+                    else:
+                        # index entry is like (term_id, [frequence_col, [(document_id, frequence_doc)...]])
+                        new_entry = (term_id, [0, []])
+                        for line in lines:
+                            entry = json.loads(line)
+                            new_entry[1][0] += entry[1][0]
+                            new_entry[1][1].extend(entry[1][1])
+                        batch.append(json.dumps(new_entry) + '\n')
+
+                    if len(batch) >= Reducer.write_batch_size:
+                        output_file.writelines(batch)
+                        batch = []
+                    if term_id % 1000 == 0:
+                        print("INDEXED_TERM", term_id)
+                output_file.writelines(batch)
+        finally:
+            for partial_index_file in files.values():
+                partial_index_file.close()
 
-    def remove_value(self, index):
+    @staticmethod
+    def read_entries(partial_index_file):
         """
-        Removes a value from the buffer designed by the index.
+        Yields the (term_id, line) tuples of a partial index file, only the
+        term_id is decoded to sort the entries.
         """
-        self.buffers[index] = None
+        for line in partial_index_file:
+            if not line.endswith('\n'):
+                line += '\n'
+            # line is like '[term_id, [frequence_col, [[document_id, frequence_doc]...]]]'
+            yield int(line[1:line.index(',')]), line
 
-    @property
-    def isEmpty(self):
-        return len(self.empty_buffers) == len(self.files)  # All files ended
+    @staticmethod
+    def buffer_size(files_number):
+        """Returns the size of the read buffer of each of files_number files read at the same time"""
+        return max(
+            Reducer.min_read_buffer_size,
+            min(Reducer.read_buffer_size, Reducer.read_buffers_budget // max(files_number, 1))
+        )
+
+    @staticmethod
+    def open_files(input_filepaths):
+        """Opens the files containing the sorted parts of the index.
+            + filenames: array of strings, that are the paths to the files
+            return: Dictionnary of files
+        """
+        buffer_size = Reducer.buffer_size(len(input_filepaths))
+        files = {}
+        for i in range(len(input_filepaths)):
+            files[i] = open(input_filepaths[i], 'r', buffer_size)
+        return files
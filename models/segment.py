@@ -0,0 +1,253 @@
+"""
+This file defines the binary segment format of our reverse index.
+A segment is made of three files:
+    - name.offsets: a header followed by a fixed-width table containing one
+    record per term_id: (postings offset, postings length in bytes,
+    frequence_col, skips offset)
+    - name.postings: the posting lists of all the terms one after the other,
+    sorted by term_id. A posting list is cut in blocks of BLOCK_SIZE postings
+    sorted by document id, each block containing the document ids and the
+    document frequences encoded with the codec recorded in the header (see
+    models/codec.py). The document ids of a block are encoded from the last
+    document id of the previous block.
+    - name.skips: the skip pointers of the posting lists, one per block:
+    (last document id of the block, end of the block in bytes from the start
+    of the posting list). They give the block which may contain a document id
+    without decoding the other blocks.
+
+The files are opened with mmap: reading the posting list of a term only
+decodes the bytes of this posting list, and the pages of the files are kept
+by the OS page cache instead of the Python heap.
+
+CACM document ids are strings, they are stored as integers and converted back
+when the posting lists are read.
+"""
+import json
+import mmap
+import os
+import struct
+from bisect import bisect_left
+
+from models.codec import CODECS, RawCodec
+
+
+MAGIC = b'MOSE'
+VERSION = 3
+# magic, version, document id type, codec, block size, number of terms
+HEADER = struct.Struct('<4sHHHHI')
+# postings offset, postings length in bytes, frequence_col, skips offset
+RECORD = struct.Struct('<QIIQ')
+# last document id of the block, end of the block from the start of the posting list
+SKIP = struct.Struct('<II')
+# number of postings of a block
+BLOCK_SIZE = 128
+# document id types, the position in the tuple is stored in the header
+DOC_ID_TYPES = (int, str)
+
+
+class SegmentError(Exception):
+    """This is a custom exception raised when a segment file is not valid."""
+
+
+class SegmentWriter(object):
+    """This class writes a segment from the json index built by the reducers."""
+
+    @staticmethod
+    def write_from_index(index_filepath, basepath, codec=RawCodec):
+        """
+        + params:
+            - index_filepath: path of the json index, one line per term_id
+            - basepath: path of the segment files, without extension
+            - codec: codec class used to encode the posting lists
+        """
+        records = []
+        doc_id_type = int
+        with open(index_filepath, 'r') as index_file, \
+                open(basepath + '.postings', 'wb') as postings_file, \
+                open(basepath + '.skips', 'wb') as skips_file:
+            offset = 0
+            skips_offset = 0
+            for line in index_file:
+                # entry is like (term_id, [frequence_col, [(document_id, frequence_doc)...]])
+                term_id, (frequence_col, postings) = json.loads(line)
+                if postings and isinstance(postings[0][0], str):
+                    doc_id_type = str
+                postings = sorted((int(document_id), frequence) for document_id, frequence in postings)
+                data = bytearray()
+                skips = bytearray()
+                base = -1
+                for start in range(0, len(postings), BLOCK_SIZE):
+                    block = postings[start:start + BLOCK_SIZE]
+                    data.extend(codec.encode(
+                        [document_id for document_id, _ in block],
+                        [frequence for _, frequence in block],
+                        base
+                    ))
+                    base = block[-1][0]
+                    skips.extend(SKIP.pack(base, len(data)))
+                # term_ids without entry get an empty record
+                while len(records) < term_id:
+                    records.append((offset, 0, 0, skips_offset))
+                records.append((offset, len(data), frequence_col, skips_offset))
+                postings_file.write(data)
+                skips_file.write(skips)
+                offset += len(data)
+                skips_offset += len(skips)
+
+        with open(basepath + '.offsets', 'wb') as offsets_file:
+            offsets_file.write(HEADER.pack(
+                MAGIC,
+                VERSION,
+                DOC_ID_TYPES.index(doc_id_type),
+                CODECS.index(codec),
+                BLOCK_SIZE,
+                len(records)
+            ))
+            for record in records:
+                offsets_file.write(RECORD.pack(*record))
+
+
+class Segment(object):
+    """
+    This class gives access to the posting lists of a segment.
+    + wrapping methods:
+        - __getitem__: returns [frequence_col, [(document_id, frequence_doc)...]]
+        for the given term_id
+        - __len__: returns the number of term_ids of the segment
+    + core methods:
+        - blocks, decode_block: read the skip pointers and decode one block
+        of a posting list
+        - stream: returns a SegmentStream over the document ids of a term_id
+    """
+
+    def __init__(self, basepath):
+        self.basepath = basepath
+        self._files = []
+        self.offsets = self._map(basepath + '.offsets')
+        self.postings = self._map(basepath + '.postings')
+        self.skips = self._map(basepath + '.skips')
+
+        magic, version = struct.unpack_from('<4sH', self.offsets, 0)
+        if magic != MAGIC or version != VERSION:
+            raise SegmentError('{}.offsets is not a valid segment'.format(basepath))
+        _, _, doc_id_type, codec, self.block_size, self.term_number = HEADER.unpack_from(self.offsets, 0)
+        self.doc_id_type = DOC_ID_TYPES[doc_id_type]
+        self.codec = CODECS[codec]
+
+    def _map(self, filepath):
+        """Opens filepath with mmap, empty files can not be mapped."""
+        if os.path.getsize(filepath) == 0:
+            return b''
+        with open(filepath, 'rb') as segment_file:
+            mapped_file = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._files.append(mapped_file)
+        return mapped_file
+
+    def _record(self, term_id):
+        if not 0 <= term_id < self.term_number:
+            raise KeyError(term_id)
+        return RECORD.unpack_from(self.offsets, HEADER.size + term_id * RECORD.size)
+
+    def record(self, term_id):
+        """Returns the (postings offset, postings length, frequence_col) of term_id"""
+        return self._record(term_id)[:3]
+
+    def blocks(self, term_id):
+        """
+        Returns the [(last document id, start offset, end offset, postings number)...]
+        of the blocks of the posting list of term_id, from the skip pointers.
+        """
+        offset, _, frequence_col, skips_offset = self._record(term_id)
+        blocks = []
+        start = offset
+        block_number = -(-frequence_col // self.block_size)
+        for block, (last_document_id, end) in enumerate(
+                SKIP.iter_unpack(self.skips[skips_offset:skips_offset + block_number * SKIP.size])):
+            postings_number = min(self.block_size, frequence_col - block * self.block_size)
+            blocks.append((last_document_id, start, offset + end, postings_number))
+            start = offset + end
+        return blocks
+
+    def decode_block(self, blocks, block):
+        """Returns the (document_ids, frequences) of a block given by blocks()"""
+        _, start, end, postings_number = blocks[block]
+        # the document ids are encoded from the last document id of the previous block
+        base = blocks[block - 1][0] if block else -1
+        return self.codec.decode(self.postings[start:end], postings_number, base)
+
+    def __getitem__(self, term_id):
+        frequence_col = self.record(term_id)[2]
+        document_ids = []
+        frequences = []
+        blocks = self.blocks(term_id)
+        for block in range(len(blocks)):
+            block_document_ids, block_frequences = self.decode_block(blocks, block)
+            document_ids.extend(block_document_ids)
+            frequences.extend(block_frequences)
+        if self.doc_id_type is not int:
+            document_ids = map(self.doc_id_type, document_ids)
+        return [frequence_col, list(zip(document_ids, frequences))]
+
+    def stream(self, term_id):
+        """Returns a SegmentStream over the sorted document ids of term_id"""
+        return SegmentStream(self, term_id)
+
+    def __len__(self):
+        return self.term_number
+
+    def close(self):
+        for mapped_file in self._files:
+            mapped_file.close()
+        self._files = []
+
+
+class SegmentStream(object):
+    """
+    This class is a forward cursor over the sorted document ids of a posting
+    list of a segment. seek uses the skip pointers to decode only the block
+    which may contain the document id searched.
+    """
+
+    def __init__(self, segment, term_id):
+        self.segment = segment
+        self.blocks = segment.blocks(term_id)
+        self.last_document_ids = [last_document_id for last_document_id, _, _, _ in self.blocks]
+        self.length = sum(postings_number for _, _, _, postings_number in self.blocks)
+        self.block = -1
+        self.document_ids = []
+        self.frequences = []
+        self.position = 0
+
+    def _load_block(self, block):
+        self.block = block
+        self.document_ids, self.frequences = self.segment.decode_block(self.blocks, block)
+        self.position = 0
+
+    def seek(self, document_id):
+        """Returns the first document id greater or equal to document_id after the cursor, or None"""
+        if self.block == len(self.blocks):
+            return None
+        if self.block < 0 or document_id > self.last_document_ids[self.block]:
+            block = bisect_left(self.last_document_ids, document_id, max(self.block, 0))
+            if block == len(self.blocks):
+                self.block = block
+                self.document_ids = []
+                return None
+            self._load_block(block)
+        self.position = bisect_left(self.document_ids, document_id, self.position)
+        if self.position == len(self.document_ids):
+            return None
+        return self.document_ids[self.position]
+
+    def frequence(self):
+        return self.frequences[self.position]
+
+    def rank(self):
+        return self.document_ids[self.position]
+
+    def __iter__(self):
+        for block in range(len(self.blocks)):
+            yield from self.segment.decode_block(self.blocks, block)[0]
+
+    def __len__(self):
+        return self.length
@@ -0,0 +1,252 @@
+"""
+This file defines the query server of the search engine: the collection and
+the reverse index are loaded once, then the requests are answered by a small
+HTTP/JSON server written with asyncio, on a TCP port of localhost or on a
+Unix socket.
+
+The server answers to:
+    - GET /health: {"status": "ok", "collection": name}
+    - GET /stats: the size of the collection and of the index, the number
+    and mean duration of the requests served, and the hits of the caches
+    - GET /search?q=<request>&model=<vectorial|boolean>&results=<len>, or
+    POST /search with the same parameters in a json body
+    {"q": request, "model": model, "results": len}: the number of results
+    and the first results, with their score for the vectorial requests
+
+The requests are evaluated by the threads of an executor, so that the event
+loop keeps accepting connections while a long request is evaluated. The
+request objects and the index are shared by the threads: Request.search
+keeps no state of the request on them.
+"""
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+from urllib.parse import parse_qs, urlsplit
+
+from models.parser import ParsingError
+from models.request import BooleanRequest, NumpyVectorialRequest
+
+
+HTTP_REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    500: 'Internal Server Error',
+}
+
+
+class RequestError(Exception):
+    """This is a custom exception raised when a request sent to the server is not valid."""
+
+
+class QueryServer(object):
+    """
+    This class answers the requests sent to the HTTP server.
+    + attributes:
+        - reverse_index, collection: loaded once when the server starts
+        - vectorial_request_class: Request class of the vectorial requests
+        - boolean_request_class: Request class of the boolean requests
+        - requests: {model: request object}, shared by the threads
+        - results: number of results returned by default
+        - threads: number of requests evaluated at once
+        - query_cache: QueryCache of the boolean requests (see
+        models/cache.py), or None
+        - requests_number, errors_number, total_duration: counters given by
+        the /stats endpoint
+    + core methods:
+        - search: evaluates a request and returns its json answer
+        - serve: runs the server until it is interrupted
+    """
+
+    def __init__(self, reverse_index, collection, vectorial_request_class=NumpyVectorialRequest,
+                 boolean_request_class=BooleanRequest, results=10, threads=4, query_cache=None):
+        self.reverse_index = reverse_index
+        self.collection = collection
+        self.vectorial_request_class = vectorial_request_class
+        self.boolean_request_class = boolean_request_class
+        self.requests = {
+            'vectorial': vectorial_request_class(reverse_index, collection),
+            'boolean': boolean_request_class(reverse_index, collection, cache=query_cache),
+        }
+        self.query_cache = query_cache
+        self.results = results
+        self.start_time = time()
+        self.requests_number = 0
+        self.errors_number = 0
+        self.total_duration = 0
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+
+    def search(self, raw_request, model='vectorial', results=None):
+        """
+        Evaluates raw_request with the vectorial or the boolean model. It is
+        called by the threads of the executor, the counters of the server
+        being updated by the event loop.
+        + returns:
+            {"q", "model", "results_number", "exact_results_number", "duration_ms",
+            "results": [{"id", "title", "score"}...]}, results_number being a
+            lower bound if exact_results_number is False
+        """
+        results = self.results if results is None else results
+        if model not in self.requests:
+            raise RequestError('Unknown model {}, expected vectorial or boolean'.format(model))
+        start_time = time()
+        results_number, top_results = self.requests[model].search(raw_request, results)
+        duration = time() - start_time
+        return {
+            'q': raw_request,
+            'model': model,
+            'results_number': results_number,
+            'exact_results_number': self.requests[model].exact_results_number,
+            'duration_ms': duration * 1000,
+            'results': [
+                self._describe(document_id, score)
+                for document_id, score in top_results
+            ],
+        }
+
+    def _describe(self, document_id, score):
+        document = self.collection[document_id]
+        description = {'id': document_id, 'title': document.title.strip()}
+        if score is not None:
+            description['score'] = score
+        return description
+
+    def stats(self):
+        stats = {
+            'collection': self.collection.name,
+            'documents': len(self.collection),
+            'terms': len(self.reverse_index),
+            'uptime_s': time() - self.start_time,
+            'requests': self.requests_number,
+            'errors': self.errors_number,
+            'mean_duration_ms': self.total_duration / (self.requests_number or 1) * 1000,
+        }
+        if self.query_cache is not None:
+            stats['query_cache'] = self.query_cache.stats()
+        if self.reverse_index.postings_cache is not None:
+            stats['postings_cache'] = self.reverse_index.postings_cache.stats()
+        return stats
+
+    def read_parameters(self, parameters):
+        """
+        Checks the parameters of a search, given by the query string or by
+        the json body.
+        + returns:
+            (raw_request, model, results)
+        """
+        if not isinstance(parameters, dict):
+            raise RequestError('The parameters must be a json object')
+        raw_request = parameters.get('q')
+        if not raw_request:
+            raise RequestError('Missing request q')
+        if not isinstance(raw_request, str):
+            raise RequestError('The request q must be a string')
+        model = parameters.get('model', 'vectorial')
+        if not isinstance(model, str):
+            raise RequestError('The model must be a string')
+        results = parameters.get('results', self.results)
+        # a json body may give a number or a string, a query string a string
+        if isinstance(results, bool) or not isinstance(results, (int, str)):
+            raise RequestError('The number of results must be an integer')
+        try:
+            results = int(results)
+        except ValueError:
+            raise RequestError('The number of results must be an integer')
+        if results < 0:
+            raise RequestError('The number of results must not be negative')
+        return raw_request, model, results
+
+    async def route(self, method, target, body):
+        """Returns the (status, json answer) of an HTTP request"""
+        url = urlsplit(target)
+        if url.path == '/health':
+            return 200, {'status': 'ok', 'collection': self.collection.name}
+        elif url.path == '/stats':
+            return 200, self.stats()
+        elif url.path != '/search':
+            return 404, {'error': 'Unknown path {}'.format(url.path)}
+
+        if method == 'GET':
+            parameters = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        elif method == 'POST':
+            try:
+                parameters = json.loads(body.decode('utf-8')) if body else {}
+            except ValueError:
+                return 400, {'error': 'The body is not valid json'}
+        else:
+            return 405, {'error': 'Unknown method {}'.format(method)}
+
+        try:
+            raw_request, model, results = self.read_parameters(parameters)
+            answer = await asyncio.get_event_loop().run_in_executor(
+                self.executor,
+                self.search,
+                raw_request,
+                model,
+                results
+            )
+        except (RequestError, ParsingError, ValueError) as error:
+            self.errors_number += 1
+            return 400, {'error': str(error)}
+        except KeyError as error:
+            # the terms of a boolean request need to be in the index
+            self.errors_number += 1
+            return 400, {'error': 'Unknown term {}'.format(error)}
+        self.requests_number += 1
+        self.total_duration += answer['duration_ms'] / 1000
+        return 200, answer
+
+    async def handle(self, reader, writer):
+        """Reads one HTTP request from the connection and writes its answer"""
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1').strip()
+                if not line:
+                    break
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+            if len(request_line) != 3:
+                status, answer = 400, {'error': 'Invalid request line'}
+            else:
+                try:
+                    status, answer = await self.route(request_line[0], request_line[1], body)
+                except Exception as error:
+                    self.errors_number += 1
+                    status, answer = 500, {'error': repr(error)}
+
+            data = json.dumps(answer).encode('utf-8')
+            writer.write('HTTP/1.1 {} {}\r\n'.format(status, HTTP_REASONS[status]).encode('latin-1'))
+            writer.write(b'Content-Type: application/json\r\n')
+            writer.write('Content-Length: {}\r\n'.format(len(data)).encode('latin-1'))
+            writer.write(b'Connection: close\r\n\r\n')
+            writer.write(data)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    def serve(self, host='127.0.0.1', port=8080, socket_path=None):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        if socket_path:
+            server = loop.run_until_complete(asyncio.start_unix_server(self.handle, path=socket_path))
+            print('Serving {} on unix socket {}...'.format(self.collection.name, socket_path))
+        else:
+            server = loop.run_until_complete(asyncio.start_server(self.handle, host, port))
+            print('Serving {} on http://{}:{}/ ...'.format(self.collection.name, host, port))
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+            loop.run_until_complete(server.wait_closed())
+            self.executor.shutdown()
+            loop.close()
@@ -0,0 +1,170 @@
+"""
+This file defines the statistics of the documents of an index, computed once
+when the index is built instead of being computed from the term_bag of the
+documents for each posting of a request.
+For each document we store, in arrays indexed by the document id:
+    - doc_len: number of tokens of the document
+    - tf_max: max tf of the document
+    - unique_terms: number of distinct terms of the document
+    - norms: norm of the vector of the document, for each ponderation function
+
+CACM document ids are strings, they are converted to integers to index the
+arrays.
+"""
+import json
+import pickle
+from array import array
+from math import sqrt
+
+import numpy as np
+
+import models.ponderation as ponderation_module
+
+
+class DocumentStatistics(object):
+    """
+    This class contains the statistics of all the documents of an index.
+    + attributes:
+        - doc_lens, tf_maxs, unique_terms: arrays of unsigned integers indexed
+        by document id, 0 for the ids without document
+        - norms: {ponderation function name: array of floats indexed by
+        document id}
+        - doc_id_type: type of the document ids of the index
+    + core methods:
+        - build_from_index: compute the statistics from a json index file
+        - save, load: write and read the statistics as a pickle file
+    + accessors:
+        - doc_len, tf_max, unique_term_number, norm: return the statistic of
+        a document, 1 for unknown documents (e.g. the request, with id -1)
+        - as_numpy: return a statistic as a numpy array indexed by document id
+    """
+
+    def __init__(self):
+        self.doc_lens = array('I')
+        self.tf_maxs = array('I')
+        self.unique_terms = array('I')
+        self.norms = {}
+        self.doc_id_type = int
+        # numpy copies of the arrays, built on demand and not saved
+        self._numpy_arrays = {}
+
+    @staticmethod
+    def build_from_index(index_filepath, collection, weight_functions=None):
+        """
+        Computes the statistics in two passes over the index: the first one
+        gives the length of each document, needed by the ponderation functions
+        to compute the norms in the second one.
+        + params:
+            - index_filepath: path of the json index, one line per term_id
+            - collection: collection of the index, given to the ponderation
+            functions
+            - weight_functions: names of the ponderation functions whose norms
+            are stored, all the functions of models/ponderation.py by default
+        """
+        statistics = DocumentStatistics()
+        weight_functions = weight_functions or ponderation_module.__all__
+
+        for _, postings in DocumentStatistics._read_index(index_filepath, statistics):
+            for document_id, frequence in postings:
+                statistics._grow(document_id)
+                statistics.doc_lens[document_id] += frequence
+                statistics.unique_terms[document_id] += 1
+                if frequence > statistics.tf_maxs[document_id]:
+                    statistics.tf_maxs[document_id] = frequence
+
+        squared_norms = {
+            name: [0.] * len(statistics.doc_lens)
+            for name in weight_functions
+        }
+        for frequence_col, postings in DocumentStatistics._read_index(index_filepath, statistics):
+            for name in weight_functions:
+                weight_function = getattr(ponderation_module, name)
+                squared_norm = squared_norms[name]
+                for document_id, frequence in postings:
+                    squared_norm[document_id] += weight_function(
+                        tf=frequence,
+                        df=frequence_col,
+                        collection=collection,
+                        document_id=document_id,
+                        statistics=statistics
+                    ) ** 2
+        statistics.norms = {
+            name: array('d', map(sqrt, squared_norm))
+            for name, squared_norm in squared_norms.items()
+        }
+        return statistics
+
+    @staticmethod
+    def _read_index(index_filepath, statistics):
+        """
+        Yields the (frequence_col, [(int document_id, frequence_doc)...]) of
+        the index, and records the type of the document ids in statistics.
+        """
+        with open(index_filepath, 'r') as index_file:
+            for line in index_file:
+                # entry is like (term_id, [frequence_col, [(document_id, frequence_doc)...]])
+                _, (frequence_col, postings) = json.loads(line)
+                if postings and isinstance(postings[0][0], str):
+                    statistics.doc_id_type = str
+                yield frequence_col, [(int(document_id), frequence) for document_id, frequence in postings]
+
+    def _grow(self, document_id):
+        """Extends the arrays so that document_id is a valid position"""
+        missing = document_id + 1 - len(self.doc_lens)
+        if missing > 0:
+            for statistic in (self.doc_lens, self.tf_maxs, self.unique_terms):
+                statistic.extend([0] * missing)
+
+    def save(self, filepath):
+        with open(filepath, 'wb') as statistics_file:
+            pickler = pickle.Pickler(statistics_file)
+            pickler.dump({
+                name: statistic
+                for name, statistic in self.__dict__.items()
+                if not name.startswith('_')
+            })
+
+    @staticmethod
+    def load(filepath):
+        statistics = DocumentStatistics()
+        with open(filepath, 'rb') as statistics_file:
+            depickler = pickle.Unpickler(statistics_file)
+            statistics.__dict__.update(depickler.load())
+        return statistics
+
+    def as_numpy(self, name):
+        """
+        Returns the doc_lens or tf_maxs array as a numpy array, with 1 for
+        the ids without document as the accessors.
+        """
+        if name in self._numpy_arrays:
+            return self._numpy_arrays[name]
+        statistic = np.frombuffer(getattr(self, name), dtype=np.uint32).astype(np.int64)
+        statistic[statistic == 0] = 1
+        self._numpy_arrays[name] = statistic
+        return statistic
+
+    def _get(self, statistic, document_id):
+        document_id = int(document_id)
+        if 0 <= document_id < len(statistic) and statistic[document_id]:
+            return statistic[document_id]
+        return 1
+
+    def doc_len(self, document_id):
+        return self._get(self.doc_lens, document_id)
+
+    def tf_max(self, document_id):
+        return self._get(self.tf_maxs, document_id)
+
+    def unique_term_number(self, document_id):
+        return self._get(self.unique_terms, document_id)
+
+    def norm(self, document_id, weight_function_name):
+        return self._get(self.norms[weight_function_name], document_id)
+
+    def document_ids(self):
+        """Yields the integer ids of the documents of the index"""
+        return (document_id for document_id, doc_len in enumerate(self.doc_lens) if doc_len)
+
+    def __len__(self):
+        return len(self.doc_lens)
@@ -0,0 +1,117 @@
+"""
+This file defines the streams of document ids used to evaluate the boolean
+requests: instead of building a set for each node of the request tree, the
+nodes combine sorted streams of integer document ids.
+
+A stream implements:
+    - seek(document_id): moves the cursor forward to the first document id
+    greater or equal to document_id and returns it, or None at the end
+    - __iter__: yields all the document ids of the stream in increasing order
+    - __len__: number of document ids of the stream
+
+The streams of postings scored by MaxScore (see models/request.py) also
+implement:
+    - frequence(): frequence in the document of the cursor
+    - rank(): rank of the posting of the cursor in the posting list of the
+    index, the document id itself when the posting list is sorted by document
+    id, used to break the ties of the scores as the exhaustive scoring does
+
+The intersection iterates over the shortest stream and seeks the others, so
+that its cost depends on the length of the shortest stream and not on the
+length of the longest one: ListStream seeks by galloping, SegmentStream (see
+models/segment.py) uses the skip pointers of the segment to decode only the
+blocks which may contain the document ids searched.
+"""
+import heapq
+from bisect import bisect_left
+
+
+class ListStream(object):
+    """
+    This class is a forward cursor over a sorted sequence of integer document
+    ids (list, array or memoryview of a CompactIndex).
+    + attributes:
+        - document_ids: sorted integer document ids
+        - frequences: frequences aligned with document_ids, or None
+        - ranks: ranks of the postings in the posting list of the index
+        aligned with document_ids, or None if it is sorted by document id
+        - position: position of the cursor in document_ids
+    """
+
+    def __init__(self, document_ids, frequences=None, ranks=None):
+        self.document_ids = document_ids
+        self.frequences = frequences
+        self.ranks = ranks
+        self.position = 0
+
+    def seek(self, document_id):
+        """Gallops from the cursor, then searches the last interval found"""
+        document_ids = self.document_ids
+        start = self.position
+        if start >= len(document_ids):
+            return None
+        if document_ids[start] >= document_id:
+            return document_ids[start]
+        step = 1
+        end = start
+        while end < len(document_ids) and document_ids[end] < document_id:
+            start = end + 1
+            end += step
+            step *= 2
+        self.position = bisect_left(document_ids, document_id, start, min(end, len(document_ids)))
+        if self.position == len(document_ids):
+            return None
+        return document_ids[self.position]
+
+    def frequence(self):
+        return self.frequences[self.position]
+
+    def rank(self):
+        if self.ranks is None:
+            return self.document_ids[self.position]
+        return self.ranks[self.position]
+
+    def __iter__(self):
+        return iter(self.document_ids)
+
+    def __len__(self):
+        return len(self.document_ids)
+
+
+def intersection(streams):
+    """Returns the ListStream of the document ids found in all the streams"""
+    streams = sorted(streams, key=len)
+    if not streams or not len(streams[0]):
+        return ListStream([])
+    document_ids = []
+    for document_id in streams[0]:
+        for stream in streams[1:]:
+            found = stream.seek(document_id)
+            if found is None:
+                return ListStream(document_ids)
+            if found != document_id:
+                break
+        else:
+            document_ids.append(document_id)
+    return ListStream(document_ids)
+
+
+def union(streams):
+    """Returns the ListStream of the document ids found in one of the streams"""
+    document_ids = []
+    for document_id in heapq.merge(*streams):
+        if not document_ids or document_ids[-1] != document_id:
+            document_ids.append(document_id)
+    return ListStream(document_ids)
+
+
+def difference(stream, removed_stream):
+    """
+    Returns the ListStream of the document ids of stream not found in
+    removed_stream, stream can be any iterable of sorted document ids.
+    """
+    document_ids = []
+    for document_id in stream:
+        if removed_stream.seek(document_id) != document_id:
+            document_ids.append(document_id)
+    return ListStream(document_ids)
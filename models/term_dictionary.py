@@ -0,0 +1,182 @@
+"""
+This file defines a compact term dictionary, replacing the {term: term_id}
+json hash table. The terms are sorted and stored in a single file:
+    - a header: (magic, version, block size, number of terms, number of blocks)
+    - a table with the offset of each block
+    - the blocks of block_size terms. A term is written as the length of the
+    prefix it shares with the previous term of the block, the length and the
+    bytes of the rest of the term, and its term_id (numbers are written with
+    variable byte encoding). The first term of a block is written entirely.
+
+The file is opened with mmap and only the first term of each block is kept in
+memory: a lookup is a binary search over those terms followed by the decoding
+of one block.
+"""
+import mmap
+import struct
+from bisect import bisect_right
+
+from models.codec import VByteCodec
+
+
+MAGIC = b'MOST'
+VERSION = 1
+# magic, version, block size, number of terms, number of blocks
+HEADER = struct.Struct('<4sHHII')
+BLOCK_OFFSET = struct.Struct('<Q')
+
+
+def read_number(data, position):
+    """Reads a variable byte encoded number, returns it with the next position"""
+    number = 0
+    while True:
+        byte = data[position]
+        position += 1
+        if byte & 0x80:
+            return (number << 7) | (byte & 0x7f), position
+        number = (number << 7) | byte
+
+
+class TermDictionaryError(Exception):
+    """This is a custom exception raised when a term dictionary file is not valid."""
+
+
+class TermDictionary(object):
+    """
+    This class gives access to a term dictionary file with the interface of
+    the {term: term_id} dict.
+    + core methods:
+        - write: write a {term: term_id} dict as a term dictionary file
+        - prefix: iterate over the (term, term_id) whose term starts with
+        a given prefix
+        - range: iterate over the (term, term_id) between two terms
+    + wrapping methods:
+        - __getitem__, get, __contains__, __len__, __iter__ and keys, as
+        for a dict
+    """
+    block_size = 16
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        with open(filepath, 'rb') as dictionary_file:
+            self.data = mmap.mmap(dictionary_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.block_size, self.term_number, block_number = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise TermDictionaryError('{} is not a valid term dictionary'.format(filepath))
+        self.block_offsets = [
+            BLOCK_OFFSET.unpack_from(self.data, HEADER.size + block * BLOCK_OFFSET.size)[0]
+            for block in range(block_number)
+        ]
+        # sparse index: the first term of each block
+        self.block_terms = [
+            next(self._iter_block(block))[0].decode('utf-8')
+            for block in range(block_number)
+        ]
+
+    @staticmethod
+    def write(term_dict, filepath, block_size=None):
+        """
+        + params:
+            - term_dict: {term: term_id} dict to write
+            - filepath: path of the term dictionary file
+            - block_size: number of terms per block
+        """
+        block_size = block_size or TermDictionary.block_size
+        # utf-8 bytes are sorted in the same order as the strings
+        terms = sorted(term_dict)
+        blocks = []
+        for start in range(0, len(terms), block_size):
+            block = bytearray()
+            previous = b''
+            for term in terms[start:start + block_size]:
+                encoded = term.encode('utf-8')
+                prefix_length = 0
+                for previous_byte, byte in zip(previous, encoded):
+                    if previous_byte != byte:
+                        break
+                    prefix_length += 1
+                block.extend(VByteCodec.encode_numbers([prefix_length, len(encoded) - prefix_length]))
+                block.extend(encoded[prefix_length:])
+                block.extend(VByteCodec.encode_numbers([term_dict[term]]))
+                previous = encoded
+            blocks.append(block)
+
+        with open(filepath, 'wb') as dictionary_file:
+            dictionary_file.write(HEADER.pack(MAGIC, VERSION, block_size, len(terms), len(blocks)))
+            offset = HEADER.size + len(blocks) * BLOCK_OFFSET.size
+            for block in blocks:
+                dictionary_file.write(BLOCK_OFFSET.pack(offset))
+                offset += len(block)
+            for block in blocks:
+                dictionary_file.write(block)
+
+    def _iter_block(self, block):
+        """Yields the (utf-8 encoded term, term_id) of a block"""
+        position = self.block_offsets[block]
+        end = self.block_offsets[block + 1] if block + 1 < len(self.block_offsets) else len(self.data)
+        term = b''
+        while position < end:
+            prefix_length, position = read_number(self.data, position)
+            suffix_length, position = read_number(self.data, position)
+            term = term[:prefix_length] + self.data[position:position + suffix_length]
+            position += suffix_length
+            term_id, position = read_number(self.data, position)
+            yield term, term_id
+
+    def _iter_from(self, term):
+        """Yields the (term, term_id) greater or equal to term, in sorted order"""
+        block = max(bisect_right(self.block_terms, term) - 1, 0)
+        encoded = term.encode('utf-8')
+        for block in range(block, len(self.block_offsets)):
+            for current_term, term_id in self._iter_block(block):
+                if current_term >= encoded:
+                    yield current_term.decode('utf-8'), term_id
+
+    def get(self, term, default=None):
+        block = bisect_right(self.block_terms, term) - 1
+        if block < 0:
+            return default
+        encoded = term.encode('utf-8')
+        for current_term, term_id in self._iter_block(block):
+            if current_term == encoded:
+                return term_id
+            if current_term > encoded:
+                break
+        return default
+
+    def __getitem__(self, term):
+        term_id = self.get(term)
+        if term_id is None:
+            raise KeyError(term)
+        return term_id
+
+    def __contains__(self, term):
+        return self.get(term) is not None
+
+    def prefix(self, prefix):
+        for term, term_id in self._iter_from(prefix):
+            if not term.startswith(prefix):
+                break
+            yield term, term_id
+
+    def range(self, start, end):
+        """Yields the (term, term_id) with start <= term < end"""
+        for term, term_id in self._iter_from(start):
+            if term >= end:
+                break
+            yield term, term_id
+
+    def __iter__(self):
+        for block in range(len(self.block_offsets)):
+            for term, _ in self._iter_block(block):
+                yield term.decode('utf-8')
+
+    def keys(self):
+        return self
+
+    def __len__(self):
+        return self.term_number
+
+    def close(self):
+        self.data.close()
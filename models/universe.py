@@ -0,0 +1,103 @@
+"""
+This file defines the universe of an index: the set of the ids of all the
+documents found in the index, needed to evaluate the NOT operator of the
+boolean requests without reading every posting list.
+
+The document ids are stored as sorted ranges of consecutive ids, in a single
+file:
+    - a header: (magic, version, document id type, number of ranges)
+    - the ranges: (first document id, last document id + 1) as little-endian
+    unsigned 32 bits integers
+"""
+import struct
+from bisect import bisect_right
+
+from models.segment import DOC_ID_TYPES
+
+
+MAGIC = b'MOUN'
+VERSION = 1
+# magic, version, document id type, number of ranges
+HEADER = struct.Struct('<4sHHI')
+RANGE = struct.Struct('<II')
+
+
+class UniverseError(Exception):
+    """This is a custom exception raised when a universe file is not valid."""
+
+
+class DocumentUniverse(object):
+    """
+    This class contains the ids of all the documents of an index.
+    + attributes:
+        - ranges: sorted list of (start, end) ranges of integer document ids
+        - doc_id_type: type of the document ids of the index (CACM document
+        ids are strings)
+    + core methods:
+        - from_document_ids: build the universe from integer document ids
+        - save, load: write and read the universe file
+        - difference: returns the set of the ids of the universe which are not
+        in the given set
+        - document_ids: yields the integer ids in increasing order
+    + wrapping methods:
+        - __contains__, __iter__ and __len__, as for a set
+    """
+
+    def __init__(self, ranges=None, doc_id_type=int):
+        self.ranges = ranges or []
+        self.doc_id_type = doc_id_type
+
+    @staticmethod
+    def from_document_ids(document_ids, doc_id_type=int):
+        ranges = []
+        for document_id in sorted(set(document_ids)):
+            if ranges and ranges[-1][1] == document_id:
+                ranges[-1][1] = document_id + 1
+            else:
+                ranges.append([document_id, document_id + 1])
+        return DocumentUniverse([tuple(document_range) for document_range in ranges], doc_id_type)
+
+    def save(self, filepath):
+        with open(filepath, 'wb') as universe_file:
+            universe_file.write(HEADER.pack(MAGIC, VERSION, DOC_ID_TYPES.index(self.doc_id_type), len(self.ranges)))
+            for start, end in self.ranges:
+                universe_file.write(RANGE.pack(start, end))
+
+    @staticmethod
+    def load(filepath):
+        with open(filepath, 'rb') as universe_file:
+            data = universe_file.read()
+        magic, version, doc_id_type, range_number = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise UniverseError('{} is not a valid universe file'.format(filepath))
+        return DocumentUniverse(
+            list(RANGE.iter_unpack(data[HEADER.size:HEADER.size + range_number * RANGE.size])),
+            DOC_ID_TYPES[doc_id_type]
+        )
+
+    def difference(self, document_ids):
+        """Returns the set of the ids of the universe which are not in document_ids"""
+        return set(self).difference(document_ids)
+
+    def document_ids(self):
+        """Yields the integer ids of the universe in increasing order"""
+        for start, end in self.ranges:
+            yield from range(start, end)
+
+    def __contains__(self, document_id):
+        try:
+            document_id = int(document_id)
+        except (TypeError, ValueError):
+            return False
+        position = bisect_right(self.ranges, (document_id, float('inf'))) - 1
+        return position >= 0 and document_id < self.ranges[position][1]
+
+    def __iter__(self):
+        for start, end in self.ranges:
+            if self.doc_id_type is int:
+                yield from range(start, end)
+            else:
+                yield from map(self.doc_id_type, range(start, end))
+
+    def __len__(self):
+        return sum(end - start for start, end in self.ranges)
@@ -0,0 +1,82 @@
+"""
+My Own Search Engine project.
+This script compares the time of the vectorial requests scored posting by
+posting (VectorialRequest), with numpy arrays (NumpyVectorialRequest) and
+document at a time with MaxScore (MaxScoreVectorialRequest) on the CS276
+index, and checks that they give the same ranking.
+
+Usage:
+    vectorial_benchmark.py [--queries=<filepath>] [--sample=<n>] [--terms=<n>] [--results=<len>]
+    vectorial_benchmark.py (-h | --help)
+
+Options:
+    -h --help                   Show this screen.
+    -q --queries=<filepath>     File with one request per line, instead of random requests.
+    -s --sample=<n>             Number of random requests [default: 50].
+    -t --terms=<n>              Max number of terms of a random request [default: 4].
+    -r --results=<len>          Number of results selected for each request [default: 10].
+
+"""
+from docopt import docopt
+
+import random
+from os import path
+from time import time
+
+from models.document import StanfordDocumentCollection
+from models.request import VectorialRequest, NumpyVectorialRequest, MaxScoreVectorialRequest
+from models.reverse_index import StanfordReverseIndex
+
+
+def get_requests(reverse_index, sample, max_terms):
+    # the seed gives the same requests from one run to another
+    random.seed(0)
+    terms = list(reverse_index.keys())
+    return [
+        ' '.join(random.sample(terms, random.randint(1, max_terms)))
+        for _ in range(sample)
+    ]
+
+
+def get_duration(request_class, requests, results):
+    durations = []
+    rankings = []
+    for raw_request in requests:
+        start_time = time()
+        _, top_results = request_class(reverse_index, collection).return_top_results(raw_request, results)
+        durations.append(time() - start_time)
+        rankings.append([doc_id for doc_id, _ in top_results])
+    return sum(durations) / len(durations), rankings
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+
+    print('Loading collection and index...')
+    collection = StanfordDocumentCollection()
+    collection.load_from_dir(path.join('Data', 'Collection', 'CS276'))
+    reverse_index = StanfordReverseIndex()
+    reverse_index.load_compact()
+    reverse_index.load_statistics()
+    if reverse_index.statistics is None:
+        raise SystemExit('No document statistics found for cs276, run build.py first.')
+
+    if args['--queries']:
+        with open(args['--queries'], 'r') as queries_file:
+            requests = [line.strip() for line in queries_file if line.strip()]
+    else:
+        requests = get_requests(reverse_index, int(args['--sample']), int(args['--terms']))
+
+    results = int(args['--results'])
+    python_duration, python_rankings = get_duration(VectorialRequest, requests, results)
+    print('| Scorer | Mean time per request (ms) | Speedup | Same ranking |')
+    print('| VectorialRequest | {:.2f} | 1.0x | - |'.format(python_duration * 1000))
+    for request_class in (NumpyVectorialRequest, MaxScoreVectorialRequest):
+        duration, rankings = get_duration(request_class, requests, results)
+        print('| {} | {:.2f} | {:.1f}x | {}/{} |'.format(
+            request_class.__name__,
+            duration * 1000,
+            python_duration / duration,
+            sum(python == other for python, other in zip(python_rankings, rankings)),
+            len(requests)
+        ))